@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+from id_mapper import IdMapper
+
+
+class RatingAggregates:
+    """Per-book rating aggregates plus catalog and global statistics.
+
+    Built once per data version from books_df/ratings_df. Arrays are indexed
+    by the book mapper, and add_ratings() folds new ratings in without
+    rescanning the ratings table. The popularity ranking is a pre-sorted
+    array that is only re-sorted on the first read after an update.
+    """
+
+    def __init__(self, books_df, ratings_df, book_mapper, user_mapper=None, min_count=5):
+        self.book_mapper = book_mapper
+        self.min_count = min_count
+        n_books = len(book_mapper)
+
+        # Per-book rating totals (ratings for books outside the catalog are skipped)
+        self.counts = np.zeros(n_books, dtype=np.int64)
+        self.sums = np.zeros(n_books, dtype=np.float64)
+
+        # Global rating stats (over every rating, as the old frame-wide calls were)
+        self.n_ratings = 0
+        self.rating_sum = 0.0
+        self.rating_min = None
+        self.rating_max = None
+        self.user_mapper = user_mapper if user_mapper is not None else IdMapper(ratings_df['user_id'])
+        self._popular_order = None
+
+        self._build_catalog_stats(books_df)
+        self._fold(ratings_df, new_users=False)
+
+    def _build_catalog_stats(self, books_df):
+        self.n_books = len(books_df)
+        self.n_authors = books_df['author'].nunique() if 'author' in books_df.columns else 0
+        self.genre_counts = books_df['genre'].value_counts() if 'genre' in books_df.columns else pd.Series(dtype=np.int64)
+        self.n_genres = len(self.genre_counts)
+
+        self.catalog_avg_rating = None
+        self.catalog_rating_counts = pd.Series(dtype=np.int64)
+        self.top_catalog_rows = np.zeros(0, dtype=np.int64)
+        if 'rating' in books_df.columns:
+            rating = books_df['rating'].to_numpy(dtype=np.float64)
+            self.catalog_avg_rating = float(np.nanmean(rating)) if len(rating) else None
+            self.catalog_rating_counts = books_df['rating'].value_counts().sort_index()
+            # Same rows as books_df.nlargest(10, 'rating') (ties keep catalog order)
+            self.top_catalog_rows = np.argsort(-rating, kind='stable')[:10]
+
+        self.year_min = self.year_max = None
+        if 'year' in books_df.columns and len(books_df):
+            self.year_min = int(books_df['year'].min())
+            self.year_max = int(books_df['year'].max())
+
+    def _fold(self, ratings, new_users=True):
+        """Add a frame of ratings to the running totals"""
+        if len(ratings) == 0:
+            return
+        values = ratings['rating'].to_numpy(dtype=np.float64)
+        idx = self.book_mapper.to_index(ratings['book_id'].to_numpy())
+        known = idx >= 0
+        self.counts += np.bincount(idx[known], minlength=len(self.counts))
+        self.sums += np.bincount(idx[known], weights=values[known], minlength=len(self.sums))
+
+        self.n_ratings += len(values)
+        self.rating_sum += float(values.sum())
+        lo, hi = float(values.min()), float(values.max())
+        self.rating_min = lo if self.rating_min is None else min(self.rating_min, lo)
+        self.rating_max = hi if self.rating_max is None else max(self.rating_max, hi)
+
+        if new_users:
+            user_ids = ratings['user_id'].to_numpy()
+            unseen = user_ids[self.user_mapper.to_index(user_ids) < 0]
+            if len(unseen):
+                self.user_mapper = IdMapper(np.concatenate([self.user_mapper.ids, unseen]))
+        self._popular_order = None
+
+    def add_ratings(self, ratings):
+        """Incrementally account for new ratings (a frame with user_id, book_id, rating)"""
+        self._fold(ratings)
+        return self
+
+    @property
+    def n_users(self):
+        return len(self.user_mapper)
+
+    @property
+    def avg_rating(self):
+        return self.rating_sum / self.n_ratings if self.n_ratings else None
+
+    @property
+    def means(self):
+        """Mean rating per book (NaN for unrated books)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+    @property
+    def weighted_scores(self):
+        """mean * log1p(count) for books with at least min_count ratings, else -inf"""
+        scores = np.full(len(self.counts), -np.inf)
+        eligible = self.counts >= self.min_count
+        scores[eligible] = self.sums[eligible] / self.counts[eligible] * np.log1p(self.counts[eligible])
+        return scores
+
+    def popular_order(self):
+        """Book indices of eligible books, most popular first"""
+        if self._popular_order is None:
+            scores = self.weighted_scores
+            order = np.argsort(-scores, kind='stable')
+            self._popular_order = order[np.isfinite(scores[order])]
+        return self._popular_order
+
+    def most_popular(self, n=5):
+        """(book_ids, mean ratings, rating counts) of the top-n weighted-popularity books"""
+        idx = self.popular_order()[:n]
+        return self.book_mapper.to_id(idx), self.sums[idx] / self.counts[idx], self.counts[idx]
+
+    def top_rated(self, n=3):
+        """(book_ids, mean ratings) of the books with the highest mean rating"""
+        means = self.means
+        rated = np.flatnonzero(self.counts > 0)
+        idx = rated[np.argsort(-means[rated], kind='stable')[:n]]
+        return self.book_mapper.to_id(idx), means[idx]
+
+
+class SegmentedPopularity:
+    """Top-N popularity lists per genre, author and publication-year bucket.
+
+    Books are scored with a Bayesian average, (C * m + sum) / (C + count),
+    which shrinks thinly-rated books toward the global mean m instead of
+    dropping them at a hard count threshold. If ratings carry a 'timestamp'
+    column (unix seconds) and half_life_days is set, each rating's weight
+    halves every half_life_days, so recent activity counts for more.
+
+    All lists are stored in one int array of book indices plus per-segment
+    offsets, so a preference query is a few slices and one small sort.
+    """
+
+    def __init__(self, books_df, ratings_df, book_mapper, prior_weight=5.0,
+                 half_life_days=None, top_n=50, now=None):
+        self.book_mapper = book_mapper
+        self.prior_weight = prior_weight
+        self.half_life_days = half_life_days
+        self.top_n = top_n
+        self._score_books(ratings_df, now)
+        self._build_segments(books_df)
+
+    def _score_books(self, ratings_df, now):
+        values = ratings_df['rating'].to_numpy(dtype=np.float64)
+        idx = self.book_mapper.to_index(ratings_df['book_id'].to_numpy())
+        known = idx >= 0
+        idx, values = idx[known], values[known]
+
+        weights = np.ones(len(values))
+        if self.half_life_days and 'timestamp' in ratings_df.columns:
+            stamps = ratings_df['timestamp'].to_numpy(dtype=np.float64)[known]
+            now = stamps.max() if now is None else now
+            age_days = np.maximum(now - stamps, 0) / 86400.0
+            weights = np.exp2(-age_days / self.half_life_days)
+
+        n_books = len(self.book_mapper)
+        self.counts = np.bincount(idx, weights=weights, minlength=n_books)
+        sums = np.bincount(idx, weights=weights * values, minlength=n_books)
+        self.global_mean = sums.sum() / self.counts.sum() if self.counts.sum() else 0.0
+        C = self.prior_weight
+        self.scores = (C * self.global_mean + sums) / (C + self.counts)
+
+        # Books nobody rated sit below every rated book
+        self.scores[self.counts == 0] = -np.inf
+        self.order = np.argsort(-self.scores, kind='stable')
+
+    def _build_segments(self, books_df):
+        """Concatenated top-N lists: segment kind -> {value: (start, stop)}"""
+        rows_idx = self.book_mapper.to_index(books_df['book_id'].to_numpy())
+        columns = {}
+        if 'genre' in books_df.columns:
+            columns['genre'] = books_df['genre'].to_numpy()
+        if 'author' in books_df.columns:
+            columns['author'] = books_df['author'].to_numpy()
+        if 'year' in books_df.columns:
+            # Books with a missing year get no decade segment (NaN would cast to garbage)
+            years = pd.to_numeric(books_df['year'], errors='coerce').to_numpy(dtype=np.float64)
+            known = np.isfinite(years)
+            decades = np.full(len(years), None, dtype=object)
+            decades[known] = (years[known] // 10 * 10).astype(np.int64)
+            columns['decade'] = decades
+
+        rank = np.empty(len(self.order), dtype=np.int64)
+        rank[self.order] = np.arange(len(self.order))
+        rated = self.counts[rows_idx] > 0
+
+        lists, offset = [], 0
+        self.segments = {}
+        for kind, column in columns.items():
+            codes, values = pd.factorize(column[rated])
+            book_idx = rows_idx[rated]
+            # Group by segment, best-ranked first within each group
+            grouped = np.lexsort((rank[book_idx], codes))
+            codes, book_idx = codes[grouped], book_idx[grouped]
+            starts = np.searchsorted(codes, np.arange(len(values)))
+            stops = np.append(starts[1:], len(codes))
+
+            self.segments[kind] = {}
+            for value, start, stop in zip(values, starts, stops):
+                top = book_idx[start:min(stop, start + self.top_n)]
+                lists.append(top)
+                self.segments[kind][value] = (offset, offset + len(top))
+                offset += len(top)
+        self.book_lists = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int64)
+
+    def values(self, kind):
+        """Sorted segment values of a kind ('genre', 'author' or 'decade')"""
+        return sorted(self.segments.get(kind, {}))
+
+    def top(self, kind, value, n=10):
+        """(book_ids, scores) of the most popular books in one segment"""
+        start, stop = self.segments.get(kind, {}).get(value, (0, 0))
+        idx = self.book_lists[start:min(stop, start + n)]
+        return self.book_mapper.to_id(idx), self.scores[idx]
+
+    def recommend(self, genres=(), authors=(), decades=(), n=10, exclude=()):
+        """Most popular books matching any of the given preferences.
+
+        Books matching more of the preferences come first, then by score.
+        With no preferences this is the global popularity list.
+        """
+        wanted = [('genre', genres), ('author', authors), ('decade', decades)]
+        parts = []
+        for kind, values in wanted:
+            for value in values:
+                start, stop = self.segments.get(kind, {}).get(value, (0, 0))
+                parts.append(self.book_lists[start:stop])
+
+        if not parts:
+            candidates, matches = self.order[np.isfinite(self.scores[self.order])], None
+        else:
+            candidates, matches = np.unique(np.concatenate(parts), return_counts=True)
+
+        if len(exclude):
+            keep = ~np.isin(candidates, self.book_mapper.to_index(np.asarray(exclude)))
+            candidates = candidates[keep]
+            matches = matches[keep] if matches is not None else None
+
+        if matches is not None:
+            ranking = np.lexsort((-self.scores[candidates], -matches))
+            candidates = candidates[ranking]
+        candidates = candidates[:n]
+        return self.book_mapper.to_id(candidates), self.scores[candidates]
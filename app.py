@@ -1,17 +1,48 @@
 import os
 import sys
-from data_loader import DataLoader
-from collaborative_filtering import CollaborativeFiltering
-from content_based import ContentBasedFiltering
-from hybrid_recommender import HybridRecommender
+import time
 import pandas as pd
+from cooccurrence import CooccurrenceEngine
+from data_loader import DataLoader
+from event_log import RatingEventLog, DEFAULT_LOG_PATH
+from factorization import FactorizationError
+import instrumentation
+from precision import PrecisionPolicy
+from results import RecommendationBlock
+from scheduler import ModelHandle, RetrainScheduler, build_models
+
+# Fitted content features are cached here so later runs skip scikit-learn
+ARTIFACTS_DIR = 'artifacts'
+CONTENT_FEATURES_PATH = os.path.join(ARTIFACTS_DIR, 'content_features.npz')
+
+# Models are retrained in the background after this many new ratings,
+# or on this timer while any are pending
+RETRAIN_MIN_RATINGS = 50
+RETRAIN_INTERVAL_SECONDS = 300
+
+# "Readers also liked" lists are seeded from this many of the latest ratings,
+# then updated with every new rating
+COOCCURRENCE_SEED_RATINGS = 50000
 
 class BookRecommendationSystem:
     def __init__(self):
-        self.data_loader = DataLoader()
+        # KITAB_DATA_BACKEND=sqlite keeps ratings in data/kitab.db instead of memory
+        self.data_loader = DataLoader.from_env()
         self.cf = None
         self.cbf = None
         self.hybrid = None
+        self.models = None
+        self.scheduler = None
+        self.event_log = None
+        self.cooccurrence = None
+        
+    def use_current_models(self):
+        """Point this session at the latest model snapshot (once per menu action)"""
+        snapshot = self.models.get()
+        self.data_loader = snapshot.data_loader
+        self.cf = snapshot.cf
+        self.cbf = snapshot.cbf
+        self.hybrid = snapshot.hybrid
         
     def initialize(self):
         """Initialize the recommendation system"""
@@ -19,22 +50,35 @@ class BookRecommendationSystem:
         print("BOOK RECOMMENDATION SYSTEM")
         print("=" * 50)
         
-        # Load data
-        if not self.data_loader.load_data():
+        # Load data (ratings.csv or its compacted snapshot, plus the rating event log)
+        if not self.data_loader.load_data(log_path=DEFAULT_LOG_PATH):
             print("Error: Could not load data files.")
             print("Please run sample_data_generator.py first.")
             return False
         
-        # Create user-item matrix
-        user_item_matrix = self.data_loader.create_user_item_matrix()
-        
-        # Initialize recommender systems
-        self.cf = CollaborativeFiltering(user_item_matrix)
-        self.cbf = ContentBasedFiltering(self.data_loader.books_df)
-        self.hybrid = HybridRecommender(self.cf, self.cbf, self.data_loader)
+        # Fit every model up front; later retrains run in the background
+        # (KITAB_PRECISION selects the dtype policy)
+        precision = PrecisionPolicy.from_env()
+        self.cooccurrence = CooccurrenceEngine()
+        self.cooccurrence.consume(self.data_loader.get_recent_ratings(COOCCURRENCE_SEED_RATINGS))
+        try:
+            self.models = ModelHandle(build_models(
+                self.data_loader, precision=precision, artifact_path=CONTENT_FEATURES_PATH,
+                cooccurrence=self.cooccurrence
+            ))
+        except FactorizationError as e:
+            print(f"Error: could not fit the models: {e}")
+            return False
+        self.event_log = RatingEventLog(DEFAULT_LOG_PATH)
+        self.scheduler = RetrainScheduler(
+            self.models, min_new_ratings=RETRAIN_MIN_RATINGS, interval_seconds=RETRAIN_INTERVAL_SECONDS,
+            precision=precision, artifact_path=CONTENT_FEATURES_PATH, event_log=self.event_log,
+            cooccurrence=self.cooccurrence
+        ).start()
+        self.use_current_models()
         
         print("System initialized successfully!")
-        print(f"Number of users: {len(user_item_matrix)}")
+        print(f"Number of users: {len(self.data_loader.user_mapper)}")
         print(f"Number of books: {len(self.data_loader.books_df)}")
         return True
     
@@ -65,39 +109,48 @@ class BookRecommendationSystem:
     
     def collaborative_recommendations(self, user_id):
         """Generate collaborative filtering recommendations"""
+        if user_id not in self.data_loader.user_mapper:
+            print(f"No ratings found for user {user_id}")
+            return
+        
         print(f"\n Collaborative Filtering Recommendations for User {user_id}:")
         
         # User-based recommendations
-        indices, scores = self.cf.user_based_recommendations(user_id, 3)
+        book_ids, scores = self.cf.user_based_recommendations(user_id, 3)
         print("\n   User-Based Recommendations:")
-        for idx, score in zip(indices, scores):
-            book_id = idx + 1
-            book_info = self.data_loader.get_book_info(book_id)
-            if book_info:
-                print(f"   - {book_info['title']} (Score: {score:.3f})")
+        for rec in RecommendationBlock.from_arrays(book_ids, scores, user_id, self.data_loader):
+            print(f"   - {rec['title']} (Score: {rec['score']:.3f})")
         
         # Item-based recommendations
-        indices, scores = self.cf.item_based_recommendations(user_id, 3)
+        book_ids, scores = self.cf.item_based_recommendations(user_id, 3)
         print("\n   Item-Based Recommendations:")
-        for idx, score in zip(indices, scores):
-            book_id = idx + 1
-            book_info = self.data_loader.get_book_info(book_id)
-            if book_info:
-                print(f"   - {book_info['title']} (Score: {score:.3f})")
+        for rec in RecommendationBlock.from_arrays(book_ids, scores, user_id, self.data_loader):
+            print(f"   - {rec['title']} (Score: {rec['score']:.3f})")
     
     def content_based_recommendations(self, book_id):
         """Generate content-based recommendations"""
         print(f"\n Content-Based Recommendations similar to Book {book_id}:")
         
-        indices, scores = self.cbf.get_similar_books(book_id, 5)
-        for idx, score in zip(indices, scores):
-            book_id = idx + 1
-            book_info = self.data_loader.get_book_info(book_id)
-            if book_info:
-                print(f"   - {book_info['title']} (Similarity: {score:.3f})")
+        if book_id not in self.data_loader.book_mapper:
+            print(f"Book with ID {book_id} not found.")
+            return
+        
+        book_ids, scores = self.cbf.get_similar_books(book_id, 5)
+        for rec in RecommendationBlock.from_arrays(book_ids, scores, data_loader=self.data_loader):
+            print(f"   - {rec['title']} (Similarity: {rec['score']:.3f})")
+        
+        book_ids, scores = self.cooccurrence.also_liked(book_id, 5)
+        if len(book_ids):
+            print("\n   Readers Also Liked:")
+            for rec in RecommendationBlock.from_arrays(book_ids, scores, data_loader=self.data_loader):
+                print(f"   - {rec['title']} (Score: {rec['score']:.3f})")
     
     def hybrid_recommendations(self, user_id):
         """Generate hybrid recommendations"""
+        if user_id not in self.data_loader.user_mapper:
+            print(f"No ratings found for user {user_id}; try the cold start recommendations.")
+            return
+        
         print(f"\n Hybrid Recommendations for User {user_id}:")
         
         recommendations = self.hybrid.hybrid_recommendations(user_id, 5)
@@ -116,12 +169,41 @@ class BookRecommendationSystem:
             print(f"      Author: {rec['author']}, Genre: {rec['genre']}")
             print(f"      Avg Rating: {rec['avg_rating']}/5 ({rec['rating_count']} ratings)")
     
+    def search_books(self, query, limit=10):
+        """Search the catalog by title/author word prefixes"""
+        search_index = self.data_loader.get_search_index()
+        total, rows = search_index.search(query, limit=limit)
+        print(f"\n Found {total} books matching '{query}':")
+        for _, book in self.data_loader.books_df.iloc[rows].iterrows():
+            print(f"   [{book['book_id']}] {book['title']} by {book['author']} (Rating: {book['rating']})")
+        if total > limit:
+            print(f"   ... and {total - limit} more")
+    
+    def rate_book(self, user_id, book_id, rating):
+        """Log a rating durably; the models pick it up at the next background retrain"""
+        if book_id not in self.data_loader.book_mapper:
+            print(f"Book with ID {book_id} not found.")
+            return
+        if not 1 <= rating <= 5:
+            print("Rating must be between 1 and 5.")
+            return
+        
+        rating_df = pd.DataFrame({'user_id': [user_id], 'book_id': [book_id], 'rating': [rating],
+                                  'timestamp': [time.time()]})
+        self.event_log.append_frame(rating_df)
+        self.event_log.flush()
+        n_pending = self.scheduler.add_ratings(rating_df)
+        print(f"Rating saved. {n_pending} new rating(s) waiting for the next model update "
+              f"(retrains after {self.scheduler.min_new_ratings} or every {RETRAIN_INTERVAL_SECONDS // 60} minutes).")
+    
     def run(self):
         """Main application loop"""
         if not self.initialize():
             return
         
         while True:
+            # Each action runs against one snapshot, even if a retrain lands meanwhile
+            self.use_current_models()
             print("\n" + "=" * 50)
             print("MAIN MENU")
             print("=" * 50)
@@ -132,9 +214,11 @@ class BookRecommendationSystem:
             print("5. Get Hybrid Recommendations")
             print("6. Get Cold Start Recommendations")
             print("7. View Sample Data Statistics")
-            print("8. Exit")
+            print("8. Search Books")
+            print("9. Rate a Book")
+            print("10. Exit")
             
-            choice = input("\nEnter your choice (1-8): ").strip()
+            choice = input("\nEnter your choice (1-10): ").strip()
             
             if choice == '1':
                 try:
@@ -180,44 +264,72 @@ class BookRecommendationSystem:
                 self.display_statistics()
             
             elif choice == '8':
+                query = input("Search title or author: ").strip()
+                self.search_books(query)
+            
+            elif choice == '9':
+                try:
+                    user_id = int(input("Enter User ID: "))
+                    book_id = int(input("Enter Book ID: "))
+                    rating = float(input("Enter Rating (1-5): "))
+                    self.rate_book(user_id, book_id, rating)
+                except ValueError:
+                    print("Please enter a valid number.")
+            
+            elif choice == '10':
+                self.scheduler.stop()
+                self.event_log.close()
                 print("Thank you for using the Book Recommendation System!")
                 break
             
             else:
-                print("Invalid choice. Please enter a number between 1 and 8.")
+                print("Invalid choice. Please enter a number between 1 and 10.")
     
     def display_statistics(self):
         """Display data statistics"""
         print("\n DATA STATISTICS:")
-        print(f"   Total Books: {len(self.data_loader.books_df)}")
-        print(f"   Total Ratings: {len(self.data_loader.ratings_df)}")
-        print(f"   Total Users: {self.data_loader.user_item_matrix.shape[0]}")
+        aggregates = self.data_loader.get_aggregates()
+        print(f"   Total Books: {aggregates.n_books}")
+        print(f"   Total Ratings: {aggregates.n_ratings}")
+        print(f"   Total Users: {aggregates.n_users}")
         
         # Average rating
-        avg_rating = self.data_loader.ratings_df['rating'].mean()
+        avg_rating = aggregates.avg_rating
         print(f"   Average Rating: {avg_rating:.2f}/5")
         
         # Most popular genres
-        genre_counts = self.data_loader.books_df['genre'].value_counts()
+        genre_counts = aggregates.genre_counts
         print(f"\n    Books by Genre:")
         for genre, count in genre_counts.head().items():
             print(f"      {genre}: {count} books")
         
         # Top rated books
-        book_ratings = self.data_loader.ratings_df.groupby('book_id')['rating'].mean()
-        top_books = book_ratings.sort_values(ascending=False).head(3)
+        top_ids, top_ratings = aggregates.top_rated(3)
         
         print(f"\n    Top Rated Books:")
-        for book_id, rating in top_books.items():
+        for book_id, rating in zip(top_ids, top_ratings):
             book_info = self.data_loader.get_book_info(book_id)
             if book_info:
                 print(f"      {book_info['title']}: {rating:.2f}/5")
+        
+        # Model freshness
+        status = self.scheduler.status()
+        print(f"\n    Model Version: {status['version']} "
+              f"({status['pending_ratings']} new ratings pending)")
+        if status['last_error']:
+            print(f"      Last retrain failed: {status['last_error']}")
+        
+        # Instrumentation counters (only when enabled)
+        if instrumentation.is_enabled():
+            print(f"\n    Performance Counters:")
+            print(instrumentation.REGISTRY.to_prometheus())
 
 def main():
     """Main function"""
     # Create data directory if it doesn't exist
     os.makedirs('data', exist_ok=True)
     os.makedirs('src', exist_ok=True)
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
     
     # Check if data exists
     if not (os.path.exists('data/books.csv') and os.path.exists('data/ratings.csv')):
@@ -225,6 +337,9 @@ def main():
         from sample_data_generator import generate_sample_data
         generate_sample_data()
     
+    # Opt-in profiling (KITAB_INSTRUMENT=1)
+    instrumentation.enable_from_env()
+    
     # Run the recommendation system
     system = BookRecommendationSystem()
     system.run()
@@ -0,0 +1,692 @@
+"""Benchmarks and budget checks for the recommender modules.
+
+Usage:
+    python benchmark.py imports        # import-time budget (exit 1 on failure)
+    python benchmark.py precision      # memory vs. recommendation overlap per dtype policy
+    python benchmark.py features       # TF-IDF vs. hashed content features (time, peak memory)
+    python benchmark.py quality        # offline precision/recall/NDCG/RMSE on a seeded split
+    python benchmark.py svd            # randomized (cold/warm) vs. ARPACK truncated SVD
+    python benchmark.py eventlog       # rating log append rate per fsync batch, compaction, base + tail load
+    python benchmark.py sqlite         # pandas vs. SQLite DataLoader lookup latency and memory
+    python benchmark.py sharding       # item-sharded scatter-gather vs. single-process latency and agreement
+    python benchmark.py cooccurrence   # streaming co-occurrence update cost per catalog size, sketch error
+    python benchmark.py all --json out.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# =========================
+# Shared helpers
+# =========================
+GENRES = ['Fiction', 'Non-Fiction', 'Mystery', 'Sci-Fi', 'Romance', 'Biography', 'Self-Help']
+WORDS = ['love', 'night', 'city', 'secret', 'river', 'storm', 'garden', 'shadow', 'empire',
+         'journey', 'heart', 'stars', 'code', 'mind', 'winter', 'fire', 'silent', 'lost']
+
+
+def synthetic_loader(n_users=1000, n_books=2000, ratings_per_user=30, seed=42):
+    """DataLoader filled with random books/ratings of the given size"""
+    import pandas as pd
+    from data_loader import DataLoader
+
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS)
+    titles = [' '.join(rng.choice(words, 3)).title() for _ in range(n_books)]
+    books_df = pd.DataFrame({
+        'book_id': np.arange(1, n_books + 1),
+        'title': titles,
+        'author': [f'Author {a}' for a in rng.integers(0, max(1, n_books // 20), n_books)],
+        'genre': rng.choice(GENRES, n_books),
+        'year': rng.integers(1950, 2024, n_books),
+        'rating': np.round(rng.uniform(3.0, 5.0, n_books), 1),
+    })
+
+    # Zipf-ish item popularity so neighbourhoods are not uniform noise
+    popularity = 1.0 / np.arange(1, n_books + 1) ** 0.8
+    popularity /= popularity.sum()
+    per_user = min(ratings_per_user, n_books)
+    user_ids = np.repeat(np.arange(1, n_users + 1), per_user)
+    book_ids = np.concatenate([
+        rng.choice(n_books, per_user, replace=False, p=popularity) + 1 for _ in range(n_users)
+    ])
+    ratings_df = pd.DataFrame({
+        'user_id': user_ids,
+        'book_id': book_ids,
+        'rating': rng.integers(1, 6, len(user_ids)),
+    })
+
+    loader = DataLoader()
+    loader.books_df = books_df
+    loader.ratings_df = ratings_df
+    loader.build_id_mappers()
+    loader.create_user_item_matrix()
+    return loader
+
+
+def overlap(a, b):
+    """Fraction of items in list b that also appear in list a"""
+    return len(set(map(int, a)) & set(map(int, b))) / max(1, len(b))
+
+
+def tie_aware_overlap(a, a_scores, b, b_scores, tol=1e-3):
+    """Like overlap(), but items of b scoring within tol of a's cut-off also count.
+
+    Many predicted ratings tie exactly (e.g. 5.0 from a single neighbour), so
+    which tied items make the top N is arbitrary and not a precision loss.
+    """
+    if len(b) == 0:
+        return 1.0
+    cutoff = float(np.min(a_scores)) - tol if len(a_scores) else float('inf')
+    members = set(map(int, a))
+    hits = sum(1 for item, score in zip(b, b_scores) if int(item) in members or score >= cutoff)
+    return hits / len(b)
+
+
+# =========================
+# Import-time budget
+# =========================
+IMPORT_BUDGET_MS = 500
+LAZY_MODULES = ('collaborative_filtering', 'content_based')
+FORBIDDEN_AT_IMPORT = ('sklearn', 'scipy.sparse.linalg', 'pandas')
+
+
+def parse_importtime(stderr):
+    """Parse `python -X importtime` output into {module: (self_us, cumulative_us, depth)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name[1:]  # drop the separator space, keep the depth indent
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def _run_python(code):
+    return subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+
+def check_import_budget(modules=LAZY_MODULES, budget_ms=IMPORT_BUDGET_MS,
+                        forbidden=FORBIDDEN_AT_IMPORT):
+    """Import the modules in a fresh interpreter and check time and heavy deps"""
+    proc = _run_python('import ' + ', '.join(modules))
+    timings = parse_importtime(proc.stderr)
+    total_us = sum(timings[m][1] for m in modules if m in timings)
+    loaded = [m for m in forbidden if m in timings]
+    return {
+        'modules': list(modules),
+        'total_ms': total_us / 1000,
+        'budget_ms': budget_ms,
+        'forbidden_loaded': loaded,
+        'ok': total_us / 1000 <= budget_ms and not loaded,
+    }
+
+
+def check_cli_startup(forbidden=('sklearn',)):
+    """Initialise the CLI up to its menu and report which heavy deps were loaded.
+
+    A warm-up run goes first: on a clean checkout it fits and caches the
+    content features, so the measured run does not depend on leftover state.
+    """
+    code = (
+        'import contextlib, io, json, sys, app\n'
+        'with contextlib.redirect_stdout(io.StringIO()):\n'
+        '    ok = app.BookRecommendationSystem().initialize()\n'
+        f'print(json.dumps({{"initialized": ok, "loaded": [m for m in {list(forbidden)!r} if m in sys.modules]}}))\n'
+    )
+    _run_python(code)
+    proc = _run_python(code)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['ok'] = result['initialized'] and not result['loaded']
+    return result
+
+
+def bench_imports(args):
+    results = {
+        'import_budget': check_import_budget(budget_ms=args.import_budget_ms),
+        'cli_startup': check_cli_startup(),
+    }
+    budget = results['import_budget']
+    print(f"Import {', '.join(budget['modules'])}: {budget['total_ms']:.1f} ms "
+          f"(budget {budget['budget_ms']} ms)")
+    if budget['forbidden_loaded']:
+        print(f"   Loaded at import time: {', '.join(budget['forbidden_loaded'])}")
+    startup = results['cli_startup']
+    print(f"CLI startup loads: {', '.join(startup['loaded']) or 'no heavy dependencies'}")
+    return results
+
+
+# =========================
+# Precision policies
+# =========================
+def bench_precision(args, policies=('full', 'compact', 'quantized'), n_recommendations=10):
+    """Model memory and top-N overlap with the float64 baseline for each policy"""
+    from collaborative_filtering import CollaborativeFiltering
+    from content_based import ContentBasedFiltering
+    from instrumentation import allocated_bytes
+    from precision import PrecisionPolicy
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(loader.user_mapper.ids, min(args.sample, len(loader.user_mapper)), replace=False)
+    books = rng.choice(loader.book_mapper.ids, min(args.sample, len(loader.book_mapper)), replace=False)
+
+    results = {}
+    baseline = None
+    for name in policies:
+        policy = PrecisionPolicy.from_name(name)
+        t0 = time.perf_counter()
+        cf = CollaborativeFiltering(loader.user_item_matrix, loader.user_mapper, loader.book_mapper,
+                                    precision=policy)
+        cbf = ContentBasedFiltering(loader.books_df, book_mapper=loader.book_mapper, precision=policy)
+        cf.calculate_user_similarity()
+        cf.calculate_item_similarity()
+        cf.matrix_factorization()
+        cbf.prepare_features()
+        build_seconds = time.perf_counter() - t0
+
+        recs = {
+            'user_based': [cf.user_based_recommendations(u, n_recommendations) for u in users],
+            'item_based': [cf.item_based_recommendations(u, n_recommendations) for u in users],
+            'mf': [cf.mf_recommendations(u, n_recommendations) for u in users],
+            'content': [cbf.get_similar_books(b, n_recommendations) for b in books],
+        }
+        memory = {
+            'ratings': allocated_bytes(cf.user_item_matrix),
+            'user_similarity': allocated_bytes(cf.user_similarity),
+            'item_similarity': allocated_bytes(cf.item_similarity),
+            'mf_factors': allocated_bytes(cf.user_factors) + allocated_bytes(cf.item_factors),
+            'content_features': allocated_bytes(cbf.feature_vectors),
+            'content_similarity': allocated_bytes(cbf.content_similarity),
+        }
+        if baseline is None:
+            baseline = recs
+
+        results[name] = {
+            'policy': repr(policy),
+            'build_seconds': build_seconds,
+            'memory_bytes': memory,
+            'total_bytes': sum(memory.values()),
+            'overlap_at_n': {
+                method: float(np.mean([overlap(a[0], b[0]) for a, b in zip(baseline[method], lists)]))
+                for method, lists in recs.items()
+            },
+            'tie_aware_overlap_at_n': {
+                method: float(np.mean([tie_aware_overlap(a[0], a[1], b[0], b[1])
+                                       for a, b in zip(baseline[method], lists)]))
+                for method, lists in recs.items()
+            },
+        }
+
+    full_bytes = results[policies[0]]['total_bytes']
+    print(f"{'policy':<10} {'memory MB':>10} {'vs full':>8} {'build s':>8}  "
+          f"overlap@{n_recommendations} (tie-aware)")
+    for name, res in results.items():
+        ov = ', '.join(f"{k}={v:.3f} ({res['tie_aware_overlap_at_n'][k]:.3f})"
+                       for k, v in res['overlap_at_n'].items())
+        print(f"{name:<10} {res['total_bytes'] / 1e6:>10.1f} {res['total_bytes'] / full_bytes:>8.2f} "
+              f"{res['build_seconds']:>8.2f}  {ov}")
+    return results
+
+
+# =========================
+# Content feature pipelines
+# =========================
+def bench_features(args, n_recommendations=10):
+    """Build time, model size and neighbour overlap of TF-IDF vs. hashed features"""
+    import pickle
+    from content_based import ContentBasedFiltering
+    from instrumentation import allocated_bytes
+    from similarity import l2_normalize_rows
+    import sklearn.feature_extraction.text  # noqa: F401  keep import time out of the timings
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    rng = np.random.default_rng(args.seed)
+    books = rng.choice(loader.book_mapper.ids, min(args.sample, len(loader.book_mapper)), replace=False)
+
+    variants = {
+        'tfidf': dict(feature_mode='tfidf'),
+        'hashing': dict(feature_mode='hashing', chunk_size=max(1, args.books // 8)),
+        f'hashing_x{args.workers}': dict(feature_mode='hashing', chunk_size=max(1, args.books // 8),
+                                         n_workers=args.workers),
+    }
+
+    results = {}
+    baseline = None
+    for name, options in variants.items():
+        cbf = ContentBasedFiltering(loader.books_df, book_mapper=loader.book_mapper, **options)
+        t0 = time.perf_counter()
+        cbf.build_features()
+        build_seconds = time.perf_counter() - t0
+
+        # Second build under tracemalloc for peak memory (numpy reports its buffers)
+        columns = list(loader.books_df.columns)
+        tracemalloc.start()
+        cbf.build_features()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if list(loader.books_df.columns) != columns:
+            raise RuntimeError(f"{name}: build_features modified the caller's books_df")
+
+        # Neighbours of the sampled books only (no n x n similarity matrix)
+        normalized = l2_normalize_rows(cbf.feature_vectors)
+        rows = loader.book_mapper.to_index(books)
+        scores = (normalized[rows] @ normalized.T).toarray()
+        scores[np.arange(len(rows)), rows] = -np.inf
+        neighbours = np.argsort(-scores, axis=1, kind='stable')[:, :n_recommendations]
+        if baseline is None:
+            baseline = neighbours
+        results[name] = {
+            'build_seconds': build_seconds,
+            'peak_build_bytes': peak_bytes,
+            'model_bytes': len(pickle.dumps(cbf.vectorizer)),
+            'feature_bytes': allocated_bytes(cbf.feature_vectors),
+            'neighbour_overlap': float(np.mean([overlap(a, b) for a, b in zip(baseline, neighbours)])),
+        }
+
+    print(f"{'mode':<12} {'build s':>8} {'peak MB':>8} {'model KB':>10} {'features KB':>12} {'overlap':>8}")
+    for name, res in results.items():
+        print(f"{name:<12} {res['build_seconds']:>8.3f} {res['peak_build_bytes'] / 1e6:>8.1f} "
+              f"{res['model_bytes'] / 1e3:>10.1f} "
+              f"{res['feature_bytes'] / 1e3:>12.1f} {res['neighbour_overlap']:>8.3f}")
+    return results
+
+
+# =========================
+# Recommendation quality
+# =========================
+def bench_quality(args, k=10):
+    """Offline metrics on a seeded leave-k-out split, tracked next to the latency numbers"""
+    from evaluation import evaluate, print_report
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    results = evaluate(loader.books_df, loader.ratings_df, split='leave_k_out', k=k, seed=args.seed,
+                       n_workers=args.workers, max_users=args.sample)
+    print_report(results)
+    return results
+
+
+# =========================
+# Truncated SVD solvers
+# =========================
+def bench_svd(args, n_factors=15, n_recommendations=10, new_fraction=0.01):
+    """Fit time, residual and MF top-N overlap of randomized SVD (cold and warm) vs. svds"""
+    import pandas as pd
+    from collaborative_filtering import CollaborativeFiltering
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(loader.user_mapper.ids, min(args.sample, len(loader.user_mapper)), replace=False)
+
+    def fit(solver, **options):
+        cf = CollaborativeFiltering(loader.user_item_matrix, loader.user_mapper, loader.book_mapper)
+        cf.matrix_factorization(n_factors, solver=solver, seed=args.seed, **options)
+        return cf
+
+    def mf_overlap(cf, baseline):
+        return float(np.mean([overlap(baseline.mf_recommendations(u, n_recommendations)[0],
+                                      cf.mf_recommendations(u, n_recommendations)[0])
+                              for u in users]))
+
+    results = {}
+
+    def record(name, cf, baseline):
+        info = cf.factorization_info
+        results[name] = {
+            'seconds': info['seconds'],
+            'iterations': info['iterations'],
+            'relative_residual': info['relative_residual'],
+            'mf_overlap': mf_overlap(cf, baseline),
+        }
+
+    reference = fit('svds')
+    model = fit('randomized')
+    record('svds', reference, reference)
+    record('randomized_cold', model, reference)
+
+    # Warm restart: append ~1% new ratings and refit the same model from its previous basis
+    n_new = max(1, int(len(loader.ratings_df) * new_fraction))
+    new = pd.DataFrame({
+        'user_id': rng.choice(loader.user_mapper.ids, n_new),
+        'book_id': rng.choice(loader.book_mapper.ids, n_new),
+        'rating': rng.integers(1, 6, n_new),
+    })
+    loader.ratings_df = pd.concat([loader.ratings_df, new], ignore_index=True)
+    loader.build_id_mappers()
+    loader.create_user_item_matrix()
+
+    reference = fit('svds')
+    record('svds_updated', reference, reference)
+    record('randomized_refit_cold', fit('randomized'), reference)
+    model.user_item_matrix = loader.user_item_matrix
+    model.matrix_factorization(n_factors, seed=args.seed)
+    record('randomized_refit_warm', model, reference)
+
+    print(f"{'solver':<22} {'seconds':>8} {'iters':>6} {'residual':>9} "
+          f"{'overlap@' + str(n_recommendations):>10}")
+    for name, res in results.items():
+        iterations = res['iterations'] if res['iterations'] is not None else '-'
+        print(f"{name:<22} {res['seconds']:>8.3f} {iterations:>6} {res['relative_residual']:>9.4f} "
+              f"{res['mf_overlap']:>10.3f}")
+    return results
+
+
+# =========================
+# Rating event log
+# =========================
+def bench_eventlog(args, batch_sizes=(1, 64, 1024), n_appends=20000):
+    """Append throughput per fsync batch size, then compaction and base + tail load times"""
+    import shutil
+    import tempfile
+    import pandas as pd
+    from event_log import RatingEventLog, load_ratings
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(loader.user_mapper.ids, n_appends)
+    books = rng.choice(loader.book_mapper.ids, n_appends)
+    ratings = rng.integers(1, 6, n_appends).astype(np.float32)
+
+    directory = tempfile.mkdtemp()
+    try:
+        ratings_path = os.path.join(directory, 'ratings.csv')
+        loader.ratings_df.to_csv(ratings_path, index=False)
+
+        results = {'append': {}}
+        for batch_size in batch_sizes:
+            path = os.path.join(directory, f'batch{batch_size}.log')
+            log = RatingEventLog(path, batch_size=batch_size, flush_interval=None)
+            # Unbatched fsyncs are slow; a smaller sample keeps the run short
+            n = min(n_appends, 2000) if batch_size == 1 else n_appends
+            t0 = time.perf_counter()
+            for i in range(n):
+                log.append(users[i], books[i], ratings[i])
+            log.flush()
+            seconds = time.perf_counter() - t0
+            results['append'][batch_size] = {'records': n, 'records_per_second': n / seconds,
+                                             'fsyncs': log.n_fsyncs}
+            log.close()
+
+        log_path = os.path.join(directory, 'ratings.log')
+        log = RatingEventLog(log_path, flush_interval=None)
+        t0 = time.perf_counter()
+        log.append_many(users, books, ratings)
+        log.flush()
+        results['append_many_records_per_second'] = n_appends / (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        pd.read_csv(ratings_path)
+        results['csv_load_seconds'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        n_rows = len(load_ratings(ratings_path, log_path)[0])
+        results['base_tail_load_seconds'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        log.compact(ratings_path)
+        results['compact_seconds'] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        load_ratings(ratings_path, log_path)
+        results['compacted_load_seconds'] = time.perf_counter() - t0
+        results['ratings'] = n_rows
+        log.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"{'fsync batch':>11} {'records/s':>11} {'fsyncs':>7}")
+    for batch_size, res in results['append'].items():
+        print(f"{batch_size:>11} {res['records_per_second']:>11,.0f} {res['fsyncs']:>7}")
+    print(f"append_many: {results['append_many_records_per_second']:,.0f} records/s")
+    print(f"{results['ratings']} ratings: CSV load {results['csv_load_seconds']:.3f} s, "
+          f"CSV + {n_appends} logged {results['base_tail_load_seconds']:.3f} s, "
+          f"compact {results['compact_seconds']:.3f} s, compacted base {results['compacted_load_seconds']:.3f} s")
+    return results
+
+
+# =========================
+# Data loader backends
+# =========================
+def bench_sqlite(args, n_lookups=500, bulk_size=100):
+    """Import/load time, peak memory and per-user, per-book and bulk lookup latency per backend"""
+    import shutil
+    import tempfile
+    from data_loader import DataLoader
+    from sqlite_loader import SQLiteDataLoader
+
+    source = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(source.user_mapper.ids, n_lookups)
+    books = rng.choice(source.book_mapper.ids, n_lookups)
+    bulk_users = rng.choice(source.user_mapper.ids, min(bulk_size, len(source.user_mapper)), replace=False)
+
+    directory = tempfile.mkdtemp()
+    try:
+        books_path = os.path.join(directory, 'books.csv')
+        ratings_path = os.path.join(directory, 'ratings.csv')
+        source.books_df.to_csv(books_path, index=False)
+        source.ratings_df.to_csv(ratings_path, index=False)
+        db_path = os.path.join(directory, 'kitab.db')
+
+        def timed(func, items):
+            t0 = time.perf_counter()
+            for item in items:
+                func(item)
+            return (time.perf_counter() - t0) * 1e6 / len(items)
+
+        results = {}
+        for name, make in (('pandas', DataLoader), ('sqlite', lambda: SQLiteDataLoader(db_path))):
+            loader = make()
+            if name == 'sqlite':
+                t0 = time.perf_counter()
+                loader.import_csv(books_path, ratings_path)
+                import_seconds = time.perf_counter() - t0
+            # Timed and traced separately: tracemalloc slows per-row allocations
+            t0 = time.perf_counter()
+            loader.load_data(books_path, ratings_path)
+            loader.create_user_item_matrix()
+            load_seconds = time.perf_counter() - t0
+            tracemalloc.start()
+            loader.load_data(books_path, ratings_path)
+            loader.create_user_item_matrix()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            resident = loader.books_df.memory_usage(deep=True).sum() + loader.user_item_matrix.data.nbytes \
+                + loader.user_item_matrix.indices.nbytes + loader.user_item_matrix.indptr.nbytes
+            if name == 'pandas':
+                resident += loader.ratings_df.memory_usage(deep=True).sum()
+            results[name] = {
+                'load_seconds': load_seconds,
+                'peak_load_bytes': peak_bytes,
+                'resident_bytes': int(resident),
+                'user_ratings_us': timed(loader.get_user_ratings, users),
+                'book_info_us': timed(loader.get_book_info, books),
+                'bulk_users_us': timed(loader.get_ratings_for_users, [bulk_users] * 20),
+            }
+            if name == 'sqlite':
+                results[name]['import_seconds'] = import_seconds
+                results[name]['db_bytes'] = os.path.getsize(db_path)
+                loader.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"{'backend':<8} {'load s':>7} {'peak MB':>8} {'resident MB':>12} {'user µs':>8} "
+          f"{'book µs':>8} {f'{bulk_size} users µs':>14}")
+    for name, res in results.items():
+        print(f"{name:<8} {res['load_seconds']:>7.3f} {res['peak_load_bytes'] / 1e6:>8.1f} "
+              f"{res['resident_bytes'] / 1e6:>12.1f} {res['user_ratings_us']:>8.0f} "
+              f"{res['book_info_us']:>8.0f} {res['bulk_users_us']:>14.0f}")
+    sqlite = results['sqlite']
+    print(f"SQLite import {sqlite['import_seconds']:.2f} s, database {sqlite['db_bytes'] / 1e6:.1f} MB on disk")
+    return results
+
+
+def bench_sharding(args, n_shards=4, n_recommendations=10, neighbours=20):
+    """Per-request latency of MF, item-based and content top-n: one process vs. item shards"""
+    import shutil
+    import tempfile
+    from collaborative_filtering import CollaborativeFiltering
+    from content_based import ContentBasedFiltering
+    from sharding import ShardedCatalog, ShardedRecommender, write_shards
+
+    loader = synthetic_loader(args.users, args.books, args.ratings_per_user, args.seed)
+    cf = CollaborativeFiltering(loader.user_item_matrix, user_mapper=loader.user_mapper,
+                                item_mapper=loader.book_mapper)
+    cf.matrix_factorization()
+    cf.calculate_item_similarity(top_k=neighbours)
+    cbf = ContentBasedFiltering(loader.books_df, book_mapper=loader.book_mapper)
+    cbf.prepare_features()
+    rng = np.random.default_rng(args.seed)
+    users = rng.choice(loader.user_mapper.ids, min(args.sample, len(loader.user_mapper)), replace=False)
+    histories = {user: list(loader.get_user_ratings(user)[['book_id', 'rating']].itertuples(index=False))
+                 for user in users}
+
+    def calls(models):
+        return {
+            'mf': lambda user: models[0].mf_recommendations(user, n_recommendations),
+            'item': lambda user: models[0].item_based_recommendations(user, n_recommendations),
+            'content': lambda user: models[1].recommend_based_on_history(histories[user], n_recommendations),
+        }
+
+    def run(models):
+        timings, results = {}, {}
+        for kind, call in calls(models).items():
+            t0 = time.perf_counter()
+            results[kind] = [call(user) for user in users]
+            timings[kind] = (time.perf_counter() - t0) * 1000 / len(users)
+        return timings, results
+
+    directory = tempfile.mkdtemp()
+    try:
+        t0 = time.perf_counter()
+        manifest = write_shards(cf, cbf, directory, n_shards, neighbours)
+        write_seconds = time.perf_counter() - t0
+        shard_bytes = [sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, shard['path'])))
+                       for shard in manifest['shards']]
+        single_ms, expected = run((cf, cbf))
+        results = {'single': {'ms_per_request': single_ms}}
+        for name, processes in (('in_process', False), ('processes', True)):
+            with ShardedCatalog(directory, processes=processes) as catalog:
+                catalog.info()  # waits for the workers to start
+                sharded = ShardedRecommender(catalog, cf)
+                timings, got = run((sharded, sharded))
+            agreement = {kind: float(np.mean([np.allclose(a[1], b[1], atol=1e-9)
+                                              for a, b in zip(got[kind], expected[kind])]))
+                         for kind in got}
+            results[name] = {'ms_per_request': timings, 'score_agreement': agreement}
+    finally:
+        shutil.rmtree(directory)
+    results['shards'] = {'n_shards': len(shard_bytes), 'write_seconds': write_seconds,
+                         'max_shard_bytes': max(shard_bytes), 'total_bytes': sum(shard_bytes)}
+
+    print(f"{'mode':<11} {'mf ms':>7} {'item ms':>8} {'content ms':>11}  score agreement")
+    for name in ('single', 'in_process', 'processes'):
+        res = results[name]
+        ms = res['ms_per_request']
+        agreement = ' '.join(f"{kind}={value:.0%}" for kind, value in res.get('score_agreement', {}).items())
+        print(f"{name:<11} {ms['mf']:>7.2f} {ms['item']:>8.2f} {ms['content']:>11.2f}  {agreement}")
+    info = results['shards']
+    print(f"{info['n_shards']} shards written in {info['write_seconds']:.2f} s; largest "
+          f"{info['max_shard_bytes'] / 1e6:.1f} MB of {info['total_bytes'] / 1e6:.1f} MB")
+    return results
+
+
+def bench_cooccurrence(args, catalog_sizes=(1000, 100000, 10000000), n_events=20000, k=10):
+    """Per-rating update cost of the streaming co-occurrence engine by catalog size, and its count error"""
+    from collections import Counter
+    from cooccurrence import CooccurrenceEngine
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for n_books in catalog_sizes:
+        # Zipf-ish popularity over the catalog, as in synthetic_loader
+        books = np.minimum(rng.zipf(1.3, n_events), n_books)
+        users = rng.integers(1, args.users + 1, n_events)
+        engine = CooccurrenceEngine()
+        t0 = time.perf_counter()
+        for user_id, book_id in zip(users.tolist(), books.tolist()):
+            engine.update(user_id, book_id)
+        update_us = (time.perf_counter() - t0) * 1e6 / n_events
+        t0 = time.perf_counter()
+        for book_id in books[:args.sample].tolist():
+            engine.also_liked(book_id, k)
+        query_us = (time.perf_counter() - t0) * 1e6 / args.sample
+
+        # Exact pair counts for the sketch's over-estimate
+        sessions, exact = {}, Counter()
+        for user_id, book_id in zip(users.tolist(), books.tolist()):
+            session = sessions.setdefault(user_id, [])[-engine.session_length:]
+            if book_id in session:
+                continue
+            exact.update((min(book_id, other), max(book_id, other)) for other in session)
+            sessions[user_id] = session + [book_id]
+        errors = [count - exact[(min(book_id, other), max(book_id, other))]
+                  for book_id, partners in engine.partners.items() for other, count in partners.items()]
+        results[n_books] = {'update_us': update_us, 'also_liked_us': query_us,
+                            'mean_overcount': float(np.mean(errors)) if errors else 0.0,
+                            **engine.status()}
+
+    print(f"{'books':>10} {'update µs':>10} {'query µs':>9} {'overcount':>10} {'tracked':>8} {'sketch MB':>10}")
+    for n_books, res in results.items():
+        print(f"{n_books:>10} {res['update_us']:>10.1f} {res['also_liked_us']:>9.1f} "
+              f"{res['mean_overcount']:>10.3f} {res['books']:>8} {res['sketch_bytes'] / 1e6:>10.1f}")
+    return results
+
+
+# =========================
+# Runner
+# =========================
+BENCHMARKS = {
+    'imports': bench_imports,
+    'precision': bench_precision,
+    'features': bench_features,
+    'quality': bench_quality,
+    'svd': bench_svd,
+    'eventlog': bench_eventlog,
+    'sqlite': bench_sqlite,
+    'sharding': bench_sharding,
+    'cooccurrence': bench_cooccurrence,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--users', type=int, default=1000, help='Synthetic users')
+    parser.add_argument('--books', type=int, default=2000, help='Synthetic books')
+    parser.add_argument('--ratings-per-user', type=int, default=30)
+    parser.add_argument('--sample', type=int, default=100, help='Users/books to query')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=4, help='Parallel workers where supported')
+    args = parser.parse_args(argv)
+
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {name: BENCHMARKS[name](args) for name in names}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=float)
+
+    failed = [name for name, res in results.items()
+              if any(isinstance(v, dict) and v.get('ok') is False for v in res.values())]
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
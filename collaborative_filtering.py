@@ -1,22 +1,47 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse.linalg import svds
 import warnings
+from scipy import sparse
+
+from factorization import CenteredOperator, randomized_svd, svds_reference
+from id_mapper import IdMapper
+from instrumentation import record_cache
+from precision import PrecisionPolicy
+from similarity import BlockedSimilarity
 
 warnings.filterwarnings("ignore")
 
 
 class CollaborativeFiltering:
-    def __init__(self, user_item_matrix):
+    def __init__(self, user_item_matrix, user_mapper=None, item_mapper=None, precision=None):
+        self.precision = precision or PrecisionPolicy.full()
+
         # Convert COO → CSR once (critical)
         if hasattr(user_item_matrix, "tocoo"):
-            self.user_item_matrix = user_item_matrix.tocsr()
+            self.user_item_matrix = self.precision.cast_ratings(user_item_matrix.tocsr())
         else:
-            self.user_item_matrix = user_item_matrix
+            self.user_item_matrix = self.precision.cast_ratings(user_item_matrix)
+
+        # Row/column ids: explicit mappers, the pivot table's labels,
+        # or the legacy dense 1-based ids
+        n_users, n_items = self.user_item_matrix.shape
+        if user_mapper is None:
+            user_mapper = (IdMapper(user_item_matrix.index) if hasattr(user_item_matrix, "index")
+                           else IdMapper.identity(n_users))
+        if item_mapper is None:
+            item_mapper = (IdMapper(user_item_matrix.columns) if hasattr(user_item_matrix, "columns")
+                           else IdMapper.identity(n_items))
+        self.user_mapper = user_mapper
+        self.item_mapper = item_mapper
 
         self.user_similarity = None
         self.item_similarity = None
-        self.predicted_ratings = None
+        self.user_factors = None
+        self.item_factors = None
+        self.user_bias = None
+        self.item_bias = None
+        self.factorization_info = None
+        self._svd_basis = None
+        self.similarity_timings = {}
 
     # =========================
     # Helpers
@@ -32,107 +57,237 @@ class CollaborativeFiltering:
             return self.user_item_matrix.toarray()
         return self.user_item_matrix.values
 
+    @staticmethod
+    def _dense(values):
+        """Densify a similarity row/slice that may be sparse (top-k mode)"""
+        if hasattr(values, "toarray"):
+            return values.toarray()
+        return np.asarray(values)
+
     # =========================
     # Similarity calculations
     # =========================
-    def calculate_user_similarity(self):
-        self.user_similarity = cosine_similarity(self._get_dense_matrix())
+    def _build_similarity(self, matrix, kind, top_k, block_size, n_workers, executor, output_path):
+        builder = BlockedSimilarity(
+            block_size=block_size,
+            n_workers=n_workers,
+            top_k=top_k,
+            executor=executor,
+            output_path=output_path,
+            dtype=self.precision.similarity,
+        )
+        similarity = builder.compute(matrix)
+        self.similarity_timings[kind] = builder.block_timings
+        return self.precision.store_similarity(similarity)
+
+    def calculate_user_similarity(self, top_k=None, block_size=1024, n_workers=1,
+                                  executor="thread", output_path=None):
+        """User-user cosine similarity, built in row blocks.
+
+        With top_k set only the k most similar users per row are kept (CSR);
+        with output_path set the full matrix is written to a memory-mapped file.
+        """
+        self.user_similarity = self._build_similarity(
+            self.user_item_matrix, "user", top_k, block_size, n_workers, executor, output_path
+        )
         return self.user_similarity
 
-    def calculate_item_similarity(self):
-        self.item_similarity = cosine_similarity(self._get_dense_matrix().T)
+    def calculate_item_similarity(self, top_k=None, block_size=1024, n_workers=1,
+                                  executor="thread", output_path=None):
+        """Item-item cosine similarity, built in row blocks (see calculate_user_similarity)"""
+        matrix = self.user_item_matrix
+        matrix = matrix.T if hasattr(matrix, "tocsr") else matrix.values.T
+        self.item_similarity = self._build_similarity(
+            matrix, "item", top_k, block_size, n_workers, executor, output_path
+        )
         return self.item_similarity
 
     # =========================
     # User-based CF
     # =========================
     def user_based_recommendations(self, user_id, n_recommendations=5):
+        """Returns (book_ids, predicted_ratings) for the top unrated books"""
+        record_cache("user_similarity", self.user_similarity is not None)
         if self.user_similarity is None:
             self.calculate_user_similarity()
 
-        user_idx = user_id - 1
-        similar_users = self.user_similarity[user_idx]
+        user_idx = self.user_mapper.index(user_id)
+        # Stored precision may be reduced; accumulate in float64
+        similar_users = self._dense(self.user_similarity[user_idx]).astype(np.float64).flatten()
+        similar_users[user_idx] = 0
         user_ratings = self._get_user_ratings(user_idx)
-        ratings_matrix = self._get_dense_matrix()
-
-        predicted_ratings = np.zeros(len(user_ratings))
+        ratings_matrix = self.user_item_matrix
+        if not hasattr(ratings_matrix, "tocsr"):
+            ratings_matrix = ratings_matrix.values
 
-        for item_idx in range(len(user_ratings)):
-            if user_ratings[item_idx] == 0:
-                numerator = 0
-                denominator = 0
+        # Weighted sum over the other users who rated each item
+        numerator = np.asarray(ratings_matrix.T @ similar_users).flatten()
+        denominator = np.asarray((ratings_matrix > 0).T @ np.abs(similar_users)).flatten()
 
-                for other_user_idx in range(len(similar_users)):
-                    if other_user_idx != user_idx:
-                        rating = ratings_matrix[other_user_idx, item_idx]
-                        if rating > 0:
-                            numerator += similar_users[other_user_idx] * rating
-                            denominator += abs(similar_users[other_user_idx])
-
-                if denominator > 0:
-                    predicted_ratings[item_idx] = numerator / denominator
+        predicted_ratings = np.zeros(len(user_ratings))
+        mask = (user_ratings == 0) & (denominator > 0)
+        predicted_ratings[mask] = numerator[mask] / denominator[mask]
 
         top = np.argsort(predicted_ratings)[::-1][:n_recommendations]
-        return top, predicted_ratings[top]
+        return self.item_mapper.to_id(top), predicted_ratings[top]
 
     # =========================
     # Item-based CF
     # =========================
     def item_based_recommendations(self, user_id, n_recommendations=5):
+        record_cache("item_similarity", self.item_similarity is not None)
         if self.item_similarity is None:
             self.calculate_item_similarity()
 
-        user_idx = user_id - 1
+        user_idx = self.user_mapper.index(user_id)
         user_ratings = self._get_user_ratings(user_idx)
         rated_items = np.where(user_ratings > 0)[0]
 
-        predicted_ratings = np.zeros(len(user_ratings))
-
-        for item_idx in range(len(user_ratings)):
-            if user_ratings[item_idx] == 0:
-                numerator = 0
-                denominator = 0
+        # Similarity of every item to the items this user has rated
+        sims = self._dense(self.item_similarity[:, rated_items]).astype(np.float64)
+        numerator = sims @ user_ratings[rated_items]
+        denominator = np.abs(sims).sum(axis=1)
 
-                for rated_item_idx in rated_items:
-                    sim = self.item_similarity[item_idx, rated_item_idx]
-                    numerator += sim * user_ratings[rated_item_idx]
-                    denominator += abs(sim)
-
-                if denominator > 0:
-                    predicted_ratings[item_idx] = numerator / denominator
+        predicted_ratings = np.zeros(len(user_ratings))
+        mask = (user_ratings == 0) & (denominator > 0)
+        predicted_ratings[mask] = numerator[mask] / denominator[mask]
 
         top = np.argsort(predicted_ratings)[::-1][:n_recommendations]
-        return top, predicted_ratings[top]
+        return self.item_mapper.to_id(top), predicted_ratings[top]
 
     # =========================
     # Matrix Factorization
     # =========================
-    def matrix_factorization(self, n_factors=15):
-        R = self._get_dense_matrix()
+    def _centering_offsets(self, center):
+        """Per-user and per-item offsets subtracted (implicitly) before the SVD"""
+        R = self.user_item_matrix
+        n_users, n_items = R.shape
+        user_bias, item_bias = np.zeros(n_users), np.zeros(n_items)
+        if center is None:
+            return user_bias, item_bias
 
+        R = R.tocsr() if hasattr(R, "tocsr") else sparse.csr_matrix(R.values)
+        sums = np.asarray(R.sum(axis=1)).ravel()
+        counts = np.diff(R.indptr)
+        if center == "global":
+            user_bias[:] = sums.sum() / max(1, counts.sum())
+        elif center == "user":
+            user_bias = np.divide(sums, counts, out=np.zeros(n_users), where=counts > 0)
+        elif center == "item":
+            col_sums = np.asarray(R.sum(axis=0)).ravel()
+            col_counts = np.bincount(R.indices, minlength=n_items)
+            item_bias = np.divide(col_sums, col_counts, out=np.zeros(n_items), where=col_counts > 0)
+        else:
+            raise ValueError(f"Unknown centering: {center}")
+        return user_bias, item_bias
+
+    def matrix_factorization(self, n_factors=15, solver="randomized", center=None,
+                             warm_start=True, n_iter=8, tol=1e-4, seed=0):
+        """Truncated SVD of the sparse rating matrix; returns (user_factors, item_factors).
+
+        The randomized solver works on the CSR matrix directly (center subtracts
+        'global', 'user' or 'item' means implicitly) and, with warm_start,
+        seeds its range finder from the previous item factors. Fit details and
+        the relative residual are kept in self.factorization_info. Failures
+        raise FactorizationError.
+        """
+        R = self.user_item_matrix
+        if not hasattr(R, "tocsr"):
+            R = R.values
         n_users, n_items = R.shape
         k = max(2, min(n_factors, min(n_users, n_items) - 1))
 
-        try:
-            U, sigma, Vt = svds(R, k=k)
-            self.predicted_ratings = U @ np.diag(sigma) @ Vt
-            return self.predicted_ratings
-        except Exception as e:
-            print(f"[ERROR] SVD failed: {e}")
-            self.predicted_ratings = np.random.rand(n_users, n_items) * 5
-            return self.predicted_ratings
+        user_bias, item_bias = self._centering_offsets(center)
+        operator = CenteredOperator(R, user_bias, item_bias)
+        if solver == "randomized":
+            init = None
+            if warm_start and self._svd_basis is not None and self._svd_basis.shape[1] == n_items:
+                init = self._svd_basis
+            U, sigma, Vt, info = randomized_svd(operator, k, n_iter=n_iter, init=init, tol=tol, seed=seed)
+        elif solver == "svds":
+            U, sigma, Vt, info = svds_reference(operator, k, seed=seed)
+        else:
+            raise ValueError(f"Unknown solver: {solver}")
+
+        # Predictions are user_factors @ item_factors.T + user_bias + item_bias;
+        # the dense matrix is never built
+        self.user_factors = self.precision.cast_factors(U * sigma)
+        self.item_factors = self.precision.cast_factors(Vt.T)
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self._svd_basis = Vt
+        self.factorization_info = info
+        return self.user_factors, self.item_factors
+
+    def warm_start_from(self, other):
+        """Seed the next randomized fit with another model's SVD basis (same item columns only)"""
+        if other._svd_basis is not None and np.array_equal(other.item_mapper.ids, self.item_mapper.ids):
+            self._svd_basis = other._svd_basis
+        return self
+
+    def predict_pairs(self, user_indices, item_indices):
+        """MF predictions for aligned arrays of user and item indices"""
+        if self.user_factors is None:
+            self.matrix_factorization()
+        users = self.user_factors[user_indices].astype(np.float64)
+        items = self.item_factors[item_indices].astype(np.float64)
+        return (np.einsum("ij,ij->i", users, items)
+                + self.user_bias[user_indices] + self.item_bias[item_indices])
+
+    def predict_user(self, user_idx):
+        """MF predictions of one user (by index) for every item"""
+        if self.user_factors is None:
+            self.matrix_factorization()
+        user_vector = self.user_factors[user_idx].astype(np.float64)
+        return self.item_factors @ user_vector + self.user_bias[user_idx] + self.item_bias
 
     # =========================
     # MF Recommendations
     # =========================
     def mf_recommendations(self, user_id, n_recommendations=5):
-        if self.predicted_ratings is None:
-            self.matrix_factorization()
+        record_cache("mf_factors", self.user_factors is not None)
 
-        user_idx = user_id - 1
+        user_idx = self.user_mapper.index(user_id)
         actual = self._get_user_ratings(user_idx)
-        predicted = self.predicted_ratings[user_idx]
+        predicted = self.predict_user(user_idx)
 
         predicted[actual > 0] = 0
         top = np.argsort(predicted)[::-1][:n_recommendations]
-        return top, predicted[top]
+        return self.item_mapper.to_id(top), predicted[top]
+
+    def mf_recommendations_batch(self, user_ids, n_recommendations=5, block_size=256):
+        """MF top-n for several users; returns (book_ids, scores), one row per user.
+
+        Users are scored block_size at a time with one matrix product each.
+        """
+        user_idx = np.array([self.user_mapper.index(user_id) for user_id in user_ids], dtype=np.int64)
+        if self.user_factors is None:
+            self.matrix_factorization()
+        R = self.user_item_matrix
+        if not hasattr(R, "tocsr"):
+            R = sparse.csr_matrix(R.values)
+        n = min(n_recommendations, R.shape[1])
+        book_ids = np.empty((len(user_idx), n), dtype=self.item_mapper.ids.dtype)
+        scores = np.empty((len(user_idx), n))
+
+        for start in range(0, len(user_idx), block_size):
+            rows = user_idx[start:start + block_size]
+            predicted = (self.user_factors[rows].astype(np.float64) @ self.item_factors.T.astype(np.float64)
+                         + self.user_bias[rows][:, None] + self.item_bias)
+            predicted[R[rows].toarray() > 0] = 0
+            # Ordered like mf_recommendations (ascending argsort, reversed)
+            top = np.argsort(predicted, axis=1)[:, ::-1][:, :n]
+            book_ids[start:start + len(rows)] = self.item_mapper.to_id(top)
+            scores[start:start + len(rows)] = np.take_along_axis(predicted, top, axis=1)
+        return book_ids, scores
+
+    def mf_scores(self, user_id, book_ids):
+        """MF predictions for just the given books (0 for books without a column)"""
+        scores = np.zeros(len(book_ids))
+        if user_id not in self.user_mapper:
+            return scores
+        item_idx = self.item_mapper.to_index(np.asarray(book_ids))
+        known = item_idx >= 0
+        user_idx = np.full(known.sum(), self.user_mapper.index(user_id))
+        scores[known] = self.predict_pairs(user_idx, item_idx[known])
+        return scores
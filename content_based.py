@@ -1,92 +1,337 @@
-import pandas as pd
+import os
+from itertools import chain
+
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+from scipy.sparse import csr_matrix, hstack, vstack
+
+from feature_hashing import HashedTfidf
+from id_mapper import IdMapper
+from instrumentation import record_cache
+from precision import PrecisionPolicy
+from similarity import AppendedSimilarity, blocked_cosine_similarity, l2_normalize_rows
 
 class ContentBasedFiltering:
-    def __init__(self, books_df):
+    def __init__(self, books_df, artifact_path=None, book_mapper=None, precision=None,
+                 drift_threshold=0.2, feature_mode='tfidf', n_features=2 ** 18,
+                 chunk_size=10000, n_workers=1):
+        if feature_mode not in ('tfidf', 'hashing'):
+            raise ValueError(f"Unknown feature mode: {feature_mode}")
         self.books_df = books_df
+        self.precision = precision or PrecisionPolicy.full()
         self.tfidf_matrix = None
         self.content_similarity = None
         self.feature_vectors = None
+        self.artifact_path = artifact_path
+        
+        # Fitted transformers, kept so new books can be added without a refit
+        self.vectorizer = None
+        self.year_scaler = None
+        self.rating_scaler = None
+        
+        # 'tfidf' fits a vocabulary; 'hashing' uses fixed-width hashed terms
+        # with streaming IDF, processed in chunks (optionally in parallel).
+        # In both modes the IDF is frozen at fit time: added books are
+        # weighted with it so every row shares one weighting
+        self.feature_mode = feature_mode
+        self.n_features = n_features
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        
+        # Share of out-of-vocabulary tokens (hashing: of books) added since
+        # the last fit that forces a refit
+        self.drift_threshold = drift_threshold
+        self._added_tokens = 0
+        self._oov_tokens = 0
+        self._added_books = 0
+        
+        # Feature rows follow the compact book index, not the books_df row order
+        self.book_mapper = book_mapper if book_mapper is not None else IdMapper(books_df['book_id'])
+        if len(self.book_mapper) != len(books_df):
+            raise ValueError("book_mapper must cover exactly the books in books_df")
         
     def prepare_features(self):
         """Prepare features for content-based filtering"""
-        # Create a combined feature string
-        self.books_df['features'] = (
-            self.books_df['title'].fillna('') + ' ' +
-            self.books_df['author'].fillna('') + ' ' +
-            self.books_df['genre'].fillna('')
-        )
+        self.build_features()
+        
+        # Calculate similarity matrix
+        self.content_similarity = self._build_similarity()
+        
+        if self.artifact_path:
+            self.save_features(self.artifact_path)
+        
+        return self.content_similarity
+    
+    def build_features(self):
+        """Fit the text/numeric transformers and build feature_vectors"""
+        # scikit-learn is only needed when features are (re)fitted
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.preprocessing import MinMaxScaler
+        
+        # Combined feature strings are built chunk by chunk and dropped once
+        # vectorised; the caller's books_df is never modified
+        chunks = self._text_chunks(self.books_df)
         
         # Use TF-IDF for text features
-        tfidf = TfidfVectorizer(stop_words='english')
-        self.tfidf_matrix = tfidf.fit_transform(self.books_df['features'])
+        if self.feature_mode == 'hashing':
+            self.vectorizer = HashedTfidf(self.n_features, n_workers=self.n_workers)
+            self.tfidf_matrix = self.vectorizer.fit_transform_chunks(chunks)
+        else:
+            self.vectorizer = TfidfVectorizer(stop_words='english')
+            self.tfidf_matrix = self.vectorizer.fit_transform(chain.from_iterable(chunks))
         
         # Normalize numerical features
-        scaler = MinMaxScaler()
-        year_normalized = scaler.fit_transform(self.books_df[['year']])
-        rating_normalized = scaler.fit_transform(self.books_df[['rating']])
+        self.year_scaler = MinMaxScaler().fit(self.books_df[['year']])
+        self.rating_scaler = MinMaxScaler().fit(self.books_df[['rating']])
         
         # Combine all features
-        from scipy.sparse import hstack
-        self.feature_vectors = hstack([
-        self.tfidf_matrix,
-         year_normalized,
-         rating_normalized
-       ]).tocsr()   
-
+        self.feature_vectors = self._stack_features(self.tfidf_matrix, self.books_df)
+        self._added_tokens = 0
+        self._oov_tokens = 0
+        self._added_books = 0
         
-        # Calculate similarity matrix
-        self.content_similarity = cosine_similarity(self.feature_vectors)
+        # Reorder rows from books_df order to book index order
+        order = np.argsort(self.book_mapper.to_index(self.books_df['book_id'].to_numpy()))
+        if not np.array_equal(order, np.arange(len(order))):
+            self.tfidf_matrix = self.tfidf_matrix[order]
+            self.feature_vectors = self.feature_vectors[order]
         
-        return self.content_similarity
+        return self.feature_vectors
     
-    def get_similar_books(self, book_id, n_recommendations=5):
-        """Get books similar to a given book"""
-        if self.content_similarity is None:
+    def _text_chunks(self, books):
+        """Yield lists of 'title author genre' strings, chunk_size books at a time"""
+        title, author, genre = books['title'], books['author'], books['genre']
+        for start in range(0, len(books), self.chunk_size):
+            stop = start + self.chunk_size
+            yield (
+                title.iloc[start:stop].fillna('') + ' ' +
+                author.iloc[start:stop].fillna('') + ' ' +
+                genre.iloc[start:stop].fillna('')
+            ).tolist()
+    
+    def _stack_features(self, tfidf_matrix, books):
+        """TF-IDF columns followed by the scaled year and rating"""
+        year_normalized = self.year_scaler.transform(books[['year']])
+        rating_normalized = self.rating_scaler.transform(books[['rating']])
+        features = hstack([tfidf_matrix, year_normalized, rating_normalized]).tocsr()
+        return self.precision.cast_factors(features)
+    
+    @property
+    def vocabulary_drift(self):
+        """Share of tokens in books added since the last fit that are out of vocabulary.
+        
+        Hashing mode has no vocabulary; there it is the number of books added
+        since the IDF was fitted relative to the number it was fitted on.
+        """
+        if self.feature_mode == 'hashing':
+            n_docs = self.vectorizer.n_docs if self.vectorizer is not None else 0
+            return self._added_books / n_docs if n_docs else 0.0
+        return self._oov_tokens / self._added_tokens if self._added_tokens else 0.0
+    
+    def _count_oov(self, texts):
+        analyzer = self.vectorizer.build_analyzer()
+        vocabulary = self.vectorizer.vocabulary_
+        total = oov = 0
+        for text in texts:
+            for token in analyzer(text):
+                total += 1
+                oov += token not in vocabulary
+        return oov, total
+    
+    def add_books(self, new_books):
+        """Add books to the fitted model, reusing the existing vocabulary and IDF.
+        
+        Only similarities involving the new books are computed. The IDF is
+        not updated, so new rows are weighted exactly like the stored ones
+        and the new books' terms only count towards it after a refit. A full
+        refit runs instead when the model was never fitted in this process or
+        when vocabulary_drift exceeds drift_threshold.
+        Returns True if the books were added incrementally.
+        """
+        import pandas as pd
+        
+        new_books = new_books.reset_index(drop=True)
+        new_ids = new_books['book_id'].to_numpy()
+        if (self.book_mapper.to_index(new_ids) >= 0).any() or len(np.unique(new_ids)) != len(new_ids):
+            raise ValueError("add_books got book ids that already exist")
+        
+        self._ensure_features()
+        books_df = pd.concat([self.books_df, new_books], ignore_index=True)
+        
+        texts = [text for chunk in self._text_chunks(new_books) for text in chunk]
+        if self.feature_mode == 'tfidf' and self.vectorizer is not None:
+            oov, total = self._count_oov(texts)
+            self._oov_tokens += oov
+            self._added_tokens += total
+        self._added_books += len(new_books)
+        
+        if self.vectorizer is None or self.vocabulary_drift > self.drift_threshold:
+            self.books_df = books_df
+            self.book_mapper = IdMapper(books_df['book_id'])
             self.prepare_features()
+            return False
         
-        book_idx = book_id - 1  # Assuming book IDs start from 1
-        similarity_scores = list(enumerate(self.content_similarity[book_idx]))
+        # Features for the new rows only, with the fitted vocabulary/IDF/scalers
+        new_tfidf = self.vectorizer.transform(texts)
+        new_features = self._stack_features(new_tfidf, new_books)
+        n_old = self.feature_vectors.shape[0]
+        tfidf_matrix = vstack([self.tfidf_matrix, new_tfidf]).tocsr()
+        feature_vectors = vstack([self.feature_vectors, new_features]).tocsr()
         
-        # Sort by similarity score
-        similarity_scores = sorted(similarity_scores, key=lambda x: x[1], reverse=True)
+        # Similarities of every book against the new ones, appended to the
+        # stored matrix rather than copied into a new n x n array
+        normalized = l2_normalize_rows(feature_vectors)
+        new_block = (normalized @ normalized[n_old:].T).toarray()
+        similarity = self.content_similarity
+        if not isinstance(similarity, AppendedSimilarity):
+            similarity = AppendedSimilarity(similarity)
+        stored_rows = np.concatenate([similarity.position, n_old + np.arange(len(new_ids))])
+        block = np.empty(new_block.shape, dtype=self.precision.similarity)
+        block[stored_rows] = new_block
         
-        # Get top N similar books (excluding the book itself)
-        top_indices = [i for i, _ in similarity_scores[1:n_recommendations+1]]
-        top_scores = [score for _, score in similarity_scores[1:n_recommendations+1]]
+        # Stacked rows are [old; new]; move them into book index order
+        stacked_ids = np.concatenate([self.book_mapper.ids, new_ids])
+        mapper = IdMapper(stacked_ids)
+        order = np.argsort(mapper.to_index(stacked_ids))
+        if not np.array_equal(order, np.arange(len(order))):
+            tfidf_matrix = tfidf_matrix[order]
+            feature_vectors = feature_vectors[order]
+        position = np.empty(len(stacked_ids), dtype=np.int64)
+        position[mapper.to_index(stacked_ids)] = stored_rows
+        similarity.append(block, position)
         
-        return top_indices, top_scores
+        self.books_df = books_df
+        self.book_mapper = mapper
+        self.tfidf_matrix = tfidf_matrix
+        self.feature_vectors = feature_vectors
+        self.content_similarity = similarity
+        
+        if self.artifact_path:
+            self.save_features(self.artifact_path)
+        return True
     
-    def recommend_based_on_history(self, rated_books, n_recommendations=5):
-        """Recommend books based on user's rating history"""
+    def _ensure_features(self):
+        """Load persisted features if available, otherwise fit them"""
+        record_cache("content_similarity", self.content_similarity is not None)
         if self.content_similarity is None:
-            self.prepare_features()
+            if not (self.artifact_path and self.load_features(self.artifact_path)):
+                self.prepare_features()
+    
+    def save_features(self, path):
+        """Persist the feature matrix so later runs can skip fitting"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        features = self.feature_vectors.tocsr()
+        np.savez(
+            path,
+            data=features.data,
+            indices=features.indices,
+            indptr=features.indptr,
+            shape=np.array(features.shape),
+            book_ids=self.book_mapper.ids,
+            fingerprint=np.array(self._features_fingerprint()),
+        )
+    
+    def _features_fingerprint(self):
+        """Hash of the book metadata the features are built from, plus the feature settings"""
+        import hashlib
+        import pandas as pd
         
-        # Create user profile based on rated books
-        user_profile = np.zeros(self.feature_vectors.shape[1])
+        columns = [c for c in ('book_id', 'title', 'author', 'genre', 'year', 'rating') if c in self.books_df.columns]
+        row_hashes = pd.util.hash_pandas_object(self.books_df[columns], index=False).to_numpy()
+        # In book index order, so the row order of books_df does not matter
+        ordered = np.empty_like(row_hashes)
+        ordered[self.book_mapper.to_index(self.books_df['book_id'].to_numpy())] = row_hashes
+        digest = hashlib.sha256(ordered.tobytes())
+        digest.update(f"{self.feature_mode}|{self.n_features}|{self.precision!r}".encode())
+        return digest.hexdigest()
+    
+    def load_features(self, path):
+        """Load persisted features; returns False if missing or stale"""
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as artifact:
+            if not np.array_equal(artifact['book_ids'], self.book_mapper.ids):
+                return False
+            # Same ids are not enough: regenerated data reuses them
+            if 'fingerprint' not in artifact.files or str(artifact['fingerprint']) != self._features_fingerprint():
+                return False
+            self.feature_vectors = self.precision.cast_factors(csr_matrix(
+                (artifact['data'], artifact['indices'], artifact['indptr']),
+                shape=tuple(artifact['shape'])
+            ))
+        self.content_similarity = self._build_similarity()
+        return True
+    
+    def _build_similarity(self):
+        similarity = blocked_cosine_similarity(self.feature_vectors, dtype=self.precision.similarity)
+        return self.precision.store_similarity(similarity)
+    
+    def get_similar_books(self, book_id, n_recommendations=5):
+        """Get books similar to a given book; returns (book_ids, scores)"""
+        self._ensure_features()
+        
+        book_idx = self.book_mapper.index(book_id)
+        similarity_scores = np.array(self.content_similarity[book_idx], dtype=np.float64).flatten()
+        similarity_scores[book_idx] = -np.inf  # Exclude the book itself
+        
+        # Get top N similar books by similarity score
+        top_indices = np.argsort(-similarity_scores, kind='stable')[:n_recommendations]
+        top_scores = similarity_scores[top_indices]
         
-        for book_id, rating in rated_books:
-            book_idx = book_id - 1
-            user_profile += self.feature_vectors[book_idx].toarray().flatten() * rating
+        return self.book_mapper.to_id(top_indices), top_scores
+    
+    def _user_profile(self, rated_books):
+        """Unit-length rating-weighted mean of the rated books' features, and their indices"""
+        # Map rated books to feature rows (books missing from the catalog are skipped)
+        rated_books = list(rated_books)
+        book_ids = np.array([book_id for book_id, _ in rated_books])
+        ratings = np.array([rating for _, rating in rated_books], dtype=np.float64)
+        rated_indices = self.book_mapper.to_index(book_ids) if len(book_ids) else np.array([], dtype=np.int64)
+        known = rated_indices >= 0
+        rated_indices = rated_indices[known]
+        
+        # Create user profile based on rated books
+        user_profile = np.asarray(
+            self.feature_vectors[rated_indices].T @ ratings[known]
+        ).flatten()
         
         # Normalize user profile
         if len(rated_books) > 0:
             user_profile /= len(rated_books)
         
-        # Calculate similarity with all books
-        similarities = cosine_similarity([user_profile], self.feature_vectors)
+        profile_norm = np.linalg.norm(user_profile)
+        if profile_norm > 0:
+            user_profile /= profile_norm
+        return user_profile, rated_indices
+    
+    def recommend_based_on_history(self, rated_books, n_recommendations=5):
+        """Recommend books based on user's rating history; returns (book_ids, scores)"""
+        self._ensure_features()
+        user_profile, rated_indices = self._user_profile(rated_books)
         
-        # Get top recommendations (excluding already rated books)
-        rated_indices = [book_id - 1 for book_id, _ in rated_books]
-        similarities = similarities.flatten()
+        # Calculate cosine similarity with all books
+        similarities = l2_normalize_rows(self.feature_vectors) @ user_profile
         
-        for idx in rated_indices:
-            similarities[idx] = -1  # Mark rated books
+        # Get top recommendations (excluding already rated books)
+        similarities = np.asarray(similarities).flatten()
+        similarities[rated_indices] = -1  # Mark rated books
         
         top_indices = np.argsort(similarities)[::-1][:n_recommendations]
         top_scores = similarities[top_indices]
         
-        return top_indices, top_scores
\ No newline at end of file
+        return self.book_mapper.to_id(top_indices), top_scores
+    
+    def score_books(self, rated_books, book_ids):
+        """Profile similarity for just the given books (0 for unknown books)"""
+        if self.feature_vectors is None:  # the similarity matrix is not needed here
+            self._ensure_features()
+        user_profile, _ = self._user_profile(rated_books)
+        
+        scores = np.zeros(len(book_ids))
+        indices = self.book_mapper.to_index(np.asarray(book_ids))
+        known = indices >= 0
+        if known.any():
+            candidates = l2_normalize_rows(self.feature_vectors[indices[known]])
+            scores[known] = np.asarray(candidates @ user_profile).flatten()
+        return scores
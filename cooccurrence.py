@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Ratings of at least this much count as a "like"
+DEFAULT_MIN_RATING = 4
+
+
+# =========================
+# Count-min sketch
+# =========================
+class CountMinSketch:
+    """Approximate counts of integer keys in a fixed depth x 2**width_bits table.
+
+    Each key increments one counter per row (multiply-shift hashing); its
+    estimate is the smallest of those counters, so counts are never
+    under-estimated and the error only grows with the total count.
+    """
+
+    def __init__(self, width_bits=18, depth=4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.width_bits = width_bits
+        self.depth = depth
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.float32)
+        # Odd 64-bit multipliers and offsets, one pair per row
+        self._a = rng.integers(1, 2**63, depth, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, depth, dtype=np.uint64)
+        self._rows = np.arange(depth)[:, None]
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def _buckets(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = keys[None, :] * self._a[:, None] + self._b[:, None]
+        return (hashed >> np.uint64(64 - self.width_bits)).astype(np.intp)
+
+    def add(self, keys, counts=1.0):
+        """Add counts (a scalar or one per key) to keys; returns the keys' new estimates"""
+        buckets = self._buckets(keys)
+        counts = np.broadcast_to(np.asarray(counts, dtype=self.table.dtype), buckets.shape[1:])
+        for row in range(self.depth):
+            np.add.at(self.table[row], buckets[row], counts)
+        return self.table[self._rows, buckets].min(axis=0)
+
+    def estimate(self, keys):
+        return self.table[self._rows, self._buckets(keys)].min(axis=0)
+
+    def decay(self, factor):
+        self.table *= factor
+
+
+def pair_keys(book_id, partner_ids):
+    """One 64-bit key per unordered (book_id, partner) pair (ids are taken as 32-bit)"""
+    partner_ids = np.asarray(partner_ids, dtype=np.int64)
+    low = np.minimum(book_id, partner_ids).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    high = np.maximum(book_id, partner_ids).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    return (high << np.uint64(32)) | low
+
+
+# =========================
+# Streaming co-occurrence
+# =========================
+class CooccurrenceEngine:
+    """Streaming "readers also liked" from rating events.
+
+    Each user's session holds their last session_length liked books (rated
+    min_rating or more). A new like is paired with every book in the
+    session: pair and book counts go to count-min sketches, and each book
+    keeps its top_k partners by estimated count (a heavy-hitter list). An
+    update costs O(session_length * top_k) whatever the catalog size, and
+    memory is bounded by the sketch size, max_sessions and top_k per book.
+    Partners are ranked by cosine over like counts,
+    count(a, b) / sqrt(count(a) * count(b)).
+    """
+
+    def __init__(self, top_k=20, session_length=50, max_sessions=100000, min_rating=DEFAULT_MIN_RATING,
+                 width_bits=18, depth=4, seed=0):
+        self.top_k = top_k
+        self.session_length = session_length
+        self.max_sessions = max_sessions
+        self.min_rating = min_rating
+        self.pair_counts = CountMinSketch(width_bits, depth, seed)
+        self.book_counts = CountMinSketch(width_bits - 2, depth, seed + 1)
+        self.partners = {}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.n_events = 0
+
+    # =========================
+    # Updates
+    # =========================
+    def _session_locked(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = deque(maxlen=self.session_length)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(user_id)
+        return session
+
+    def _offer_locked(self, book_id, partner_id, count):
+        """Keep partner_id in book_id's heavy-hitter list if its count ranks in the top_k"""
+        partners = self.partners.setdefault(book_id, {})
+        if partner_id in partners or len(partners) < self.top_k:
+            partners[partner_id] = count
+            return
+        weakest = min(partners, key=partners.get)
+        if count > partners[weakest]:
+            del partners[weakest]
+            partners[partner_id] = count
+
+    def _update_locked(self, user_id, book_id, rating):
+        if rating is not None and rating < self.min_rating:
+            return
+        session = self._session_locked(user_id)
+        if book_id in session:
+            return  # a re-rating is not a new co-occurrence
+        self.n_events += 1
+        self.book_counts.add([book_id])
+        if session:
+            session_ids = np.fromiter(session, dtype=np.int64, count=len(session))
+            counts = self.pair_counts.add(pair_keys(book_id, session_ids))
+            for partner_id, count in zip(session_ids.tolist(), counts.tolist()):
+                self._offer_locked(book_id, partner_id, count)
+                self._offer_locked(partner_id, book_id, count)
+        session.append(book_id)
+
+    def update(self, user_id, book_id, rating=None):
+        """Consume one rating event (a rating of None counts as a like)"""
+        with self._lock:
+            self._update_locked(int(user_id), int(book_id), rating)
+
+    def consume(self, ratings_df):
+        """Consume a frame of rating events (user_id, book_id, rating), oldest first"""
+        if 'timestamp' in ratings_df.columns:
+            # Ratings without a timestamp (the CSV base) are older than logged ones
+            ratings_df = ratings_df.sort_values('timestamp', kind='stable', na_position='first')
+        with self._lock:
+            for user_id, book_id, rating in zip(ratings_df['user_id'].tolist(), ratings_df['book_id'].tolist(),
+                                                ratings_df['rating'].tolist()):
+                self._update_locked(user_id, book_id, rating)
+        return self.n_events
+
+    def decay(self, factor=0.5):
+        """Scale every count down so recent likes outweigh old ones"""
+        with self._lock:
+            self.pair_counts.decay(factor)
+            self.book_counts.decay(factor)
+            for partners in self.partners.values():
+                for partner_id in partners:
+                    partners[partner_id] *= factor
+
+    # =========================
+    # Serving
+    # =========================
+    def also_liked(self, book_id, n=10, min_count=2):
+        """Books most liked together with book_id; returns (book_ids, scores), best first"""
+        with self._lock:
+            partners = dict(self.partners.get(int(book_id), {}))
+            if not partners:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            book_ids = np.fromiter(partners, dtype=np.int64, count=len(partners))
+            counts = np.fromiter(partners.values(), dtype=np.float64, count=len(partners))
+            keep = counts >= min_count
+            book_ids, counts = book_ids[keep], counts[keep]
+            own = self.book_counts.estimate([int(book_id)])[0]
+            others = self.book_counts.estimate(book_ids) if len(book_ids) else counts
+        scores = counts / np.sqrt(np.maximum(own * others, 1.0))
+        order = np.lexsort((book_ids, -scores))[:n]
+        return book_ids[order], scores[order]
+
+    def candidates(self, book_ids, n=10, exclude=(), min_count=1):
+        """Partners of several books, summed over the books; returns up to n book ids"""
+        pooled = {}
+        for book_id in book_ids:
+            partner_ids, scores = self.also_liked(book_id, self.top_k, min_count)
+            for partner_id, score in zip(partner_ids.tolist(), scores.tolist()):
+                pooled[partner_id] = pooled.get(partner_id, 0.0) + score
+        excluded = set(exclude)
+        ranked = sorted((item for item in pooled.items() if item[0] not in excluded), key=lambda item: -item[1])
+        return np.array([book_id for book_id, _ in ranked[:n]], dtype=np.int64)
+
+    def status(self):
+        with self._lock:
+            return {
+                'events': self.n_events,
+                'sessions': len(self._sessions),
+                'books': len(self.partners),
+                'sketch_bytes': self.pair_counts.nbytes + self.book_counts.nbytes,
+            }
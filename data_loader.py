@@ -1,45 +1,273 @@
+import os
 import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix
+
+from id_mapper import IdMapper
+from search import BookSearchIndex
+from aggregates import RatingAggregates, SegmentedPopularity
+from preview import TablePreview
+from event_log import latest_ratings, load_ratings
 
 class DataLoader:
     def __init__(self):
         self.books_df = None
         self.ratings_df = None
         self.user_item_matrix = None
+        self.user_mapper = None
+        self.book_mapper = None
+        self._book_rows = None
         
-    def load_data(self, books_path='data/books.csv', ratings_path='data/ratings.csv'):
-        """Load books and ratings data"""
+        # Bumped whenever the catalog is (re)loaded; derived indexes key on it.
+        # New ratings are folded into the aggregates instead of bumping it.
+        self.data_version = 0
+        self._search_index = None
+        self._book_labels = None
+        self._aggregates = None
+        self._popularity = None
+        self._books_preview = None
+        self._ratings_preview = None
+
+        # Rating event log (see event_log.py): ratings are its base + tail
+        self._ratings_path = None
+        self._log_path = None
+        self._log_tail = None
+
+    @classmethod
+    def from_env(cls, var="KITAB_DATA_BACKEND", default="pandas"):
+        """Loader for the backend named by an environment variable (pandas or sqlite)"""
+        backend = os.environ.get(var, default)
+        if backend == "sqlite":
+            from sqlite_loader import SQLiteDataLoader
+            return SQLiteDataLoader()
+        if backend != "pandas":
+            raise ValueError(f"Unknown data backend: {backend}")
+        return cls()
+
+    def load_data(self, books_path='data/books.csv', ratings_path='data/ratings.csv', log_path=None):
+        """Load books and ratings data (with log_path, the base snapshot plus logged events)"""
         try:
             self.books_df = pd.read_csv(books_path)
-            self.ratings_df = pd.read_csv(ratings_path)
+            if log_path is None:
+                self.ratings_df = pd.read_csv(ratings_path)
+            else:
+                self.ratings_df, self._log_tail = load_ratings(ratings_path, log_path)
+            self._ratings_path, self._log_path = ratings_path, log_path
+            self.build_id_mappers()
             print(f"Loaded {len(self.books_df)} books and {len(self.ratings_df)} ratings")
             return True
         except FileNotFoundError as e:
             print(f"Error loading data: {e}")
             return False
-    
+
+    def build_id_mappers(self):
+        """Build compact id <-> index mappings for users and books"""
+        self.data_version += 1
+        self.book_mapper = IdMapper(self.books_df['book_id'])
+        self.user_mapper = IdMapper(self.ratings_df['user_id'])
+
+        # books_df row for each compact book index
+        self._book_rows = np.empty(len(self.book_mapper), dtype=np.int64)
+        self._book_rows[self.book_mapper.to_index(self.books_df['book_id'].to_numpy())] = np.arange(len(self.books_df))
+        return self.user_mapper, self.book_mapper
+
+    def _sync_user_item_matrix(self):
+        """Rebuild an existing user-item matrix so its rows/cols follow the current mappers.
+
+        IdMapper keeps ids sorted, so a new user or book can shift every
+        index after it; the matrix must never outlive the mappers it was
+        built with.
+        """
+        if self.user_item_matrix is not None:
+            self.create_user_item_matrix()
+
+    def add_books(self, new_books):
+        """Append books to the catalog and refresh the id mappers"""
+        self.books_df = pd.concat([self.books_df, new_books], ignore_index=True)
+        self.build_id_mappers()
+        self._sync_user_item_matrix()
+        return self.books_df
+
+    def add_ratings(self, new_ratings):
+        """Append ratings and update the cached aggregates incrementally"""
+        self.ratings_df = pd.concat([self.ratings_df, new_ratings], ignore_index=True)
+        self._popularity = None  # rescored lazily on next use
+        if self._aggregates is not None and self._aggregates[0] == self.data_version:
+            aggregates = self._aggregates[1].add_ratings(new_ratings)
+            self.user_mapper = aggregates.user_mapper
+        else:
+            self.user_mapper = IdMapper(self.ratings_df['user_id'])
+        self._sync_user_item_matrix()
+        return self.ratings_df
+
+    def with_ratings(self, new_ratings):
+        """A new loader over the same catalog with new_ratings appended.
+
+        This loader is left untouched, so it can keep serving while the copy is
+        used to retrain. Catalog-only caches (search index, labels) are shared.
+        """
+        loader = DataLoader()
+        loader.books_df = self.books_df
+        loader.ratings_df = self.ratings_df
+        if len(new_ratings):
+            loader.ratings_df = pd.concat([self.ratings_df, new_ratings], ignore_index=True)
+        if 'timestamp' in loader.ratings_df.columns:
+            # Re-ratings replace the older rating, as in the event log
+            loader.ratings_df = latest_ratings(loader.ratings_df)
+        loader.build_id_mappers()
+        loader.data_version = self.data_version
+        loader._search_index = self._search_index
+        loader._book_labels = self._book_labels
+        # The copy reads the event log on from where this loader stopped
+        loader._ratings_path, loader._log_path = self._ratings_path, self._log_path
+        loader._log_tail = self._log_tail.copy() if self._log_tail is not None else None
+        loader.create_user_item_matrix()
+        return loader
+
+    def refresh_ratings(self):
+        """Pick up ratings appended to the event log since the last read; returns how many.
+
+        New (user, book) pairs are folded in incrementally; re-ratings replace
+        the older row and rebuild the aggregates. If a compaction moved unread
+        events into the base, the ratings are reloaded from base + tail.
+        """
+        if self._log_tail is None:
+            return 0
+        new = self._log_tail.read_new()
+        if new is None:
+            n_before = len(self.ratings_df)
+            self.ratings_df, self._log_tail = load_ratings(self._ratings_path, self._log_path)
+            self.build_id_mappers()
+            self._sync_user_item_matrix()
+            return len(self.ratings_df) - n_before
+        if len(new) == 0:
+            return 0
+
+        new = latest_ratings(new)
+        pairs = pd.MultiIndex.from_frame(self.ratings_df[['user_id', 'book_id']])
+        if pairs.isin(pd.MultiIndex.from_frame(new[['user_id', 'book_id']])).any():
+            self.ratings_df = latest_ratings(pd.concat([self.ratings_df, new], ignore_index=True))
+            self.user_mapper = IdMapper(self.ratings_df['user_id'])
+            self._aggregates = None
+            self._popularity = None
+            self._sync_user_item_matrix()
+        else:
+            self.add_ratings(new)
+        return len(new)
+
+    def n_unread_ratings(self):
+        """Events appended to the rating log (by any writer) that refresh_ratings would pick up"""
+        return self._log_tail.n_unread() if self._log_tail is not None else 0
+
     def create_user_item_matrix(self):
-        """Create user-item rating matrix"""
+        """Create sparse user-item rating matrix (rows/cols follow the id mappers)"""
         if self.ratings_df is not None:
-            self.user_item_matrix = self.ratings_df.pivot_table(
-                index='user_id',
-                columns='book_id',
-                values='rating',
-                fill_value=0
+            if self.user_mapper is None:
+                self.build_id_mappers()
+
+            ratings = self.ratings_df
+            if ratings.duplicated(['user_id', 'book_id']).any():
+                ratings = ratings.groupby(['user_id', 'book_id'], as_index=False)['rating'].mean()
+
+            rows = self.user_mapper.to_index(ratings['user_id'].to_numpy())
+            cols = self.book_mapper.to_index(ratings['book_id'].to_numpy())
+            known = cols >= 0  # ratings for books missing from the catalog are dropped
+
+            self.user_item_matrix = csr_matrix(
+                (ratings['rating'].to_numpy(dtype=np.float64)[known], (rows[known], cols[known])),
+                shape=(len(self.user_mapper), len(self.book_mapper))
             )
             return self.user_item_matrix
         return None
-    
+
+    def get_search_index(self):
+        """Search index over books_df, rebuilt once per data version"""
+        if self._search_index is None or self._search_index[0] != self.data_version:
+            self._search_index = (self.data_version, BookSearchIndex(self.books_df))
+        return self._search_index[1]
+
+    def get_aggregates(self):
+        """Rating/catalog aggregates, built once per data version"""
+        if self._aggregates is None or self._aggregates[0] != self.data_version:
+            aggregates = RatingAggregates(self.books_df, self.ratings_df, self.book_mapper, self.user_mapper)
+            self._aggregates = (self.data_version, aggregates)
+        return self._aggregates[1]
+
+    def get_popularity(self, half_life_days=None):
+        """Segmented (genre/author/decade) popularity lists, built once per data version"""
+        key = (self.data_version, half_life_days)
+        if self._popularity is None or self._popularity[0] != key:
+            popularity = SegmentedPopularity(self.books_df, self.ratings_df, self.book_mapper,
+                                             half_life_days=half_life_days)
+            self._popularity = (key, popularity)
+        return self._popularity[1]
+
+    def get_book_labels(self):
+        """'title by author' label per books_df row and a label -> book_id lookup, once per data version"""
+        if self._book_labels is None or self._book_labels[0] != self.data_version:
+            labels = (self.books_df['title'].astype(str) + ' by ' + self.books_df['author'].astype(str)).to_numpy()
+            # Duplicate labels resolve to the first matching row
+            label_to_id = dict(zip(labels[::-1], self.books_df['book_id'].to_numpy()[::-1]))
+            self._book_labels = (self.data_version, labels, label_to_id)
+        return self._book_labels[1], self._book_labels[2]
+
+    def read_ratings(self):
+        """Every rating as a frame (held in memory here; SQLiteDataLoader reads the table)"""
+        return self.ratings_df
+
+    @property
+    def rating_columns(self):
+        return list(self.ratings_df.columns)
+
+    def get_books_page(self, offset=0, limit=50, columns=None, sort_by=None, ascending=True, filters=None):
+        """(total, page frame) of the catalog; see TablePreview.page (indexes built once per data version)"""
+        if self._books_preview is None or self._books_preview[0] != self.data_version:
+            self._books_preview = (self.data_version, TablePreview(self.books_df))
+        return self._books_preview[1].page(offset, limit, columns, sort_by, ascending, filters)
+
+    def get_ratings_page(self, offset=0, limit=50, columns=None, sort_by=None, ascending=True, filters=None):
+        """(total, page frame) of the ratings; see TablePreview.page.
+
+        Added ratings replace ratings_df without a version bump, so the
+        preview is also rebuilt when the frame itself changes.
+        """
+        preview = self._ratings_preview
+        if preview is None or preview[0] != self.data_version or preview[1].frame is not self.ratings_df:
+            self._ratings_preview = (self.data_version, TablePreview(self.ratings_df))
+        return self._ratings_preview[1].page(offset, limit, columns, sort_by, ascending, filters)
+
     def get_book_info(self, book_id):
         """Get book information by ID"""
         if self.books_df is not None:
-            book_info = self.books_df[self.books_df['book_id'] == book_id]
-            if not book_info.empty:
-                return book_info.iloc[0].to_dict()
+            idx = self.book_mapper.to_index(book_id)
+            if idx >= 0:
+                return self.books_df.iloc[self._book_rows[idx]].to_dict()
         return None
-    
+
+    def get_book_values(self, book_ids, column):
+        """Values of one books_df column for the given book ids (unknown ids are skipped)"""
+        idx = self.book_mapper.to_index(np.asarray(book_ids))
+        return self.books_df[column].to_numpy()[self._book_rows[idx[idx >= 0]]]
+
+    def get_books(self, book_ids):
+        """Catalog rows for several book ids, in the order given (unknown ids are skipped)"""
+        idx = self.book_mapper.to_index(np.asarray(book_ids))
+        return self.books_df.iloc[self._book_rows[idx[idx >= 0]]].reset_index(drop=True)
+
     def get_user_ratings(self, user_id):
         """Get ratings by a specific user"""
         if self.ratings_df is not None:
             return self.ratings_df[self.ratings_df['user_id'] == user_id]
-        return None
\ No newline at end of file
+        return None
+
+    def get_ratings_for_users(self, user_ids):
+        """Ratings by any of the given users"""
+        return self.ratings_df[self.ratings_df['user_id'].isin(user_ids)]
+
+    def get_recent_ratings(self, n):
+        """The n most recently added ratings, oldest first"""
+        return self.ratings_df.tail(n)
+
+    def get_book_ratings(self, book_id):
+        """Ratings of one book"""
+        return self.ratings_df[self.ratings_df['book_id'] == book_id]
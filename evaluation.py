@@ -0,0 +1,285 @@
+"""Offline evaluation of the recommenders on held-out ratings.
+
+Usage:
+    python evaluation.py                              # leave-k-out on data/*.csv
+    python evaluation.py --split random --workers 4 --json eval.json
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+RECOMMENDERS = ('popularity', 'user_based', 'item_based', 'mf', 'content', 'hybrid')
+
+
+# =========================
+# Splits
+# =========================
+def random_split(ratings_df, test_size=0.2, seed=42):
+    """Seeded random (train, test) split of individual ratings"""
+    rng = np.random.default_rng(seed)
+    is_test = rng.random(len(ratings_df)) < test_size
+    return ratings_df[~is_test], ratings_df[is_test]
+
+
+def leave_k_out_split(ratings_df, k=2, seed=42):
+    """Seeded per-user split holding out k ratings of every user with more than k"""
+    rng = np.random.default_rng(seed)
+    shuffled = ratings_df.iloc[rng.permutation(len(ratings_df))]
+    position = shuffled.groupby('user_id').cumcount().to_numpy()
+    counts = shuffled.groupby('user_id')['user_id'].transform('size').to_numpy()
+    is_test = (position < k) & (counts > k)
+    # Restore the original row order so "most recent" stays meaningful in train
+    train = shuffled[~is_test].sort_index()
+    test = shuffled[is_test].sort_index()
+    return train, test
+
+
+SPLITS = {'random': random_split, 'leave_k_out': leave_k_out_split}
+
+
+# =========================
+# Metrics
+# =========================
+def rmse(predicted, actual):
+    predicted = np.asarray(predicted, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if len(actual) == 0:
+        return None
+    return float(np.sqrt(np.mean((predicted - actual) ** 2)))
+
+
+def ranking_metrics(recs, relevant_keys, n_relevant, n_books, k):
+    """precision/recall/NDCG@k and catalog coverage for a (users x k) matrix of book indices.
+
+    recs holds book indices padded with -1; relevant_keys are the sorted
+    user_row * n_books + book_index keys of relevant held-out items and
+    n_relevant counts them per user row. Users without relevant items are
+    left out of the averages.
+    """
+    recs = recs[:, :k]
+    rows = np.arange(len(recs))[:, None]
+    keys = rows * n_books + recs
+    hits = (recs >= 0) & np.isin(keys, relevant_keys)
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts).sum(axis=1)
+    idcg = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(n_relevant, k)]
+
+    judged = n_relevant > 0
+    n_hits = hits.sum(axis=1)[judged]
+    recommended = np.unique(recs[recs >= 0])
+    return {
+        f'precision@{k}': float(np.mean(n_hits / k)) if judged.any() else None,
+        f'recall@{k}': float(np.mean(n_hits / n_relevant[judged])) if judged.any() else None,
+        f'ndcg@{k}': float(np.mean(dcg[judged] / idcg[judged])) if judged.any() else None,
+        'coverage': len(recommended) / n_books if n_books else 0.0,
+        'users': int(judged.sum()),
+    }
+
+
+def scorable_users(test_df, user_mapper, max_users=None, seed=42):
+    """Sorted test users that also appear in train, optionally a seeded sample"""
+    users = np.unique(test_df['user_id'].to_numpy())
+    users = users[user_mapper.to_index(users) >= 0]
+    if max_users is not None and len(users) > max_users:
+        users = np.sort(np.random.default_rng(seed).choice(users, max_users, replace=False))
+    return users
+
+
+def relevance_keys(test_df, users, book_mapper, threshold=4.0):
+    """Relevant held-out items as sorted user_row * n_books + book_index keys, and counts per user"""
+    n_books = len(book_mapper)
+    relevant = test_df[(test_df['rating'] >= threshold) & test_df['user_id'].isin(users)]
+    rows = np.searchsorted(users, relevant['user_id'].to_numpy())
+    books = book_mapper.to_index(relevant['book_id'].to_numpy())
+    rows, books = rows[books >= 0], books[books >= 0]
+    keys = np.unique(rows * n_books + books)
+    return keys, np.bincount(keys // n_books, minlength=len(users))
+
+
+# =========================
+# Models
+# =========================
+def fit_models(books_df, train_df, precision=None):
+    """Train-split DataLoader plus fitted CF, content and hybrid recommenders"""
+    from collaborative_filtering import CollaborativeFiltering
+    from content_based import ContentBasedFiltering
+    from data_loader import DataLoader
+    from hybrid_recommender import HybridRecommender
+
+    loader = DataLoader()
+    loader.books_df = books_df
+    loader.ratings_df = train_df.reset_index(drop=True)
+    loader.build_id_mappers()
+    loader.create_user_item_matrix()
+
+    cf = CollaborativeFiltering(loader.user_item_matrix, loader.user_mapper, loader.book_mapper,
+                                precision=precision)
+    cbf = ContentBasedFiltering(books_df, book_mapper=loader.book_mapper, precision=precision)
+    # Everything lazy is built here so worker processes inherit it
+    cf.calculate_user_similarity()
+    cf.calculate_item_similarity()
+    cf.matrix_factorization()
+    cbf.prepare_features()
+    return {'loader': loader, 'cf': cf, 'cbf': cbf, 'hybrid': HybridRecommender(cf, cbf, loader)}
+
+
+def _recommend(models, name, user_id, history, n):
+    """Book ids from one recommender for one user, excluding their training books"""
+    if name == 'popularity':
+        rated = {book_id for book_id, _ in history}
+        book_ids, _, _ = models['loader'].get_aggregates().most_popular(n + len(rated))
+        return [b for b in book_ids if b not in rated][:n]
+    if name == 'user_based':
+        return models['cf'].user_based_recommendations(user_id, n)[0]
+    if name == 'item_based':
+        return models['cf'].item_based_recommendations(user_id, n)[0]
+    if name == 'mf':
+        return models['cf'].mf_recommendations(user_id, n)[0]
+    if name == 'content':
+        return models['cbf'].recommend_based_on_history(history, n)[0]
+    if name == 'hybrid':
+        alpha = models.get('alpha', 0.5)
+        return models['hybrid'].hybrid_recommendations(user_id, n, alpha).book_ids
+    raise ValueError(f"Unknown recommender: {name}")
+
+
+# Worker-side models (set once per worker by the initializer)
+_WORKER_MODELS = None
+
+
+def _init_worker(models):
+    global _WORKER_MODELS
+    _WORKER_MODELS = models
+
+
+def recommend_users(user_ids, recommenders, k, models=None):
+    """(users x k) book-index matrix per recommender, plus the seconds each took"""
+    models = models if models is not None else _WORKER_MODELS
+    loader = models['loader']
+    history_by_user = {
+        user_id: list(zip(group['book_id'], group['rating']))
+        for user_id, group in loader.get_ratings_for_users(user_ids).groupby('user_id', sort=False)
+    }
+
+    recs, seconds = {}, {}
+    for name in recommenders:
+        matrix = np.full((len(user_ids), k), -1, dtype=np.int64)
+        t0 = time.perf_counter()
+        for row, user_id in enumerate(user_ids):
+            book_ids = np.asarray(_recommend(models, name, user_id, history_by_user.get(user_id, []), k))[:k]
+            matrix[row, :len(book_ids)] = loader.book_mapper.to_index(book_ids)
+        seconds[name] = time.perf_counter() - t0
+        recs[name] = matrix
+    return recs, seconds
+
+
+# =========================
+# Evaluation
+# =========================
+def evaluate(books_df, ratings_df, split='leave_k_out', k=10, seed=42, n_workers=1,
+             recommenders=RECOMMENDERS, relevance_threshold=4.0, max_users=None,
+             precision=None, **split_kwargs):
+    """Fit on a seeded split, recommend in batch and score against the held-out ratings.
+
+    Returns a JSON-serialisable dict with split sizes, fit/recommend timings,
+    MF RMSE on held-out ratings and ranking metrics per recommender.
+    """
+    train_df, test_df = SPLITS[split](ratings_df, seed=seed, **split_kwargs)
+    t0 = time.perf_counter()
+    models = fit_models(books_df, train_df, precision)
+    fit_seconds = time.perf_counter() - t0
+    loader, cf = models['loader'], models['cf']
+
+    users = scorable_users(test_df, loader.user_mapper, max_users, seed)
+
+    # RMSE of MF predictions on held-out pairs known to the model
+    user_idx = loader.user_mapper.to_index(test_df['user_id'].to_numpy())
+    book_idx = loader.book_mapper.to_index(test_df['book_id'].to_numpy())
+    known = (user_idx >= 0) & (book_idx >= 0)
+    mf_rmse = None
+    if cf.user_factors is not None:
+        predicted = cf.predict_pairs(user_idx[known], book_idx[known])
+        mf_rmse = rmse(predicted, test_df['rating'].to_numpy()[known])
+
+    n_books = len(loader.book_mapper)
+    relevant_keys, n_relevant = relevance_keys(test_df, users, loader.book_mapper, relevance_threshold)
+
+    # Batch recommendations, chunked across a process pool
+    t0 = time.perf_counter()
+    if n_workers > 1 and len(users) > 1:
+        chunks = np.array_split(users, min(len(users), n_workers * 4))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(models,)) as pool:
+            parts = list(pool.map(recommend_users, chunks, [recommenders] * len(chunks),
+                                  [k] * len(chunks)))
+    else:
+        parts = [recommend_users(users, recommenders, k, models=models)]
+    recommend_seconds = time.perf_counter() - t0
+
+    metrics = {}
+    for name in recommenders:
+        recs = np.vstack([recs[name] for recs, _ in parts])
+        metrics[name] = ranking_metrics(recs, relevant_keys, n_relevant, n_books, k)
+        metrics[name]['seconds'] = sum(seconds[name] for _, seconds in parts)
+
+    return {
+        'split': split,
+        'seed': seed,
+        'k': k,
+        'relevance_threshold': relevance_threshold,
+        'n_train': len(train_df),
+        'n_test': len(test_df),
+        'n_users': len(users),
+        'n_workers': n_workers,
+        'fit_seconds': fit_seconds,
+        'recommend_seconds': recommend_seconds,
+        'rmse': {'mf': mf_rmse},
+        'metrics': metrics,
+    }
+
+
+def print_report(results):
+    k = results['k']
+    print(f"Split {results['split']} (seed {results['seed']}): {results['n_train']} train / "
+          f"{results['n_test']} test ratings, {results['n_users']} users")
+    print(f"Fit {results['fit_seconds']:.2f} s, recommend {results['recommend_seconds']:.2f} s "
+          f"on {results['n_workers']} worker(s)")
+    if results['rmse']['mf'] is not None:
+        print(f"MF RMSE: {results['rmse']['mf']:.3f}")
+    print(f"{'recommender':<12} {'P@' + str(k):>8} {'R@' + str(k):>8} {'NDCG@' + str(k):>9} "
+          f"{'coverage':>9} {'seconds':>8}")
+    for name, m in results['metrics'].items():
+        values = [m[f'precision@{k}'], m[f'recall@{k}'], m[f'ndcg@{k}']]
+        p, r, n = (f"{v:.4f}" if v is not None else "n/a" for v in values)
+        print(f"{name:<12} {p:>8} {r:>8} {n:>9} {m['coverage']:>9.3f} {m['seconds']:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', default='data/books.csv')
+    parser.add_argument('--ratings', default='data/ratings.csv')
+    parser.add_argument('--split', choices=sorted(SPLITS), default='leave_k_out')
+    parser.add_argument('-k', type=int, default=10, help='Cut-off for ranking metrics')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-users', type=int)
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = evaluate(pd.read_csv(args.books), pd.read_csv(args.ratings), split=args.split,
+                       k=args.k, seed=args.seed, n_workers=args.workers, max_users=args.max_users)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=float)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
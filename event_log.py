@@ -0,0 +1,383 @@
+"""Append-only binary log of rating events, compacted into a columnar base snapshot.
+
+Usage:
+    python event_log.py stats                 # records in the log and the base snapshot
+    python event_log.py compact               # merge data/ratings.log into data/ratings.base.npz
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_LOG_PATH = os.path.join('data', 'ratings.log')
+DEFAULT_RATINGS_PATH = os.path.join('data', 'ratings.csv')
+
+# Fixed-width little-endian records; a log file is a header plus whole records
+RECORD_DTYPE = np.dtype([('user_id', '<i8'), ('book_id', '<i8'), ('rating', '<f4'), ('timestamp', '<f8')])
+HEADER = struct.Struct('<4sHHQ')  # magic, format version, reserved, generation
+MAGIC = b'KRLG'
+FORMAT_VERSION = 1
+COLUMNS = ('user_id', 'book_id', 'rating', 'timestamp')
+
+
+def base_path_for(log_path):
+    """data/ratings.log -> data/ratings.base.npz"""
+    return os.path.splitext(log_path)[0] + '.base.npz'
+
+
+def compacting_path_for(log_path):
+    """Where the log is moved while a compaction merges it"""
+    return log_path + '.compacting'
+
+
+def _fsync_dir(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# =========================
+# Reading
+# =========================
+def read_header(f):
+    raw = f.read(HEADER.size)
+    if len(raw) < HEADER.size:
+        raise ValueError("rating log is missing its header")
+    magic, version, _, generation = HEADER.unpack(raw)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"not a rating log (magic {magic!r}, version {version})")
+    return generation
+
+
+def read_records(path, offset=None):
+    """(records, end offset, generation) of the complete records from offset on.
+
+    A partially written last record (from a crash mid-append) is ignored.
+    """
+    with open(path, 'rb') as f:
+        generation = read_header(f)
+        offset = HEADER.size if offset is None else offset
+        f.seek(offset)
+        raw = f.read()
+    n = len(raw) // RECORD_DTYPE.itemsize
+    records = np.frombuffer(raw[:n * RECORD_DTYPE.itemsize], dtype=RECORD_DTYPE)
+    return records, offset + n * RECORD_DTYPE.itemsize, generation
+
+
+def records_to_frame(records):
+    return pd.DataFrame({column: records[column] for column in COLUMNS})
+
+
+def latest_ratings(ratings_df):
+    """One row per (user_id, book_id): the one with the latest timestamp (later rows win ties).
+
+    Rows come back in timestamp order.
+    """
+    ordered = ratings_df.sort_values('timestamp', kind='stable')
+    return ordered.drop_duplicates(['user_id', 'book_id'], keep='last').reset_index(drop=True)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_fingerprint(ratings_path):
+    """[size, mtime_ns, sha256] of the ratings CSV a base snapshot is built from (empty if none)"""
+    if ratings_path is None or not os.path.exists(ratings_path):
+        return np.array(['', '', ''])
+    stat = os.stat(ratings_path)
+    return np.array([str(stat.st_size), str(stat.st_mtime_ns), _file_digest(ratings_path)])
+
+
+def same_source(ratings_path, source):
+    """Whether ratings_path is still the CSV a stored fingerprint describes.
+
+    Size and mtime settle it without reading the file; a touched or
+    re-copied CSV with the same size is compared by content hash.
+    """
+    size, mtime_ns, digest = (str(part) for part in source)
+    if not size:
+        return False
+    stat = os.stat(ratings_path)
+    if stat.st_size != int(size):
+        return False
+    return stat.st_mtime_ns == int(mtime_ns) or _file_digest(ratings_path) == digest
+
+
+def read_base(base_path, ratings_path=DEFAULT_RATINGS_PATH):
+    """The base ratings: the compacted snapshot, or the CSV if there is none or it was replaced.
+
+    The snapshot records the CSV it was built from (source_fingerprint); a
+    different CSV means the dataset was replaced and the snapshot is
+    ignored. Snapshots written without a fingerprint are always used. CSV
+    ratings without a timestamp column are stamped with the file's
+    modification time, so every logged event counts as newer.
+    """
+    csv_exists = ratings_path is not None and os.path.exists(ratings_path)
+    if os.path.exists(base_path):
+        with np.load(base_path) as base:
+            if not csv_exists or 'source' not in base.files or same_source(ratings_path, base['source']):
+                return pd.DataFrame({column: base[column] for column in COLUMNS})
+
+    ratings = pd.read_csv(ratings_path)
+    if 'timestamp' not in ratings.columns:
+        ratings['timestamp'] = os.path.getmtime(ratings_path)
+    return ratings
+
+
+class LogTail:
+    """Reads the records appended to a log since the previous read.
+
+    Tracks (generation, offset). If a compaction rotated the log, the rest of
+    the old generation is read from the compacting file; if that is already
+    gone, read_new() returns None and the caller must reload base + tail.
+    """
+
+    def __init__(self, path, generation=None, offset=None):
+        self.path = path
+        self.generation = generation
+        self.offset = offset
+
+    def read_new(self):
+        if not os.path.exists(self.path):
+            return records_to_frame(np.zeros(0, dtype=RECORD_DTYPE))
+        with open(self.path, 'rb') as f:
+            generation = read_header(f)
+
+        parts = []
+        if self.generation is not None and generation != self.generation:
+            compacting = compacting_path_for(self.path)
+            if not os.path.exists(compacting):
+                return None
+            records, _, old_generation = read_records(compacting, self.offset)
+            if old_generation != self.generation:
+                return None
+            parts.append(records)
+            self.offset = None
+
+        records, self.offset, self.generation = read_records(self.path, self.offset)
+        parts.append(records)
+        return records_to_frame(np.concatenate(parts))
+
+    def n_unread(self):
+        """Records in the current log that read_new() has not returned yet (a size check, no read)"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            generation = read_header(f)
+            size = os.fstat(f.fileno()).st_size
+        offset = self.offset if self.offset is not None and generation == self.generation else HEADER.size
+        return max(0, size - offset) // RECORD_DTYPE.itemsize
+
+    def copy(self):
+        return LogTail(self.path, self.generation, self.offset)
+
+
+def load_ratings(ratings_path=DEFAULT_RATINGS_PATH, log_path=DEFAULT_LOG_PATH):
+    """Base ratings plus every logged event, latest per (user, book); returns (ratings_df, LogTail)"""
+    frames = [read_base(base_path_for(log_path), ratings_path)]
+    compacting = compacting_path_for(log_path)
+    if os.path.exists(compacting):
+        # An interrupted (or running) compaction: its events may not be in the base yet
+        frames.append(records_to_frame(read_records(compacting)[0]))
+
+    tail = LogTail(log_path)
+    frames.append(tail.read_new())
+    return latest_ratings(pd.concat(frames, ignore_index=True)), tail
+
+
+# =========================
+# Writing
+# =========================
+class RatingEventLog:
+    """Durable append-only writer for rating events.
+
+    append() buffers records; they are written and fsynced together once
+    batch_size are buffered, or by a background flusher at most
+    flush_interval seconds after the first one (group commit). flush()
+    makes everything appended so far durable. Safe to share between
+    threads of one process; use a single writer process per log.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH, batch_size=1024, flush_interval=0.5):
+        self.path = path
+        self.base_path = base_path_for(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._n_buffered = 0
+        self._flusher = None
+        self._closed = False
+        self.n_fsyncs = 0
+        self._open()
+
+    def _open(self):
+        """Open (creating or repairing) the log for appending"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                self.generation = read_header(f)
+            size = os.path.getsize(self.path)
+            whole = HEADER.size + (size - HEADER.size) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+            if whole < size:
+                # Drop a torn last record so new records stay aligned
+                with open(self.path, 'r+b') as f:
+                    f.truncate(whole)
+        else:
+            compacting = compacting_path_for(self.path)
+            self.generation = 0
+            if os.path.exists(compacting):
+                with open(compacting, 'rb') as f:
+                    self.generation = read_header(f) + 1
+            self._create(self.path, self.generation)
+        self._file = open(self.path, 'ab')
+        self.n_records = (os.path.getsize(self.path) - HEADER.size) // RECORD_DTYPE.itemsize
+
+    @staticmethod
+    def _create(path, generation):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(path)
+
+    def append(self, user_id, book_id, rating, timestamp=None):
+        """Buffer one rating event (timestamp defaults to now)"""
+        self.append_many([user_id], [book_id], [rating], None if timestamp is None else [timestamp])
+
+    def append_many(self, user_ids, book_ids, ratings, timestamps=None):
+        """Buffer a batch of rating events"""
+        records = np.empty(len(user_ids), dtype=RECORD_DTYPE)
+        records['user_id'] = user_ids
+        records['book_id'] = book_ids
+        records['rating'] = ratings
+        records['timestamp'] = time.time() if timestamps is None else timestamps
+        with self._lock:
+            if self._closed:
+                raise ValueError("rating log is closed")
+            self._buffer.append(records)
+            self._n_buffered += len(records)
+            if self._n_buffered >= self.batch_size:
+                self._write_locked()
+            elif self.flush_interval is not None:
+                self._start_flusher()
+        return len(records)
+
+    def append_frame(self, ratings_df):
+        """Buffer the rows of a (user_id, book_id, rating[, timestamp]) frame"""
+        timestamps = ratings_df['timestamp'].to_numpy() if 'timestamp' in ratings_df.columns else None
+        return self.append_many(ratings_df['user_id'].to_numpy(), ratings_df['book_id'].to_numpy(),
+                                ratings_df['rating'].to_numpy(), timestamps)
+
+    def _write_locked(self):
+        if not self._buffer:
+            return
+        records = np.concatenate(self._buffer)
+        self._buffer = []
+        self._n_buffered = 0
+        self._file.write(records.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.n_fsyncs += 1
+        self.n_records += len(records)
+
+    def flush(self):
+        """Write and fsync everything buffered"""
+        with self._lock:
+            self._write_locked()
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Timer(self.flush_interval, self.flush)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def close(self):
+        with self._lock:
+            self._write_locked()
+            self._closed = True
+            self._file.close()
+        if self._flusher is not None:
+            self._flusher.cancel()
+
+    # =========================
+    # Compaction
+    # =========================
+    def compact(self, ratings_path=DEFAULT_RATINGS_PATH):
+        """Merge the logged events into the base snapshot and start a new, empty log.
+
+        The log is rotated under the lock (so appends only pause for a rename);
+        merging and writing the base happen outside it. Readers see every
+        event throughout: load_ratings() also reads the compacting file until
+        the new base is in place. Returns the number of rows in the new base.
+        """
+        compacting = compacting_path_for(self.path)
+        with self._lock:
+            self._write_locked()
+            if not os.path.exists(compacting):
+                self._file.close()
+                os.replace(self.path, compacting)
+                self.generation += 1
+                self._create(self.path, self.generation)
+                self._file = open(self.path, 'ab')
+                self.n_records = 0
+            # else: finish a compaction that was interrupted; the current log waits for the next one
+
+        # Taken before reading, so a CSV replaced meanwhile is not recorded as the source
+        source = source_fingerprint(ratings_path)
+        merged = latest_ratings(pd.concat([
+            read_base(self.base_path, ratings_path),
+            records_to_frame(read_records(compacting)[0]),
+        ], ignore_index=True))
+
+        tmp = self.base_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, source=source, **{column: merged[column].to_numpy() for column in COLUMNS})
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.base_path)
+        os.remove(compacting)
+        _fsync_dir(self.base_path)
+        return len(merged)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['stats', 'compact'])
+    parser.add_argument('--log', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--ratings', default=DEFAULT_RATINGS_PATH)
+    args = parser.parse_args(argv)
+
+    log = RatingEventLog(args.log)
+    try:
+        if args.command == 'compact':
+            n_logged = log.n_records
+            n_rows = log.compact(args.ratings)
+            print(f"Compacted {n_logged} logged events into {n_rows} base ratings ({log.base_path})")
+        else:
+            base = read_base(log.base_path, args.ratings)
+            print(f"Log: {log.n_records} events (generation {log.generation}) in {log.path}")
+            print(f"Base: {len(base)} ratings")
+    finally:
+        log.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
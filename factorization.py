@@ -0,0 +1,156 @@
+import time
+
+import numpy as np
+from scipy import sparse
+
+
+class FactorizationError(RuntimeError):
+    """Raised when a factorization fails or produces non-finite factors"""
+
+
+# =========================
+# Implicitly centered operator
+# =========================
+class CenteredOperator:
+    """R - a 1^T - 1 b^T for a sparse R, without materialising the dense offsets.
+
+    a holds one offset per row (e.g. user means) and b one per column (e.g.
+    item means); products with the centered matrix are the sparse product
+    plus two rank-one corrections.
+    """
+
+    def __init__(self, matrix, row_offsets=None, col_offsets=None):
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+        n_rows, n_cols = self.matrix.shape
+        self.shape = self.matrix.shape
+        self.a = np.zeros(n_rows) if row_offsets is None else np.asarray(row_offsets, dtype=np.float64)
+        self.b = np.zeros(n_cols) if col_offsets is None else np.asarray(col_offsets, dtype=np.float64)
+
+    def matmat(self, X):
+        return self.matrix @ X - np.outer(self.a, X.sum(axis=0)) - self.b @ X
+
+    def rmatmat(self, Y):
+        return self.matrix.T @ Y - self.a @ Y - np.outer(self.b, Y.sum(axis=0))
+
+    def squared_norm(self):
+        """||R - a 1^T - 1 b^T||_F^2, expanded so only sparse sums are needed"""
+        R = self.matrix
+        n_rows, n_cols = self.shape
+        a, b = self.a, self.b
+        row_sums = np.asarray(R.sum(axis=1)).ravel()
+        col_sums = np.asarray(R.sum(axis=0)).ravel()
+        return float(
+            R.multiply(R).sum()
+            + n_cols * a @ a + n_rows * b @ b
+            - 2 * a @ row_sums - 2 * b @ col_sums
+            + 2 * a.sum() * b.sum()
+        )
+
+
+# =========================
+# Randomized SVD
+# =========================
+def _orthonormal(Y):
+    """Orthonormal basis of Y's columns by CholeskyQR2 (two small Gram
+    factorizations and GEMMs), falling back to Householder QR if Y is too
+    ill-conditioned for Cholesky"""
+    try:
+        for _ in range(2):
+            L = np.linalg.cholesky(Y.T @ Y)
+            Y = Y @ np.linalg.inv(L).T
+        return Y
+    except np.linalg.LinAlgError:
+        Q, _ = np.linalg.qr(Y)
+        return Q
+
+
+def randomized_svd(operator, k, n_oversamples=10, n_iter=8, init=None, tol=1e-4, seed=0):
+    """Top-k SVD of a CenteredOperator by randomized range finding with power iterations.
+
+    init may hold previous right singular vectors (k' x n_cols, e.g. Vt from
+    the last fit); they seed the range finder so a refit after small data
+    changes needs few iterations. With tol set, iteration stops once the
+    largest relative change of the top-k singular values drops below it.
+
+    Returns (U, s, Vt, info); info holds the relative Frobenius residual
+    ||A - U S Vt|| / ||A||, the last singular-value change and the
+    number of iterations run.
+    """
+    n_rows, n_cols = operator.shape
+    if not 0 < k < min(n_rows, n_cols):
+        raise FactorizationError(f"rank {k} is out of range for a {n_rows}x{n_cols} matrix")
+
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    width = min(k + n_oversamples, min(n_rows, n_cols))
+    omega = rng.standard_normal((n_cols, width))
+    if init is not None:
+        warm = np.asarray(init, dtype=np.float64)[:width].T
+        omega[:, :warm.shape[1]] = warm
+
+    Q = _orthonormal(operator.matmat(omega))
+    sigma, change, iterations = None, None, 0
+    for iterations in range(1, n_iter + 1):
+        Z = operator.rmatmat(Q)
+        # Singular values of Z from its small Gram matrix
+        gram_eigs = np.linalg.eigvalsh(Z.T @ Z)[::-1][:k]
+        new_sigma = np.sqrt(np.maximum(gram_eigs, 0))
+        if sigma is not None:
+            change = float(np.max(np.abs(new_sigma - sigma) / np.maximum(new_sigma, 1e-12)))
+        sigma = new_sigma
+        Q = _orthonormal(operator.matmat(_orthonormal(Z)))
+        if tol is not None and change is not None and change < tol:
+            break
+
+    # Project onto the range and solve the small problem exactly
+    B = operator.rmatmat(Q).T
+    Ub, s, Vt = np.linalg.svd(B, full_matrices=False)
+    U = Q @ Ub[:, :k]
+    s, Vt = s[:k], Vt[:k]
+    if not (np.all(np.isfinite(U)) and np.all(np.isfinite(s)) and np.all(np.isfinite(Vt))):
+        raise FactorizationError("randomized SVD produced non-finite factors")
+
+    total = operator.squared_norm()
+    residual = np.sqrt(max(total - float(s @ s), 0.0) / total) if total > 0 else 0.0
+    info = {
+        'solver': 'randomized',
+        'rank': k,
+        'iterations': iterations,
+        'sigma_change': change,
+        'relative_residual': float(residual),
+        'warm_start': init is not None,
+        'seconds': time.perf_counter() - t0,
+    }
+    return U, s, Vt, info
+
+
+def svds_reference(operator, k, seed=0):
+    """ARPACK svds on the same implicit operator (for comparison)"""
+    from scipy.sparse.linalg import LinearOperator, svds
+
+    t0 = time.perf_counter()
+    linear = LinearOperator(
+        operator.shape, dtype=np.float64,
+        matvec=lambda x: operator.matmat(x.reshape(-1, 1)).ravel(),
+        rmatvec=lambda y: operator.rmatmat(y.reshape(-1, 1)).ravel(),
+        matmat=operator.matmat, rmatmat=operator.rmatmat,
+    )
+    try:
+        U, s, Vt = svds(linear, k=k, rng=np.random.default_rng(seed))
+    except Exception as e:
+        raise FactorizationError(f"svds failed: {e}") from e
+
+    order = np.argsort(-s)
+    U, s, Vt = U[:, order], s[order], Vt[order]
+    total = operator.squared_norm()
+    residual = np.sqrt(max(total - float(s @ s), 0.0) / total) if total > 0 else 0.0
+    info = {
+        'solver': 'svds',
+        'rank': k,
+        'iterations': None,
+        'sigma_change': None,
+        'relative_residual': float(residual),
+        'warm_start': False,
+        'seconds': time.perf_counter() - t0,
+    }
+    return U, s, Vt, info
@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from similarity import l2_normalize_rows
+
+
+def _hash_texts(texts, n_features, stop_words):
+    """Term counts for one chunk of documents (runs in worker processes)"""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    vectorizer = HashingVectorizer(
+        n_features=n_features,
+        alternate_sign=False,
+        norm=None,
+        stop_words=stop_words,
+    )
+    return vectorizer.transform(texts).tocsr()
+
+
+class HashedTfidf:
+    """TF-IDF over fixed-width hashed features with streaming IDF statistics.
+
+    There is no vocabulary: terms are hashed into n_features columns, so the
+    model is a document-frequency vector plus a document count. Chunks can be
+    hashed in parallel and in any order; the IDF only depends on the set of
+    documents seen, matching TfidfVectorizer(smooth_idf=True, norm='l2').
+    """
+
+    def __init__(self, n_features=2 ** 18, stop_words='english', n_workers=1):
+        self.n_features = n_features
+        self.stop_words = stop_words
+        self.n_workers = n_workers
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+
+    def hash_chunks(self, chunks):
+        """Raw term counts for each chunk of texts, in chunk order.
+
+        chunks may be a generator; in the serial path each chunk is released
+        as soon as it has been hashed.
+        """
+        args = (self.n_features, self.stop_words)
+        if self.n_workers > 1:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+                futures = [pool.submit(_hash_texts, list(chunk), *args) for chunk in chunks]
+                return [f.result() for f in futures]
+        return [_hash_texts(list(chunk), *args) for chunk in chunks]
+
+    def partial_fit(self, counts):
+        """Add the documents in a count matrix to the IDF statistics"""
+        counts = counts.tocsr()
+        counts.sum_duplicates()
+        self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+        return self
+
+    @property
+    def idf(self):
+        return np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+
+    def weight(self, counts):
+        """Apply the current IDF and L2-normalise rows"""
+        weighted = counts.tocsr() @ sparse.diags(self.idf)
+        return l2_normalize_rows(weighted)
+
+    def fit_transform_chunks(self, chunks):
+        """Hash all chunks, update the IDF statistics, and return weighted features"""
+        counts = self.hash_chunks(chunks)
+        for chunk_counts in counts:
+            self.partial_fit(chunk_counts)
+        if not counts:
+            return sparse.csr_matrix((0, self.n_features))
+        stacked = sparse.vstack(counts).tocsr()
+        del counts  # drop the per-chunk copies before weighting
+        return self.weight(stacked)
+
+    def transform(self, texts):
+        """Weighted features for new texts using the current statistics"""
+        return self.weight(sparse.vstack(self.hash_chunks([texts])).tocsr())
@@ -3,21 +3,30 @@ import pandas as pd
 import numpy as np
 import sys
 import os
+import time
 
 
 # Add your project modules to the path
 sys.path.append('.')
 try:
+    from cooccurrence import CooccurrenceEngine
     from data_loader import DataLoader
-    from collaborative_filtering import CollaborativeFiltering
-    from content_based import ContentBasedFiltering
-    from hybrid_recommender import HybridRecommender
+    import instrumentation
+    from precision import PrecisionPolicy
+    from scheduler import ModelHandle, RetrainScheduler, build_models
+    from event_log import RatingEventLog, DEFAULT_LOG_PATH
+    from prefetch import RecommendationPrefetcher
+    from results import RecommendationBlock
 except ImportError:
     # Try direct import
+    from cooccurrence import CooccurrenceEngine
     from data_loader import DataLoader
-    from collaborative_filtering import CollaborativeFiltering
-    from content_based import ContentBasedFiltering
-    from hybrid_recommender import HybridRecommender
+    import instrumentation
+    from precision import PrecisionPolicy
+    from scheduler import ModelHandle, RetrainScheduler, build_models
+    from event_log import RatingEventLog, DEFAULT_LOG_PATH
+    from prefetch import RecommendationPrefetcher
+    from results import RecommendationBlock
 
 
 # Page configuration
@@ -176,23 +185,55 @@ section[data-testid="stSidebar"] div[role="radiogroup"] label:hover {
 if 'data_loaded' not in st.session_state:
     st.session_state.data_loaded = False
 
+instrumentation.enable_from_env()
+
+
+# Background retraining after this many new ratings, or on this timer while any are pending
+RETRAIN_MIN_RATINGS = 50
+RETRAIN_INTERVAL_SECONDS = 300
+PREVIEW_PAGE_SIZES = [25, 50, 100, 250]
+HYBRID_RECOMMENDATIONS = 5
+COOCCURRENCE_SEED_RATINGS = 50000
+
+
+def use_current_models():
+    """Pin the latest model snapshot for this script run"""
+    snapshot = st.session_state.models.get()
+    st.session_state.snapshot = snapshot
+    st.session_state.data_loader = snapshot.data_loader
+    st.session_state.cf = snapshot.cf
+    st.session_state.cbf = snapshot.cbf
+    st.session_state.hybrid = snapshot.hybrid
+
 
 def load_data():
     """Load data and initialize recommenders"""
     try:
-        data_loader = DataLoader()
-        if data_loader.load_data():
-            data_loader.create_user_item_matrix()
-            
-            # Initialize recommenders
-            cf = CollaborativeFiltering(data_loader.user_item_matrix)
-            cbf = ContentBasedFiltering(data_loader.books_df)
-            hybrid = HybridRecommender(cf, cbf, data_loader)
+        data_loader = DataLoader.from_env()
+        if data_loader.load_data(log_path=DEFAULT_LOG_PATH):
+            # Fit every model up front; retrains then run in a background thread
+            precision = PrecisionPolicy.from_env()
+            artifact_path = os.path.join('artifacts', 'content_features.npz')
+            # "Readers also liked" lists: seeded from the latest ratings, then updated per rating
+            cooccurrence = CooccurrenceEngine()
+            cooccurrence.consume(data_loader.get_recent_ratings(COOCCURRENCE_SEED_RATINGS))
+            models = ModelHandle(build_models(data_loader, precision=precision, artifact_path=artifact_path,
+                                              cooccurrence=cooccurrence))
             
-            st.session_state.data_loader = data_loader
-            st.session_state.cf = cf
-            st.session_state.cbf = cbf
-            st.session_state.hybrid = hybrid
+            if 'scheduler' in st.session_state:
+                st.session_state.scheduler.stop()
+                st.session_state.event_log.close()
+                st.session_state.prefetcher.shutdown()
+            st.session_state.models = models
+            st.session_state.cooccurrence = cooccurrence
+            st.session_state.event_log = RatingEventLog(DEFAULT_LOG_PATH)
+            st.session_state.scheduler = RetrainScheduler(
+                models, min_new_ratings=RETRAIN_MIN_RATINGS, interval_seconds=RETRAIN_INTERVAL_SECONDS,
+                precision=precision, artifact_path=artifact_path, event_log=st.session_state.event_log,
+                cooccurrence=cooccurrence
+            ).start()
+            st.session_state.prefetcher = RecommendationPrefetcher()
+            use_current_models()
             st.session_state.data_loaded = True
             
             return True
@@ -252,22 +293,64 @@ def main():
                 st.error(f"Error: {str(e)}")
 
 
+        st.subheader("Performance")
+        profiling = st.toggle("⏱️ Instrumentation", value=instrumentation.is_enabled())
+        if profiling and not instrumentation.is_enabled():
+            instrumentation.enable()
+        elif not profiling and instrumentation.is_enabled():
+            instrumentation.disable()
+
+
+        if st.session_state.data_loaded:
+            st.subheader("Model")
+            scheduler = st.session_state.scheduler
+            status = scheduler.status()
+            st.caption(f"Version {status['version']} · {status['pending_ratings']} new ratings pending"
+                       + (" · retraining…" if status['building'] else ""))
+            if status['last_error']:
+                st.warning(f"Last retrain failed: {status['last_error']}")
+            prefetch = st.session_state.prefetcher.status()
+            st.caption(f"Prefetch: {prefetch['hits']} ready · {prefetch['misses']} waited · {prefetch['cancelled']} cancelled")
+
+            with st.expander("⭐ Rate a Book"):
+                with st.form("rate_book", clear_on_submit=True):
+                    user_id = st.number_input("User ID", min_value=1, step=1)
+                    book_id = st.number_input("Book ID", min_value=1, step=1)
+                    rating = st.slider("Rating", 1, 5, 4)
+                    if st.form_submit_button("Submit rating"):
+                        if book_id not in st.session_state.data_loader.book_mapper:
+                            st.error(f"Book with ID {book_id} not found.")
+                        else:
+                            rating_df = pd.DataFrame({'user_id': [int(user_id)], 'book_id': [int(book_id)],
+                                                      'rating': [rating], 'timestamp': [time.time()]})
+                            st.session_state.event_log.append_frame(rating_df)
+                            st.session_state.event_log.flush()
+                            scheduler.add_ratings(rating_df)
+                            st.success("Rating saved; it is used from the next model update.")
+
+            if st.button("🔁 Retrain now", width='stretch'):
+                scheduler.request_retrain()
+                st.info("Retraining in the background; new models are used once ready.")
+
+
     # Load data
     if not st.session_state.data_loaded:
         with st.spinner("Loading data and initializing system..."):
             if not load_data():
                 st.error("⚠️ Failed to load data. Click 'Generate Sample Data' above.")
                 return
+    else:
+        # A background retrain may have swapped in newer models since the last run
+        use_current_models()
 
 
     data_loader = st.session_state.data_loader
     books_df = data_loader.books_df
-    ratings_df = data_loader.ratings_df
 
 
     # Main content routing
     if menu == "🏠 Dashboard":
-        show_dashboard(books_df, ratings_df)
+        show_dashboard(books_df)
     elif menu == "📚 Browse Books":
         browse_books(books_df)
     elif menu == "🤝 Collaborative":
@@ -277,7 +360,7 @@ def main():
     elif menu == "🌟 Hybrid":
         hybrid_recommendations()
     elif menu == "📊 Statistics":
-        show_statistics(books_df, ratings_df)
+        show_statistics()
 
 
     # ✅ FOOTER (ALWAYS VISIBLE)
@@ -291,21 +374,22 @@ def main():
 
 
 
-def show_dashboard(books_df, ratings_df):
+def show_dashboard(books_df):
     """Display dashboard"""
     st.header("📊 Dashboard Overview")
+    aggregates = st.session_state.data_loader.get_aggregates()
     
     # Metrics
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.metric("📚 Total Books", len(books_df))
+        st.metric("📚 Total Books", aggregates.n_books)
     with col2:
-        st.metric("👥 Total Users", ratings_df['user_id'].nunique())
+        st.metric("👥 Total Users", aggregates.n_users)
     with col3:
-        st.metric("⭐ Total Ratings", len(ratings_df))
+        st.metric("⭐ Total Ratings", aggregates.n_ratings)
     with col4:
-        avg_rating = books_df['rating'].mean() if 'rating' in books_df.columns else 0
+        avg_rating = aggregates.catalog_avg_rating or 0
         st.metric("📈 Avg Book Rating", f"{avg_rating:.2f}")
     
     st.markdown("---")
@@ -316,19 +400,17 @@ def show_dashboard(books_df, ratings_df):
     with col1:
         st.subheader("📈 Book Ratings Distribution")
         if 'rating' in books_df.columns:
-            rating_counts = books_df['rating'].value_counts().sort_index()
-            st.bar_chart(rating_counts)
+            st.bar_chart(aggregates.catalog_rating_counts)
     
     with col2:
         st.subheader("📚 Books by Genre")
         if 'genre' in books_df.columns:
-            genre_counts = books_df['genre'].value_counts()
-            st.dataframe(genre_counts, width='stretch')
+            st.dataframe(aggregates.genre_counts, width='stretch')
     
     # Top books
     st.subheader("🏆 Top Rated Books")
     if 'rating' in books_df.columns and 'title' in books_df.columns and 'author' in books_df.columns:
-        top_books = books_df.nlargest(10, 'rating')[['title', 'author', 'genre', 'rating']]
+        top_books = books_df.iloc[aggregates.top_catalog_rows][['title', 'author', 'genre', 'rating']]
         for _, book in top_books.iterrows():
             with st.container():
                 col1, col2 = st.columns([4, 1])
@@ -344,6 +426,10 @@ def browse_books(books_df):
     """Browse books interface"""
     st.header("📚 Browse Book Collection")
     
+    # Inverted index, facets and rating order are built once per data version
+    search_index = st.session_state.data_loader.get_search_index()
+    page_size = 30
+    
     # Search and filters
     col1, col2, col3 = st.columns(3)
     
@@ -351,8 +437,8 @@ def browse_books(books_df):
         search = st.text_input("🔍 Search books", placeholder="Title or author...")
     
     with col2:
-        if 'genre' in books_df.columns:
-            genres = ["All Genres"] + list(books_df['genre'].unique())
+        if search_index.genres:
+            genres = ["All Genres"] + search_index.genres
             genre_filter = st.selectbox("Filter by genre", genres)
         else:
             genre_filter = "All Genres"
@@ -361,37 +447,28 @@ def browse_books(books_df):
         if 'rating' in books_df.columns:
             min_rating = st.slider("⭐ Minimum rating", 1.0, 5.0, 3.0, 0.5)
         else:
-            min_rating = 0
+            min_rating = None
     
-    # Filter books
-    filtered_books = books_df.copy()
-    
-    if search:
-        if 'title' in books_df.columns:
-            mask_title = filtered_books['title'].str.contains(search, case=False, na=False)
-        else:
-            mask_title = False
-        
-        if 'author' in books_df.columns:
-            mask_author = filtered_books['author'].str.contains(search, case=False, na=False)
-        else:
-            mask_author = False
-        
-        filtered_books = filtered_books[mask_title | mask_author]
-    
-    if genre_filter != "All Genres" and 'genre' in books_df.columns:
-        filtered_books = filtered_books[filtered_books['genre'] == genre_filter]
-    
-    if 'rating' in books_df.columns:
-        filtered_books = filtered_books[filtered_books['rating'] >= min_rating]
+    # Filter books (first page, to learn the total)
+    genre = None if genre_filter == "All Genres" else genre_filter
+    total, rows = search_index.search(search, genre=genre, min_rating=min_rating, limit=page_size)
     
     # Display results
-    st.subheader(f"📖 Found {len(filtered_books)} books")
-    
-    if len(filtered_books) > 0:
+    st.subheader(f"📖 Found {total} books")
+    
+    if total > 0:
+        n_pages = (total + page_size - 1) // page_size
+        if n_pages > 1:
+            page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1)
+            if page > 1:
+                _, rows = search_index.search(
+                    search, genre=genre, min_rating=min_rating,
+                    offset=(page - 1) * page_size, limit=page_size
+                )
+        
         # Display 3 per row
         cols = st.columns(3)
-        for idx, (_, book) in enumerate(filtered_books.head(30).iterrows()):  # Limit to 30
+        for idx, (_, book) in enumerate(books_df.iloc[rows].iterrows()):
             with cols[idx % 3]:
                 with st.container():
                     title = book.get('title', 'Unknown Title')
@@ -421,6 +498,8 @@ def collaborative_recommendations():
     
     with col1:
         user_id = st.number_input("👤 Enter User ID", min_value=1, max_value=50, value=1)
+        # Start every algorithm for this user in the background while the options are picked
+        st.session_state.prefetcher.prefetch(st.session_state.snapshot, user_id, HYBRID_RECOMMENDATIONS)
         
         algorithm = st.radio(
             "Select algorithm:",
@@ -438,33 +517,27 @@ def collaborative_recommendations():
         if 'cf_user' in st.session_state:
             with st.spinner(f"Generating {st.session_state.cf_algo} recommendations..."):
                 try:
-                    cf = st.session_state.cf
                     user_id = st.session_state.cf_user
+                    kind = {"User-Based": "user", "Item-Based": "item"}.get(st.session_state.cf_algo, "mf")
+                    # Usually already computed by the prefetcher
+                    book_ids, scores = st.session_state.prefetcher.get(
+                        st.session_state.snapshot, user_id, kind, st.session_state.cf_num
+                    )
                     
-                    if st.session_state.cf_algo == "User-Based":
-                        indices, scores = cf.user_based_recommendations(user_id, st.session_state.cf_num)
-                    elif st.session_state.cf_algo == "Item-Based":
-                        indices, scores = cf.item_based_recommendations(user_id, st.session_state.cf_num)
-                    else:
-                        cf.matrix_factorization()
-                        indices, scores = cf.mf_recommendations(user_id, st.session_state.cf_num)
-                    
-                    # Display
-                    data_loader = st.session_state.data_loader
-                    st.success(f"Top {len(indices)} recommendations for User {user_id}:")
+                    # Display (titles and authors are looked up for the whole list at once)
+                    recommendations = RecommendationBlock.from_arrays(
+                        book_ids, scores, user_id, st.session_state.data_loader
+                    )
+                    st.success(f"Top {len(book_ids)} recommendations for User {user_id}:")
                     
-                    for i, (idx, score) in enumerate(zip(indices, scores), 1):
-                        book_id = idx + 1
-                        book_info = data_loader.get_book_info(book_id)
-                        
-                        if book_info:
-                            col1, col2 = st.columns([4, 1])
-                            with col1:
-                                st.markdown(f"**{i}. {book_info.get('title', f'Book {book_id}')}**")
-                                st.caption(f"by {book_info.get('author', 'Unknown')}")
-                            with col2:
-                                st.metric("Score", f"{score:.3f}")
-                            st.divider()
+                    for i, rec in enumerate(recommendations, 1):
+                        col1, col2 = st.columns([4, 1])
+                        with col1:
+                            st.markdown(f"**{i}. {rec.get('title', 'Unknown Title')}**")
+                            st.caption(f"by {rec.get('author', 'Unknown')}")
+                        with col2:
+                            st.metric("Score", f"{rec['score']:.3f}")
+                        st.divider()
                     
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
@@ -481,59 +554,87 @@ def content_based_recommendations(books_df):
     with tab1:
         st.subheader("Find books similar to:")
         if 'title' in books_df.columns and 'author' in books_df.columns:
-            # Create book selection
-            book_options = books_df.apply(
-                lambda x: f"{x['title']} by {x['author']}", 
-                axis=1
-            ).tolist()
+            # Typeahead picker: only one page of search hits is sent to the browser
+            labels, label_to_id = st.session_state.data_loader.get_book_labels()
+            search_index = st.session_state.data_loader.get_search_index()
+            page_size = 50
             
-            selected_book = st.selectbox("Select a book", book_options)
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                query = st.text_input("🔍 Type to find a book", placeholder="Title or author...", key="cbf_book_query")
+            total, rows = search_index.search(query, limit=page_size)
+            n_pages = max(1, (total + page_size - 1) // page_size)
+            with col2:
+                page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1, key="cbf_book_page")
+            if page > 1:
+                _, rows = search_index.search(query, offset=(page - 1) * page_size, limit=page_size)
+            
+            selected_book = st.selectbox(f"Select a book ({total} matches)", labels[rows].tolist(), key="cbf_book_select")
             
             if selected_book:
                 # Find book ID
-                mask = books_df.apply(
-                    lambda x: f"{x['title']} by {x['author']}", 
-                    axis=1
-                ) == selected_book
+                book_id = label_to_id.get(selected_book)
                 
-                if mask.any() and st.button("🔍 Find Similar Books", width='stretch'):
-                    book_id = books_df[mask]['book_id'].values[0]
-                    
+                if book_id is not None and st.button("🔍 Find Similar Books", width='stretch'):
                     with st.spinner("Finding similar books..."):
                         try:
                             cbf = st.session_state.cbf
-                            indices, scores = cbf.get_similar_books(book_id, 5)
+                            similar_ids, scores = cbf.get_similar_books(book_id, 5)
+                            similar = RecommendationBlock.from_arrays(
+                                similar_ids, scores, data_loader=st.session_state.data_loader,
+                                metadata=('title', 'author', 'genre', 'year', 'rating')
+                            )
                             
                             st.success(f"Books similar to '{selected_book}':")
-                            for idx, score in zip(indices, scores):
-                                book_id = idx + 1
-                                book_info = st.session_state.data_loader.get_book_info(book_id)
-                                
-                                if book_info:
-                                    with st.expander(f"{book_info.get('title', f'Book {book_id}')} (Score: {score:.3f})"):
-                                        st.write(f"**Author:** {book_info.get('author', 'Unknown')}")
-                                        st.write(f"**Genre:** {book_info.get('genre', 'Unknown')}")
-                                        st.write(f"**Year:** {book_info.get('year', 'Unknown')}")
-                                        st.write(f"**Rating:** ⭐ {book_info.get('rating', 'N/A')}/5")
+                            for rec in similar:
+                                with st.expander(f"{rec.get('title', 'Unknown Title')} (Score: {rec['score']:.3f})"):
+                                    st.write(f"**Author:** {rec.get('author', 'Unknown')}")
+                                    st.write(f"**Genre:** {rec.get('genre', 'Unknown')}")
+                                    st.write(f"**Year:** {rec.get('year', 'Unknown')}")
+                                    st.write(f"**Rating:** ⭐ {rec.get('rating', 'N/A')}/5")
+                            
+                            also_ids, also_scores = st.session_state.cooccurrence.also_liked(book_id, 5)
+                            if len(also_ids):
+                                st.subheader("Readers also liked")
+                                also_liked = RecommendationBlock.from_arrays(
+                                    also_ids, also_scores, data_loader=st.session_state.data_loader
+                                )
+                                st.dataframe(also_liked.to_frame(['title', 'author', 'genre', 'score']),
+                                             hide_index=True)
                             
                         except Exception as e:
                             st.error(f"Error: {str(e)}")
     
     with tab2:
         st.subheader("Based on your preferences")
+        popularity = st.session_state.data_loader.get_popularity()
         
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         
         with col1:
-            if 'genre' in books_df.columns:
-                genres = st.multiselect("Favorite genres:", books_df['genre'].unique().tolist())
+            genres = st.multiselect("Favorite genres:", popularity.values('genre'))
         
         with col2:
-            if 'author' in books_df.columns:
-                authors = st.multiselect("Favorite authors:", books_df['author'].unique().tolist()[:10])
+            authors = st.multiselect("Favorite authors:", popularity.values('author'))
+        
+        with col3:
+            decades = st.multiselect("Favorite decades:", popularity.values('decade'),
+                                     format_func=lambda d: f"{d}s")
         
         if st.button("🎯 Get Recommendations", width='stretch'):
-            st.info("Preferences-based recommendations coming soon!")
+            recommendations = st.session_state.hybrid.preference_recommendations(
+                genres, authors, decades, n_recommendations=10
+            )
+            
+            if recommendations:
+                st.success("Popular books matching your preferences:")
+                for rec in recommendations:
+                    with st.expander(f"{rec['title']} (Score: {rec['score']:.3f})"):
+                        st.write(f"**Author:** {rec['author']}")
+                        st.write(f"**Genre:** {rec['genre']}")
+                        st.write(f"**Year:** {rec['year']}")
+            else:
+                st.warning("No rated books match these preferences yet.")
 
 
 def hybrid_recommendations():
@@ -553,6 +654,7 @@ def hybrid_recommendations():
             help="0.0 = Only Content-Based, 1.0 = Only Collaborative",
             key="hybrid_weight"
         )
+        st.session_state.prefetcher.prefetch(st.session_state.snapshot, user_id, HYBRID_RECOMMENDATIONS, weight)
         
         if st.button("🚀 Generate Hybrid Recommendations", type="primary", width='stretch'):
             st.session_state.hybrid_user = user_id
@@ -562,10 +664,11 @@ def hybrid_recommendations():
         if 'hybrid_user' in st.session_state:
             with st.spinner("Combining algorithms for optimal recommendations..."):
                 try:
-                    hybrid = st.session_state.hybrid
-                    recommendations = hybrid.hybrid_recommendations(
+                    recommendations = st.session_state.prefetcher.get(
+                        st.session_state.snapshot,
                         st.session_state.hybrid_user,
-                        n_recommendations=5,
+                        "hybrid",
+                        HYBRID_RECOMMENDATIONS,
                         alpha=st.session_state.hybrid_alpha
                     )
                     
@@ -588,9 +691,10 @@ def hybrid_recommendations():
             st.info("👈 Enter user ID and click 'Generate Recommendations'")
 
 
-def show_statistics(books_df, ratings_df):
+def show_statistics():
     """Show statistics"""
     st.header("📊 System Statistics")
+    aggregates = st.session_state.data_loader.get_aggregates()
     
     # Basic stats
     col1, col2 = st.columns(2)
@@ -598,12 +702,12 @@ def show_statistics(books_df, ratings_df):
     with col1:
         st.subheader("📚 Books Information")
         stats_books = {
-            "Total Books": len(books_df),
-            "Unique Authors": books_df['author'].nunique() if 'author' in books_df.columns else 0,
-            "Unique Genres": books_df['genre'].nunique() if 'genre' in books_df.columns else 0,
-            "Average Rating": f"{books_df['rating'].mean():.2f}" if 'rating' in books_df.columns else "N/A",
-            "Oldest Year": int(books_df['year'].min()) if 'year' in books_df.columns else "N/A",
-            "Newest Year": int(books_df['year'].max()) if 'year' in books_df.columns else "N/A"
+            "Total Books": aggregates.n_books,
+            "Unique Authors": aggregates.n_authors,
+            "Unique Genres": aggregates.n_genres,
+            "Average Rating": f"{aggregates.catalog_avg_rating:.2f}" if aggregates.catalog_avg_rating is not None else "N/A",
+            "Oldest Year": aggregates.year_min if aggregates.year_min is not None else "N/A",
+            "Newest Year": aggregates.year_max if aggregates.year_max is not None else "N/A"
         }
         
         for key, value in stats_books.items():
@@ -612,11 +716,11 @@ def show_statistics(books_df, ratings_df):
     with col2:
         st.subheader("⭐ Ratings Information")
         stats_ratings = {
-            "Total Ratings": len(ratings_df),
-            "Unique Users": ratings_df['user_id'].nunique() if 'user_id' in ratings_df.columns else 0,
-            "Average Rating": f"{ratings_df['rating'].mean():.2f}" if 'rating' in ratings_df.columns else "N/A",
-            "Min Rating": int(ratings_df['rating'].min()) if 'rating' in ratings_df.columns else "N/A",
-            "Max Rating": int(ratings_df['rating'].max()) if 'rating' in ratings_df.columns else "N/A"
+            "Total Ratings": aggregates.n_ratings,
+            "Unique Users": aggregates.n_users,
+            "Average Rating": f"{aggregates.avg_rating:.2f}" if aggregates.avg_rating is not None else "N/A",
+            "Min Rating": int(aggregates.rating_min) if aggregates.rating_min is not None else "N/A",
+            "Max Rating": int(aggregates.rating_max) if aggregates.rating_max is not None else "N/A"
         }
         
         for key, value in stats_ratings.items():
@@ -628,12 +732,95 @@ def show_statistics(books_df, ratings_df):
     st.subheader("📋 Data Preview")
     
     tab1, tab2 = st.tabs(["Books Data", "Ratings Data"])
+    data_loader = st.session_state.data_loader
     
     with tab1:
-        st.dataframe(books_df, width='stretch')
+        genres = data_loader.get_search_index().genres
+        genre = st.selectbox("Genre", ["All Genres"] + genres, key="preview_books_genre") if genres else "All Genres"
+        filters = {'genre': None if genre == "All Genres" else genre}
+        show_data_page("preview_books", data_loader.get_books_page, list(data_loader.books_df.columns), filters)
     
     with tab2:
-        st.dataframe(ratings_df, width='stretch')
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            user_id = st.number_input("User ID (0 = all)", min_value=0, value=0, key="preview_ratings_user")
+        with col2:
+            book_id = st.number_input("Book ID (0 = all)", min_value=0, value=0, key="preview_ratings_book")
+        with col3:
+            rating_values = ["All"]
+            if aggregates.rating_min is not None:
+                rating_values += list(range(int(aggregates.rating_min), int(aggregates.rating_max) + 1))
+            rating = st.selectbox("Rating", rating_values, key="preview_ratings_rating")
+        filters = {
+            'user_id': int(user_id) or None,
+            'book_id': int(book_id) or None,
+            'rating': None if rating == "All" else rating,
+        }
+        show_data_page("preview_ratings", data_loader.get_ratings_page, data_loader.rating_columns, filters)
+    
+    show_performance_counters()
+
+
+def show_data_page(key, get_page, columns, filters):
+    """One server-side page of a table: only the visible rows and columns reach the browser"""
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    
+    with col1:
+        shown = st.multiselect("Columns", columns, default=columns, key=f"{key}_columns") or columns
+    with col2:
+        sort_by = st.selectbox("Sort by", ["(table order)"] + columns, key=f"{key}_sort")
+        sort_by = None if sort_by == "(table order)" else sort_by
+    with col3:
+        ascending = st.radio("Order", ["Asc", "Desc"], key=f"{key}_order", horizontal=True) == "Asc"
+    with col4:
+        page_size = st.selectbox("Rows", PREVIEW_PAGE_SIZES, index=1, key=f"{key}_page_size")
+    
+    page = st.number_input("Page", min_value=1, value=1, key=f"{key}_page")
+    total, frame = get_page(offset=(page - 1) * page_size, limit=page_size, columns=shown,
+                            sort_by=sort_by, ascending=ascending, filters=filters)
+    n_pages = max(1, (total + page_size - 1) // page_size)
+    if page > n_pages:
+        # Filters narrowed the result; show its last page
+        page = n_pages
+        total, frame = get_page(offset=(page - 1) * page_size, limit=page_size, columns=shown,
+                                sort_by=sort_by, ascending=ascending, filters=filters)
+    
+    st.dataframe(frame, width='stretch', hide_index=True)
+    first = (page - 1) * page_size + 1 if total else 0
+    st.caption(f"Rows {first}–{first + len(frame) - 1 if total else 0} of {total} · page {page} of {n_pages}")
+
+
+def show_performance_counters():
+    """Live instrumentation counters"""
+    st.markdown("---")
+    st.subheader("⏱️ Performance Counters")
+    
+    if not instrumentation.is_enabled():
+        st.info("Turn on 'Instrumentation' in the sidebar to collect timings.")
+        return
+    
+    snapshot = instrumentation.REGISTRY.snapshot()
+    if snapshot['stages']:
+        stages = pd.DataFrame.from_dict(snapshot['stages'], orient='index')
+        stages['avg_ms'] = stages['total_seconds'] / stages['calls'] * 1000
+        st.dataframe(stages.sort_values('total_seconds', ascending=False), width='stretch')
+    else:
+        st.caption("No instrumented calls yet.")
+    
+    if snapshot['cache']:
+        st.dataframe(pd.DataFrame.from_dict(snapshot['cache'], orient='index'), width='stretch')
+    
+    if snapshot['traces']:
+        last = snapshot['traces'][-1]
+        with st.expander(f"Last request trace: {last['name']}"):
+            st.dataframe(pd.DataFrame(last['spans']), width='stretch')
+    
+    with st.expander("Prometheus metrics"):
+        st.code(instrumentation.REGISTRY.to_prometheus(), language="text")
+    
+    if st.button("Reset counters"):
+        instrumentation.REGISTRY.reset()
+        st.rerun()
 
 
 if __name__ == "__main__":
@@ -1,81 +1,117 @@
 import numpy as np
 
+from results import RecommendationBlock
+
 class HybridRecommender:
-    def __init__(self, collaborative_filter, content_based_filter, data_loader):
+    def __init__(self, collaborative_filter, content_based_filter, data_loader, pipeline=None, cooccurrence=None):
         self.cf = collaborative_filter
         self.cbf = content_based_filter
         self.data_loader = data_loader
+        # Optional candidate-generation + re-ranking pipeline (see pipeline.py);
+        # without one every engine scores the full catalog
+        self.pipeline = pipeline
+        # Optional streaming co-occurrence engine (see cooccurrence.py) adding
+        # "readers also liked" candidates that reflect ratings since the last retrain
+        self.cooccurrence = cooccurrence
         
     def hybrid_recommendations(self, user_id, n_recommendations=5, alpha=0.5):
-        """Combine collaborative and content-based filtering"""
+        """Combine collaborative and content-based filtering; returns a RecommendationBlock.
+        
+        Candidates are the CF and content top lists (plus co-occurrence
+        partners), each scored alpha * MF prediction + (1 - alpha) * profile
+        similarity.
+        """
+        book_ids, scores = self._hybrid_scores(user_id, n_recommendations, alpha)
+        return self._describe(user_id, book_ids, scores)
+    
+    def hybrid_recommendations_batch(self, user_ids, n_recommendations=5, alpha=0.5):
+        """Hybrid recommendations of several users as one RecommendationBlock (see for_user)"""
+        blocks = [self._describe(user_id, *self._hybrid_scores(user_id, n_recommendations, alpha))
+                  for user_id in user_ids]
+        return RecommendationBlock.concat(blocks, self.data_loader)
+    
+    def mf_recommendations_batch(self, user_ids, n_recommendations=5):
+        """MF recommendations of several users as one RecommendationBlock, scored in one product"""
+        book_ids, scores = self.cf.mf_recommendations_batch(user_ids, n_recommendations)
+        blocks = [RecommendationBlock.from_arrays(ids, row, user_id, self.data_loader)
+                  for user_id, ids, row in zip(user_ids, book_ids, scores)]
+        return RecommendationBlock.concat(blocks, self.data_loader)
+    
+    def _hybrid_scores(self, user_id, n_recommendations, alpha):
+        """(book_ids, combined scores) of a user's top books"""
+        if self.pipeline is not None:
+            return self._pipeline_scores(user_id, n_recommendations, alpha)
+        
         # Get collaborative filtering recommendations
-        cf_indices, cf_scores = self.cf.mf_recommendations(user_id, n_recommendations * 2)
+        cf_book_ids, cf_scores = self.cf.mf_recommendations(user_id, n_recommendations * 2)
         
         # Get user's rated books for content-based filtering
         user_ratings = self.data_loader.get_user_ratings(user_id)
         rated_books = list(zip(user_ratings['book_id'], user_ratings['rating'])) if user_ratings is not None else []
         
         if rated_books:
-            cbf_indices, cbf_scores = self.cbf.recommend_based_on_history(rated_books, n_recommendations * 2)
+            cbf_book_ids, cbf_scores = self.cbf.recommend_based_on_history(rated_books, n_recommendations * 2)
         else:
             # If no ratings, use popular books as fallback
-            cbf_indices = list(range(n_recommendations * 2))
-            cbf_scores = [1.0] * (n_recommendations * 2)
-        
-        # Combine scores
-        combined_scores = {}
-        
-        # Add CF scores
-        for idx, score in zip(cf_indices, cf_scores):
-            book_id = idx + 1
-            combined_scores[book_id] = combined_scores.get(book_id, 0) + alpha * score
+            cbf_book_ids = self.cbf.book_mapper.to_id(np.arange(min(n_recommendations * 2, len(self.cbf.book_mapper))))
+            cbf_scores = [1.0] * len(cbf_book_ids)
         
-        # Add CBF scores
-        for idx, score in zip(cbf_indices, cbf_scores):
-            book_id = idx + 1
-            combined_scores[book_id] = combined_scores.get(book_id, 0) + (1 - alpha) * score
+        if not rated_books:
+            # No history to build a content profile from: fall back to the
+            # per-list sums (CF scores plus the popularity placeholder)
+            combined_scores = {}
+            for book_id, score in zip(cf_book_ids, cf_scores):
+                combined_scores[book_id] = combined_scores.get(book_id, 0) + alpha * score
+            for book_id, score in zip(cbf_book_ids, cbf_scores):
+                combined_scores[book_id] = combined_scores.get(book_id, 0) + (1 - alpha) * score
+        else:
+            # Candidates from CF, content and (when available) books liked together
+            # with the user's recent likes; every candidate gets both terms, as in
+            # the pipeline re-ranker, so scores share one scale for every user
+            rated = [book_id for book_id, _ in rated_books]
+            seen = set(rated)
+            candidates = [book_id for book_id in dict.fromkeys(list(cf_book_ids) + list(cbf_book_ids))
+                          if book_id not in seen]
+            if self.cooccurrence is not None:
+                liked = [book_id for book_id, rating in rated_books if rating >= self.cooccurrence.min_rating]
+                seen.update(candidates)
+                candidates += [book_id for book_id in self.cooccurrence.candidates(
+                    liked[::-1][:10], n_recommendations * 2, rated) if book_id not in seen]
+            scores = (alpha * self.cf.mf_scores(user_id, candidates)
+                      + (1 - alpha) * self.cbf.score_books(rated_books, candidates))
+            combined_scores = dict(zip(candidates, scores))
         
         # Sort by combined score
-        sorted_books = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)
-        
-        # Get top N recommendations
-        top_recommendations = []
-        for book_id, score in sorted_books[:n_recommendations]:
-            book_info = self.data_loader.get_book_info(book_id)
-            if book_info:
-                top_recommendations.append({
-                    'book_id': book_id,
-                    'title': book_info['title'],
-                    'author': book_info['author'],
-                    'genre': book_info['genre'],
-                    'score': round(score, 3)
-                })
-        
-        return top_recommendations
+        sorted_books = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[:n_recommendations]
+        return [book_id for book_id, _ in sorted_books], [score for _, score in sorted_books]
+    
+    def _pipeline_scores(self, user_id, n_recommendations, alpha):
+        """Hybrid scores for pipeline candidates only"""
+        user_ratings = self.data_loader.get_user_ratings(user_id)
+        history = list(zip(user_ratings['book_id'], user_ratings['rating'])) if user_ratings is not None else []
+        return self.pipeline.recommend(user_id, history, n_recommendations, alpha)
+    
+    def _describe(self, user_id, book_ids, scores):
+        """Block of a user's scored books (title/author/genre are resolved when first read)"""
+        return RecommendationBlock.from_arrays(book_ids, scores, user_id, self.data_loader, decimals=3)
     
     def cold_start_recommendations(self, n_recommendations=5):
         """Recommendations for new users (cold start problem)"""
         # Return popular books based on average rating
-        if self.data_loader.ratings_df is not None:
-            book_ratings = self.data_loader.ratings_df.groupby('book_id')['rating'].agg(['mean', 'count'])
-            book_ratings = book_ratings[book_ratings['count'] >= 5]  # Only books with at least 5 ratings
-            
-            # Sort by rating (weighted by number of ratings)
-            book_ratings['weighted_score'] = book_ratings['mean'] * np.log1p(book_ratings['count'])
-            popular_books = book_ratings.sort_values('weighted_score', ascending=False).head(n_recommendations)
-            
-            recommendations = []
-            for book_id in popular_books.index:
-                book_info = self.data_loader.get_book_info(book_id)
-                if book_info:
-                    recommendations.append({
-                        'book_id': book_id,
-                        'title': book_info['title'],
-                        'author': book_info['author'],
-                        'genre': book_info['genre'],
-                        'avg_rating': round(popular_books.loc[book_id, 'mean'], 2),
-                        'rating_count': int(popular_books.loc[book_id, 'count'])
-                    })
-            
-            return recommendations
-        return []
\ No newline at end of file
+        if self.data_loader.user_mapper is not None:
+            # Pre-sorted by mean * log1p(count) over books with at least 5 ratings
+            aggregates = self.data_loader.get_aggregates()
+            book_ids, means, counts = aggregates.most_popular(n_recommendations)
+            return RecommendationBlock.from_arrays(
+                book_ids, means * np.log1p(counts), data_loader=self.data_loader, decimals=3,
+                avg_rating=np.round(means, 2), rating_count=counts
+            )
+        return RecommendationBlock.from_arrays([], [], data_loader=self.data_loader)
+    
+    def preference_recommendations(self, genres=(), authors=(), decades=(), n_recommendations=5, exclude=()):
+        """Popular books for stated genre/author/decade preferences (Bayesian-average scored)"""
+        popularity = self.data_loader.get_popularity()
+        book_ids, scores = popularity.recommend(genres, authors, decades, n_recommendations, exclude)
+        metadata = ('title', 'author', 'genre') + (('year',) if 'year' in self.data_loader.books_df.columns else ())
+        return RecommendationBlock.from_arrays(book_ids, scores, data_loader=self.data_loader, decimals=3,
+                                               metadata=metadata)
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class IdMapper:
+    """Maps external ids (user_id, book_id) to compact 0-based matrix indices.
+
+    Backed by a sorted array of the known ids, so lookups in either direction
+    are vectorised (np.searchsorted / fancy indexing) and the matrix size
+    tracks the number of entities rather than the largest id.
+    """
+
+    def __init__(self, ids):
+        self.ids = np.unique(np.asarray(ids))
+
+    @classmethod
+    def identity(cls, n, start=1):
+        """Mapper for dense ids start..start+n-1 (the old `id - 1` convention)"""
+        return cls(np.arange(start, start + n))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, external_id):
+        return self.to_index(external_id) >= 0
+
+    def to_index(self, ids):
+        """Indices for the given id(s); unknown ids map to -1"""
+        scalar = np.ndim(ids) == 0
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            idx = np.full(ids.shape, -1, dtype=np.int64)
+        else:
+            idx = np.searchsorted(self.ids, ids)
+            idx = np.minimum(idx, len(self.ids) - 1)
+            idx = np.where(self.ids[idx] == ids, idx, -1).astype(np.int64)
+        return int(idx) if scalar else idx
+
+    def to_id(self, indices):
+        """External id(s) for the given index/indices"""
+        return self.ids[indices]
+
+    def index(self, external_id):
+        """Index of a single id; raises KeyError if it is unknown"""
+        idx = self.to_index(external_id)
+        if idx < 0:
+            raise KeyError(f"Unknown id: {external_id}")
+        return idx
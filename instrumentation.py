@@ -0,0 +1,278 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Global switch; every hook checks this first so the disabled cost is one
+# attribute lookup. Method wrapping only happens in enable().
+_enabled = False
+
+# Methods wrapped by enable(), per "module:Class"
+INSTRUMENTED_METHODS = {
+    "data_loader:DataLoader": [
+        "load_data", "create_user_item_matrix", "get_book_info", "get_user_ratings",
+    ],
+    "collaborative_filtering:CollaborativeFiltering": [
+        "calculate_user_similarity", "calculate_item_similarity",
+        "user_based_recommendations", "item_based_recommendations",
+        "matrix_factorization", "mf_recommendations",
+    ],
+    "content_based:ContentBasedFiltering": [
+        "prepare_features", "build_features", "add_books",
+        "get_similar_books", "recommend_based_on_history",
+    ],
+    "hybrid_recommender:HybridRecommender": [
+        "hybrid_recommendations", "cold_start_recommendations",
+    ],
+    "pipeline:RecommendationPipeline": ["recommend"],
+}
+
+
+# =========================
+# Metrics registry
+# =========================
+class MetricsRegistry:
+    """Thread-safe in-process store of per-stage timings, counters and traces"""
+
+    def __init__(self, max_traces=50):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.cache = {}
+        self.traces = deque(maxlen=max_traces)
+
+    def observe(self, stage, seconds, allocated_bytes=0):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {
+                    "calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "allocated_bytes": 0,
+                }
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["allocated_bytes"] += allocated_bytes
+
+    def record_cache(self, name, hit):
+        with self._lock:
+            stats = self.cache.setdefault(name, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+
+    def add_trace(self, trace):
+        with self._lock:
+            self.traces.append(trace)
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.cache.clear()
+            self.traces.clear()
+
+    def snapshot(self):
+        """Copy of the current counters, safe to read from another thread"""
+        with self._lock:
+            return {
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "cache": {k: dict(v) for k, v in self.cache.items()},
+                "traces": [t.to_dict() for t in self.traces],
+            }
+
+    def to_prometheus(self, prefix="kitab"):
+        """Render the counters in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_calls_total Number of calls per instrumented method.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        for stage, s in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {s["calls"]}')
+
+        lines += [
+            f"# HELP {prefix}_stage_seconds Wall time spent per instrumented method.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, s in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {s["total_seconds"]:.9f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {s["calls"]}')
+
+        lines += [
+            f"# HELP {prefix}_allocated_bytes_total Bytes of arrays returned per method.",
+            f"# TYPE {prefix}_allocated_bytes_total counter",
+        ]
+        for stage, s in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_allocated_bytes_total{{stage="{stage}"}} {s["allocated_bytes"]}')
+
+        lines += [
+            f"# HELP {prefix}_cache_requests_total Lazy model cache lookups.",
+            f"# TYPE {prefix}_cache_requests_total counter",
+        ]
+        for name, c in sorted(snap["cache"].items()):
+            lines.append(f'{prefix}_cache_requests_total{{cache="{name}",result="hit"}} {c["hits"]}')
+            lines.append(f'{prefix}_cache_requests_total{{cache="{name}",result="miss"}} {c["misses"]}')
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# =========================
+# Per-request traces
+# =========================
+class RequestTrace:
+    """Ordered list of the instrumented stages run while handling one request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.depth = 0
+        self.duration = None
+
+    def add_span(self, stage, start, seconds, depth, allocated_bytes):
+        self.spans.append({
+            "stage": stage,
+            "offset_ms": (start - self.started) * 1000,
+            "ms": seconds * 1000,
+            "depth": depth,
+            "allocated_bytes": allocated_bytes,
+        })
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": None if self.duration is None else self.duration * 1000,
+            "spans": list(self.spans),
+        }
+
+
+_current_trace = contextvars.ContextVar("kitab_current_trace", default=None)
+
+
+def current_trace():
+    """The trace of the request running in this context, if any"""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_request(name, registry=None):
+    """Group every instrumented call made inside the block into one trace"""
+    trace = RequestTrace(name)
+    token = _current_trace.set(trace)
+    t0 = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - t0
+        _current_trace.reset(token)
+        if _enabled:
+            (registry or REGISTRY).add_trace(trace)
+
+
+# =========================
+# Hooks
+# =========================
+def is_enabled():
+    return _enabled
+
+
+def record_cache(name, hit):
+    """Count a hit/miss on a lazily built model; no-op when disabled"""
+    if _enabled:
+        REGISTRY.record_cache(name, hit)
+
+
+def allocated_bytes(obj):
+    """Approximate size of the arrays/frames in a return value"""
+    if obj is None:
+        return 0
+    if isinstance(obj, (tuple, list)) and obj and not isinstance(obj[0], dict):
+        return sum(allocated_bytes(o) for o in obj[:4])
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if hasattr(obj, "data") and hasattr(obj, "indices") and hasattr(obj, "indptr"):
+        return obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes
+    if hasattr(obj, "memory_usage"):
+        usage = obj.memory_usage(deep=False)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    return 0
+
+
+def instrument(stage, func, registry=None):
+    """Wrap func so each call records wall time, allocation size and a trace span"""
+    registry = registry or REGISTRY
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = _current_trace.get()
+        owns_trace = trace is None
+        if owns_trace:
+            trace = RequestTrace(stage)
+            token = _current_trace.set(trace)
+
+        depth = trace.depth
+        trace.depth += 1
+        start_wall = time.time()
+        t0 = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - t0
+            trace.depth -= 1
+            if owns_trace:
+                _current_trace.reset(token)
+
+        size = allocated_bytes(result)
+        registry.observe(stage, seconds, size)
+        trace.add_span(stage, start_wall, seconds, depth, size)
+        if owns_trace:
+            trace.duration = seconds
+            registry.add_trace(trace)
+        return result
+
+    wrapper.__wrapped_original__ = func
+    return wrapper
+
+
+def _resolve(target):
+    import importlib
+
+    module_name, class_name = target.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def enable(methods=None):
+    """Turn instrumentation on and wrap the recommender classes' methods"""
+    global _enabled
+    for target, names in (methods or INSTRUMENTED_METHODS).items():
+        cls = _resolve(target)
+        for name in names:
+            method = cls.__dict__.get(name)
+            if method is None or hasattr(method, "__wrapped_original__"):
+                continue
+            setattr(cls, name, instrument(f"{cls.__name__}.{name}", method))
+    _enabled = True
+
+
+def disable(methods=None):
+    """Restore the original methods; counters collected so far are kept"""
+    global _enabled
+    _enabled = False
+    for target, names in (methods or INSTRUMENTED_METHODS).items():
+        cls = _resolve(target)
+        for name in names:
+            method = cls.__dict__.get(name)
+            if method is not None and hasattr(method, "__wrapped_original__"):
+                setattr(cls, name, method.__wrapped_original__)
+
+
+def enable_from_env(var="KITAB_INSTRUMENT"):
+    """Enable instrumentation when the environment variable is set to 1"""
+    if os.environ.get(var) == "1":
+        enable()
+    return _enabled
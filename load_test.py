@@ -0,0 +1,477 @@
+"""Concurrent load generator for the recommenders.
+
+Usage:
+    python load_test.py --threads 8 --duration 10
+    python load_test.py --processes 4 --requests 4000 --mix user=1,item=1,mf=2,content=1,hybrid=3,cold=1
+    python load_test.py --synthetic 5000x3000x30 --threads 4 --json load.json
+    python load_test.py serve --port 8765                 # local HTTP stand-in of the service
+    python load_test.py --url http://127.0.0.1:8765 --threads 16
+
+Requests replay a weighted mix of recommendation calls for users drawn from
+a Zipf distribution over users ranked by activity. The report gives
+throughput, HDR-style latency percentiles per call type, and GIL-contention
+indicators: CPU/wall time per request, the process's effective parallelism,
+and the scheduling delay seen by a probe thread that only sleeps.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_MIX = {'user': 1, 'item': 1, 'mf': 2, 'content': 1, 'hybrid': 3, 'cold': 1}
+N_RECOMMENDATIONS = 10
+
+
+# =========================
+# Latency histogram
+# =========================
+class LatencyHistogram:
+    """Log-linear histogram of microsecond latencies (HDR-style).
+
+    Values below 2**sub_bits are counted exactly; above that every power of
+    two is split into 2**(sub_bits - 1) buckets, so any recorded value is
+    reported within 1 / 2**(sub_bits - 1) of itself. Histograms from
+    different threads or processes merge by adding counts.
+    """
+
+    def __init__(self, sub_bits=7, max_us=3600 * 1e6):
+        self.sub_bits = sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self.counts = np.zeros(self._index(int(max_us)) + 1, dtype=np.int64)
+        self.total = 0
+        self.sum_us = 0.0
+        self.min_us = None
+        self.max_us = 0
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return (2 * self._half) + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _upper(self, index):
+        """Largest value counted in bucket index"""
+        if index < 2 * self._half:
+            return index
+        shift = (index - 2 * self._half) // self._half + 1
+        mantissa = (index - 2 * self._half) % self._half + self._half
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = max(1, int(seconds * 1e6))
+        self.counts[min(self._index(value), len(self.counts) - 1)] += 1
+        self.total += 1
+        self.sum_us += value
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, q):
+        """Latency (µs) at or below which q percent of the values fall"""
+        if self.total == 0:
+            return None
+        rank = max(1, int(np.ceil(q / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._upper(index), self.max_us)
+
+    @property
+    def mean_us(self):
+        return self.sum_us / self.total if self.total else None
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        result = {'count': self.total, 'mean_us': self.mean_us, 'min_us': self.min_us, 'max_us': self.max_us}
+        for q in percentiles:
+            result[f'p{q:g}_us'] = self.percentile(q)
+        return result
+
+    def buckets(self):
+        """(upper bound µs, count) of every non-empty bucket, for plotting"""
+        return [(self._upper(i), int(self.counts[i])) for i in np.flatnonzero(self.counts)]
+
+
+# =========================
+# Workload
+# =========================
+def parse_mix(text):
+    """'user=1,mf=2' -> {'user': 1.0, 'mf': 2.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown call type: {name} (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def zipf_users(loader, n, exponent=1.1, rng=None):
+    """n user ids drawn with P(rank r) ~ 1 / r**exponent, most active users first"""
+    rng = rng or np.random.default_rng()
+    activity = np.diff(loader.user_item_matrix.tocsr().indptr)
+    ranked = loader.user_mapper.ids[np.argsort(-activity, kind='stable')]
+    weights = 1.0 / np.arange(1, len(ranked) + 1) ** exponent
+    return ranked[rng.choice(len(ranked), n, p=weights / weights.sum())]
+
+
+def build_schedule(loader, n_requests, mix, exponent=1.1, seed=0):
+    """(call types, user ids) for n_requests requests"""
+    rng = np.random.default_rng(seed)
+    names = list(mix)
+    weights = np.array([mix[name] for name in names], dtype=np.float64)
+    kinds = np.array(names)[rng.choice(len(names), n_requests, p=weights / weights.sum())]
+    return kinds, zipf_users(loader, n_requests, exponent, rng)
+
+
+def call_model(models, kind, user_id, n=N_RECOMMENDATIONS):
+    """One recommendation call on a ModelSnapshot; returns the recommended book ids"""
+    if kind == 'user':
+        return models.cf.user_based_recommendations(user_id, n)[0]
+    if kind == 'item':
+        return models.cf.item_based_recommendations(user_id, n)[0]
+    if kind == 'mf':
+        return models.cf.mf_recommendations(user_id, n)[0]
+    if kind == 'content':
+        ratings = models.data_loader.get_user_ratings(user_id)
+        history = list(zip(ratings['book_id'], ratings['rating']))
+        return models.cbf.recommend_based_on_history(history, n)[0]
+    if kind == 'hybrid':
+        return models.hybrid.hybrid_recommendations(user_id, n).book_ids
+    if kind == 'cold':
+        return models.hybrid.cold_start_recommendations(n).book_ids
+    raise ValueError(f"Unknown call type: {kind}")
+
+
+class HTTPTarget:
+    """Issues calls against the HTTP stand-in, one keep-alive connection per thread"""
+
+    def __init__(self, url):
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._local = threading.local()
+
+    def __call__(self, kind, user_id, n=N_RECOMMENDATIONS):
+        import http.client
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request('GET', f'/recommend?kind={kind}&user_id={int(user_id)}&n={n}')
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {body[:200].decode(errors='replace')}")
+        return json.loads(body)['book_ids']
+
+
+# =========================
+# GIL contention probe
+# =========================
+class SchedulingProbe:
+    """Thread that sleeps interval seconds at a time and records how late it wakes.
+
+    A thread that needs nothing but the GIL to wake up is delayed by every
+    thread holding it, so its lateness approximates GIL wait time.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.histogram = LatencyHistogram()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gil-probe", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            time.sleep(self.interval)
+            self.histogram.record(max(0.0, time.perf_counter() - t0 - self.interval))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.histogram
+
+
+# =========================
+# Running load
+# =========================
+def run_worker(target, kinds, users, deadline=None):
+    """Replay a schedule (cycling until deadline if one is given).
+
+    Returns per-kind {histogram, errors, cpu_seconds} measured with this
+    thread's own CPU clock.
+    """
+    stats = {kind: {'histogram': LatencyHistogram(), 'errors': 0, 'cpu_seconds': 0.0} for kind in set(kinds)}
+    i = 0
+    while True:
+        if deadline is None:
+            if i >= len(kinds):
+                break
+        elif time.perf_counter() >= deadline:
+            break
+        kind, user_id = kinds[i % len(kinds)], users[i % len(users)]
+        entry = stats[kind]
+        cpu0, t0 = time.thread_time(), time.perf_counter()
+        try:
+            target(kind, user_id)
+        except Exception:
+            entry['errors'] += 1
+        entry['histogram'].record(time.perf_counter() - t0)
+        entry['cpu_seconds'] += time.thread_time() - cpu0
+        i += 1
+    return stats
+
+
+def _cpu_seconds():
+    """CPU time of this process plus its reaped children (worker processes)"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def merge_stats(parts):
+    merged = {}
+    for part in parts:
+        for kind, entry in part.items():
+            into = merged.setdefault(kind, {'histogram': LatencyHistogram(), 'errors': 0, 'cpu_seconds': 0.0})
+            into['histogram'].merge(entry['histogram'])
+            into['errors'] += entry['errors']
+            into['cpu_seconds'] += entry['cpu_seconds']
+    return merged
+
+
+_MODELS = None  # set in the parent before forking, or by _init_process
+
+
+def _init_process(source):
+    global _MODELS
+    if _MODELS is None:
+        _MODELS = load_models(source)
+
+
+def _process_worker(kinds, users, duration, url):
+    target = HTTPTarget(url) if url else (lambda kind, user_id: call_model(_MODELS, kind, user_id))
+    deadline = time.perf_counter() + duration if duration else None
+    return run_worker(target, kinds, users, deadline)
+
+
+def load_models(source):
+    """Fitted ModelSnapshot from ('csv', books, ratings) or ('synthetic', users, books, per_user)"""
+    from scheduler import build_models
+    if source[0] == 'synthetic':
+        from benchmark import synthetic_loader
+        loader = synthetic_loader(*source[1:])
+    else:
+        from data_loader import DataLoader
+        loader = DataLoader()
+        if not loader.load_data(source[1], source[2]):
+            raise SystemExit(1)
+    return build_models(loader)
+
+
+def run_load(models, mix=None, n_threads=4, n_processes=0, n_requests=2000, duration=None,
+             zipf_exponent=1.1, seed=0, url=None, source=None, warmup=50):
+    """Run the load test and return the report dict.
+
+    models supplies the users to draw from (and serves in-process calls);
+    with url the calls go to the HTTP stand-in instead. n_processes > 0
+    runs that many single-threaded worker processes instead of threads.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    import multiprocessing
+
+    global _MODELS
+    mix = mix or DEFAULT_MIX
+    n_workers = n_processes or n_threads
+    target = HTTPTarget(url) if url else (lambda kind, user_id: call_model(models, kind, user_id))
+
+    # Warm lazy state (connections, caches) outside the measurement
+    warm_kinds, warm_users = build_schedule(models.data_loader, warmup, mix, zipf_exponent, seed + 10_000)
+    run_worker(target, warm_kinds, warm_users)
+
+    per_worker = max(1, n_requests // n_workers)
+    schedules = [build_schedule(models.data_loader, per_worker, mix, zipf_exponent, seed + w)
+                 for w in range(n_workers)]
+
+    probe = SchedulingProbe().start()
+    cpu0, t0 = _cpu_seconds(), time.perf_counter()
+    if n_processes:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        _MODELS = models  # inherited by forked workers; spawned ones rebuild from source
+        with ProcessPoolExecutor(n_processes, mp_context=context, initializer=_init_process,
+                                 initargs=(source,)) as pool:
+            parts = list(pool.map(_process_worker, *zip(*schedules), [duration] * n_workers,
+                                  [url] * n_workers))
+        _MODELS = None
+    else:
+        deadline = t0 + duration if duration else None
+        with ThreadPoolExecutor(n_threads, thread_name_prefix="load") as pool:
+            futures = [pool.submit(run_worker, target, kinds, users, deadline) for kinds, users in schedules]
+            parts = [future.result() for future in futures]
+    elapsed = time.perf_counter() - t0
+    process_cpu = _cpu_seconds() - cpu0
+    probe_histogram = probe.stop()
+
+    stats = merge_stats(parts)
+    overall = merge_stats([{'all': entry} for entry in stats.values()])['all']
+    calls = {}
+    for kind, entry in sorted(stats.items()):
+        histogram = entry['histogram']
+        calls[kind] = dict(histogram.summary(), errors=entry['errors'],
+                           requests_per_second=histogram.total / elapsed,
+                           cpu_per_wall=entry['cpu_seconds'] / (histogram.sum_us / 1e6) if histogram.total else None)
+
+    return {
+        'mode': f"{n_processes} processes" if n_processes else f"{n_threads} threads",
+        'target': url or 'in-process',
+        'mix': mix,
+        'zipf_exponent': zipf_exponent,
+        'elapsed_seconds': elapsed,
+        'requests': overall['histogram'].total,
+        'errors': overall['errors'],
+        'requests_per_second': overall['histogram'].total / elapsed,
+        'latency': overall['histogram'].summary(),
+        'calls': calls,
+        'gil': {
+            # Busy-thread CPU over wall time, near 1.0 when requests never wait
+            'cpu_per_wall': overall['cpu_seconds'] / max(1e-9, overall['histogram'].sum_us / 1e6),
+            # CPU of this process (and its workers) over wall time; with threads the GIL
+            # caps pure-Python work near 1.0
+            'effective_parallelism': process_cpu / elapsed,
+            'probe_delay': probe_histogram.summary(),
+            'switch_interval_ms': sys.getswitchinterval() * 1000,
+        },
+        'histogram': overall['histogram'].buckets(),
+    }
+
+
+def print_report(report):
+    print(f"{report['requests']} requests ({report['errors']} errors) in {report['elapsed_seconds']:.2f} s "
+          f"from {report['mode']} against {report['target']}: {report['requests_per_second']:.1f} req/s")
+    print(f"{'call':<8} {'count':>7} {'req/s':>8} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} "
+          f"{'p99 ms':>7} {'p99.9 ms':>9} {'max ms':>7} {'cpu/wall':>8} {'errors':>6}")
+    rows = list(report['calls'].items()) + [('all', dict(report['latency'], errors=report['errors'],
+                                                         requests_per_second=report['requests_per_second'],
+                                                         cpu_per_wall=report['gil']['cpu_per_wall']))]
+    for kind, res in rows:
+        cpu_per_wall = f"{res['cpu_per_wall']:>8.2f}" if res['cpu_per_wall'] is not None else f"{'-':>8}"
+        print(f"{kind:<8} {res['count']:>7} {res['requests_per_second']:>8.1f} {res['mean_us'] / 1e3:>8.2f} "
+              f"{res['p50_us'] / 1e3:>7.2f} {res['p90_us'] / 1e3:>7.2f} {res['p99_us'] / 1e3:>7.2f} "
+              f"{res['p99.9_us'] / 1e3:>9.2f} {res['max_us'] / 1e3:>7.2f} {cpu_per_wall} {res['errors']:>6}")
+
+    gil = report['gil']
+    probe = gil['probe_delay']
+    print(f"GIL: cpu/wall {gil['cpu_per_wall']:.2f}, effective parallelism {gil['effective_parallelism']:.2f}, "
+          f"probe wake-up delay p50 {probe['p50_us'] / 1e3:.2f} ms / p99 {probe['p99_us'] / 1e3:.2f} ms "
+          f"(switch interval {gil['switch_interval_ms']:.0f} ms)")
+
+
+# =========================
+# HTTP stand-in
+# =========================
+def serve(models, host='127.0.0.1', port=8765):
+    """Serve GET /recommend?kind=..&user_id=..&n=.. and GET /health from a thread per connection"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, as the load generator expects
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/health':
+                return self._send(200, {'status': 'ok'})
+            if url.path != '/recommend':
+                return self._send(404, {'error': 'not found'})
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                book_ids = call_model(models, query.get('kind', 'hybrid'), int(query['user_id']),
+                                      int(query.get('n', N_RECOMMENDATIONS)))
+            except Exception as e:
+                return self._send(400, {'error': f"{type(e).__name__}: {e}"})
+            self._send(200, {'book_ids': [int(b) for b in book_ids]})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', nargs='?', choices=['run', 'serve'], default='run')
+    parser.add_argument('--books', default='data/books.csv')
+    parser.add_argument('--ratings', default='data/ratings.csv')
+    parser.add_argument('--synthetic', help='USERSxBOOKSxRATINGS_PER_USER synthetic data instead of the CSVs')
+    parser.add_argument('--mix', type=parse_mix, default=None, help='e.g. user=1,item=1,mf=2,content=1,hybrid=3,cold=1')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=0, help='Worker processes instead of threads')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--duration', type=float, help='Run for this many seconds instead of --requests')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of the user distribution')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='Send calls to the HTTP stand-in at this URL')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--json', help='Write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        source = ('synthetic',) + tuple(int(part) for part in args.synthetic.lower().split('x'))
+    else:
+        source = ('csv', args.books, args.ratings)
+    models = load_models(source)
+
+    if args.command == 'serve':
+        server = serve(models, args.host, args.port)
+        print(f"Serving recommendations on http://{args.host}:{args.port}/recommend (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    report = run_load(models, args.mix, n_threads=args.threads, n_processes=args.processes,
+                      n_requests=args.requests, duration=args.duration, zipf_exponent=args.zipf,
+                      seed=args.seed, url=args.url, source=source)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=float)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,315 @@
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import instrumentation
+from similarity import BlockedSimilarity, l2_normalize_rows
+
+
+# Below this catalog size scoring every book is cheap enough that the
+# single-stage hybrid is used
+PIPELINE_MIN_BOOKS = 5000
+
+
+# =========================
+# Candidate generators
+# =========================
+class CandidateGenerator:
+    """Base class: produce up to n book ids worth scoring for a user.
+
+    history is the user's (book_id, rating) pairs, oldest first.
+    """
+
+    name = "candidates"
+
+    def generate(self, user_id, history, n):
+        raise NotImplementedError
+
+
+class FactorCandidates(CandidateGenerator):
+    """Books with the largest MF prediction, searched over the low-rank item factors.
+
+    This costs O(n_items * n_factors) per user and never builds a dense
+    user x item prediction matrix.
+    """
+
+    name = "mf_factors"
+
+    def __init__(self, cf):
+        self.cf = cf
+
+    def generate(self, user_id, history, n):
+        if self.cf.user_factors is None:
+            self.cf.matrix_factorization()
+        if user_id not in self.cf.user_mapper:
+            return np.zeros(0, dtype=np.int64)
+
+        scores = self.cf.predict_user(self.cf.user_mapper.index(user_id))
+        # Over-fetch so enough survive once the user's rated books are dropped
+        k = min(n + len(history), len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return self.cf.item_mapper.to_id(top)
+
+
+class ItemNeighbourCandidates(CandidateGenerator):
+    """Nearest items (rating-vector cosine) of the user's most recently rated books.
+
+    Keeps its own top-k neighbour table, built once in row blocks, so it never
+    needs the full item-item similarity matrix.
+    """
+
+    name = "item_neighbours"
+
+    def __init__(self, cf, n_recent=10, per_item=20, block_size=1024):
+        self.cf = cf
+        self.n_recent = n_recent
+        self.per_item = per_item
+        self.block_size = block_size
+        self.neighbours = None
+
+    def _build(self):
+        matrix = self.cf.user_item_matrix
+        matrix = matrix.T if hasattr(matrix, "tocsr") else matrix.values.T
+        # One extra neighbour per row since every item is its own best match
+        builder = BlockedSimilarity(block_size=self.block_size, top_k=self.per_item + 1)
+        self.neighbours = builder.compute(matrix)
+
+    def generate(self, user_id, history, n):
+        if self.neighbours is None:
+            self._build()
+        recent = [book_id for book_id, _ in history[-self.n_recent:]]
+        item_idx = self.cf.item_mapper.to_index(np.asarray(recent))
+        item_idx = item_idx[item_idx >= 0][::-1]  # most recent first
+        if len(item_idx) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        rows = self.neighbours[item_idx]
+        # Pool the rows' neighbours, most similar first, keeping first occurrences
+        order = np.argsort(-rows.data, kind='stable')
+        candidates = rows.indices[order]
+        _, first = np.unique(candidates, return_index=True)
+        candidates = candidates[np.sort(first)][:n]
+        return self.cf.item_mapper.to_id(candidates)
+
+
+class GenrePopularityCandidates(CandidateGenerator):
+    """Most popular books in the genres the user rates most"""
+
+    name = "genre_popularity"
+
+    def __init__(self, data_loader, n_genres=3):
+        self.data_loader = data_loader
+        self.n_genres = n_genres
+
+    def generate(self, user_id, history, n):
+        popularity = self.data_loader.get_popularity()
+        book_ids = [book_id for book_id, _ in history]
+        if not book_ids:
+            return popularity.recommend(n=n)[0]
+
+        genres = self.data_loader.get_book_values(book_ids, 'genre')
+        names, counts = np.unique(genres, return_counts=True)
+        favourite = names[np.argsort(-counts, kind='stable')][:self.n_genres]
+        return popularity.recommend(genres=list(favourite), n=n)[0]
+
+
+class ContentANNCandidates(CandidateGenerator):
+    """Approximate nearest neighbours of the user's content profile (random-hyperplane LSH).
+
+    Each of n_tables hash tables buckets books by the signs of n_bits sparse
+    random projections of their unit-length feature vectors. A query probes
+    one bucket per table, and books found in more tables rank first.
+    """
+
+    name = "content_ann"
+
+    def __init__(self, cbf, n_bits=8, n_tables=6, seed=0):
+        self.cbf = cbf
+        self.n_bits = n_bits
+        self.n_tables = n_tables
+        self.seed = seed
+        self._indexed = None
+
+    def _build(self):
+        features = self.cbf.feature_vectors
+        n_dims = features.shape[1]
+        rng = np.random.default_rng(self.seed)
+        # Sparse +-1 projections keep the hyperplanes small for hashed feature spaces
+        density = min(1.0, 3.0 / np.sqrt(n_dims))
+        self.planes = sparse.random(
+            n_dims, self.n_bits * self.n_tables, density=density, random_state=rng,
+            data_rvs=lambda k: rng.choice([-1.0, 1.0], size=k), format="csc",
+        )
+        self.keys = self._hash(l2_normalize_rows(features))
+
+        # Per table: book indices sorted by bucket key, so a bucket is a slice
+        self.order = np.argsort(self.keys, axis=0, kind='stable')
+        self.sorted_keys = np.take_along_axis(self.keys, self.order, axis=0)
+        self._indexed = features
+
+    def _hash(self, vectors):
+        projected = np.asarray((vectors @ self.planes).todense() if sparse.issparse(vectors)
+                               else vectors @ self.planes)
+        bits = (projected > 0).reshape(len(projected), self.n_tables, self.n_bits)
+        return bits @ (1 << np.arange(self.n_bits))
+
+    def generate(self, user_id, history, n):
+        if self.cbf.feature_vectors is None:
+            self.cbf._ensure_features()
+        if self._indexed is not self.cbf.feature_vectors:
+            self._build()
+        profile, _ = self.cbf._user_profile(history)
+        if not profile.any():
+            return np.zeros(0, dtype=np.int64)
+
+        query = self._hash(sparse.csr_matrix(profile))[0]
+        hits = []
+        for table, key in enumerate(query):
+            lo, hi = np.searchsorted(self.sorted_keys[:, table], [key, key + 1])
+            hits.append(self.order[lo:hi, table])
+        books, votes = np.unique(np.concatenate(hits), return_counts=True)
+        books = books[np.argsort(-votes, kind='stable')][:n]
+        return self.cbf.book_mapper.to_id(books)
+
+
+class CooccurrenceCandidates(CandidateGenerator):
+    """Books liked together with the user's most recent likes, from a streaming CooccurrenceEngine.
+
+    Reflects ratings as soon as they are consumed, without a retrain.
+    """
+
+    name = "cooccurrence"
+
+    def __init__(self, engine, n_recent=10):
+        self.engine = engine
+        self.n_recent = n_recent
+
+    def generate(self, user_id, history, n):
+        liked = [book_id for book_id, rating in history if rating >= self.engine.min_rating]
+        recent = liked[-self.n_recent:][::-1]  # most recent first
+        return self.engine.candidates(recent, n, exclude=[book_id for book_id, _ in history])
+
+
+# =========================
+# Re-ranker
+# =========================
+class HybridReranker:
+    """alpha * MF prediction + (1 - alpha) * content-profile similarity, for candidates only"""
+
+    name = "rerank"
+
+    def __init__(self, cf, cbf):
+        self.cf = cf
+        self.cbf = cbf
+
+    def score(self, user_id, history, book_ids, alpha=0.5):
+        scores = np.zeros(len(book_ids))
+        if alpha > 0:
+            scores += alpha * self.cf.mf_scores(user_id, book_ids)
+        if alpha < 1 and history:
+            scores += (1 - alpha) * self.cbf.score_books(history, book_ids)
+        return scores
+
+
+# =========================
+# Pipeline
+# =========================
+class RecommendationPipeline:
+    """Candidate generation followed by re-ranking.
+
+    Generators run in order and their candidates are merged (first seen wins)
+    up to max_candidates. budgets maps a stage name (a generator's name,
+    'candidates' for the whole generation stage, or 'rerank') to a latency
+    budget in milliseconds. Once the candidate stage is over budget the
+    remaining generators are skipped; overruns are listed in last_run, the
+    report of the calling thread's latest recommend().
+    """
+
+    def __init__(self, generators, reranker, max_candidates=300, per_generator=None, budgets=None):
+        self.generators = list(generators)
+        self.reranker = reranker
+        self.max_candidates = max_candidates
+        # By default every generator gets an equal share of the candidate pool
+        self.per_generator = per_generator or max(1, max_candidates // max(1, len(self.generators)))
+        self.budgets = dict(budgets or {})
+        # One run report per thread, so concurrent callers never share one
+        self._local = threading.local()
+
+    @property
+    def last_run(self):
+        return getattr(self._local, "run", {})
+
+    @staticmethod
+    def _new_run():
+        return {"stages": {}, "over_budget": [], "skipped": []}
+
+    def _run_stage(self, run, stage, func, *args):
+        """Call func, recording its time in the run report and, when enabled, the metrics registry"""
+        if instrumentation.is_enabled():
+            func = instrumentation.instrument(f"pipeline.{stage}", func)
+        t0 = time.perf_counter()
+        result = func(*args)
+        ms = (time.perf_counter() - t0) * 1000
+        run["stages"][stage] = ms
+        budget = self.budgets.get(stage)
+        if budget is not None and ms > budget:
+            run["over_budget"].append(stage)
+        return result
+
+    def candidates(self, user_id, history, run=None):
+        """Merged candidate book ids, excluding books the user already rated"""
+        run = run if run is not None else self._new_run()
+        rated = {book_id for book_id, _ in history}
+        seen, merged = set(), []
+        t0 = time.perf_counter()
+        budget = self.budgets.get("candidates")
+
+        for generator in self.generators:
+            if budget is not None and (time.perf_counter() - t0) * 1000 > budget:
+                run["skipped"].append(generator.name)
+                continue
+            book_ids = self._run_stage(run, generator.name, generator.generate, user_id, history, self.per_generator)
+            for book_id in book_ids:
+                if book_id not in seen and book_id not in rated:
+                    seen.add(book_id)
+                    merged.append(book_id)
+            if len(merged) >= self.max_candidates:
+                break
+
+        ms = (time.perf_counter() - t0) * 1000
+        run["stages"]["candidates"] = ms
+        if budget is not None and ms > budget:
+            run["over_budget"].append("candidates")
+        return np.asarray(merged[:self.max_candidates])
+
+    def recommend(self, user_id, history, n_recommendations=5, alpha=0.5):
+        """Top (book_ids, scores) for a user; history is (book_id, rating) pairs, oldest first"""
+        history = list(history)
+        run = self._local.run = self._new_run()
+        candidates = self.candidates(user_id, history, run)
+        run["n_candidates"] = len(candidates)
+        if len(candidates) == 0:
+            return candidates, np.zeros(0)
+
+        scores = self._run_stage(run, "rerank", self.reranker.score, user_id, history, candidates, alpha)
+        top = np.argsort(-scores, kind='stable')[:n_recommendations]
+        return candidates[top], scores[top]
+
+
+def build_default_pipeline(cf, cbf, data_loader, cooccurrence=None, **kwargs):
+    """MF factors, item neighbours, genre popularity and content ANN feeding the hybrid re-ranker.
+
+    With a CooccurrenceEngine its "readers also liked" candidates come right after the MF ones.
+    """
+    generators = [
+        FactorCandidates(cf),
+        ItemNeighbourCandidates(cf),
+        GenrePopularityCandidates(data_loader),
+        ContentANNCandidates(cbf),
+    ]
+    if cooccurrence is not None:
+        generators.insert(1, CooccurrenceCandidates(cooccurrence))
+    return RecommendationPipeline(generators, HybridReranker(cf, cbf), **kwargs)
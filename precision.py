@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+
+# =========================
+# Quantised neighbour scores
+# =========================
+class QuantizedMatrix:
+    """int8 copy of a dense or CSR score matrix with one float32 scale per row.
+
+    Indexing (m[i], m[rows, cols]) returns dequantised float32 values, so it can
+    stand in for the similarity matrices used by the recommenders.
+    """
+
+    def __init__(self, matrix):
+        self.is_sparse = sparse.issparse(matrix)
+        if self.is_sparse:
+            matrix = matrix.tocsr()
+            absmax = np.asarray(abs(matrix).max(axis=1).todense()).ravel()
+        else:
+            matrix = np.asarray(matrix)
+            absmax = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(matrix.shape[0])
+
+        self.scale = (absmax / 127.0).astype(np.float32)
+        self.scale[self.scale == 0] = 1.0
+
+        if self.is_sparse:
+            row_scale = np.repeat(self.scale, np.diff(matrix.indptr))
+            self.values = sparse.csr_matrix(
+                (np.round(matrix.data / row_scale).astype(np.int8), matrix.indices, matrix.indptr),
+                shape=matrix.shape
+            )
+        else:
+            self.values = np.round(matrix / self.scale[:, None]).astype(np.int8)
+        self.shape = matrix.shape
+        self.dtype = np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        if self.is_sparse:
+            v = self.values
+            return v.data.nbytes + v.indices.nbytes + v.indptr.nbytes + self.scale.nbytes
+        return self.values.nbytes + self.scale.nbytes
+
+    def __getitem__(self, key):
+        rows = key[0] if isinstance(key, tuple) else key
+        block = self.values[key]
+        scale = self.scale[rows]
+        if np.ndim(scale):
+            scale = scale[:, None]
+        if self.is_sparse:
+            return sparse.csr_matrix(block.astype(np.float32).multiply(scale))
+        return block.astype(np.float32) * scale
+
+    def toarray(self):
+        full = self[:]
+        return full.toarray() if self.is_sparse else full
+
+
+# =========================
+# Precision policy
+# =========================
+class PrecisionPolicy:
+    """dtypes used to store ratings, latent factors/features and similarities"""
+
+    def __init__(self, ratings=np.float64, factors=np.float64, similarity=np.float64,
+                 quantize_neighbours=False):
+        self.ratings = np.dtype(ratings)
+        self.factors = np.dtype(factors)
+        self.similarity = np.dtype(similarity)
+        self.quantize_neighbours = quantize_neighbours
+
+    @classmethod
+    def full(cls):
+        """float64 everywhere (previous behaviour)"""
+        return cls()
+
+    @classmethod
+    def compact(cls):
+        """int8 ratings, float32 factors/features and similarities"""
+        return cls(ratings=np.int8, factors=np.float32, similarity=np.float32)
+
+    @classmethod
+    def quantized(cls):
+        """compact() plus int8 neighbour scores with a per-row scale"""
+        return cls(ratings=np.int8, factors=np.float32, similarity=np.float32,
+                   quantize_neighbours=True)
+
+    @classmethod
+    def from_name(cls, name):
+        presets = {'full': cls.full, 'compact': cls.compact, 'quantized': cls.quantized}
+        if name not in presets:
+            raise ValueError(f"Unknown precision policy: {name}")
+        return presets[name]()
+
+    @classmethod
+    def from_env(cls, var="KITAB_PRECISION", default="full"):
+        """Policy named by an environment variable (full, compact or quantized)"""
+        return cls.from_name(os.environ.get(var, default))
+
+    def __repr__(self):
+        return (f"PrecisionPolicy(ratings={self.ratings}, factors={self.factors}, "
+                f"similarity={self.similarity}, quantize_neighbours={self.quantize_neighbours})")
+
+    def cast_ratings(self, matrix):
+        """Cast a rating matrix; integer dtypes are only used for whole-number ratings"""
+        dtype = self.ratings
+        values = matrix.data if sparse.issparse(matrix) else np.asarray(matrix)
+        if np.issubdtype(dtype, np.integer) and not np.array_equal(values, np.round(values)):
+            dtype = np.dtype(np.float32)
+        return matrix.astype(dtype, copy=False)
+
+    def cast_factors(self, matrix):
+        return matrix.astype(self.factors, copy=False)
+
+    def store_similarity(self, matrix):
+        """Apply the similarity dtype and optional int8 quantisation"""
+        if isinstance(matrix, np.memmap):
+            return matrix
+        if matrix.dtype != self.similarity:
+            matrix = matrix.astype(self.similarity)
+        if self.quantize_neighbours:
+            return QuantizedMatrix(matrix)
+        return matrix
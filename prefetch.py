@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# CF kinds are computed for CF_PREFETCH_N recommendations and smaller requests take
+# a prefix; the hybrid's candidate pool depends on n, so it is cached per n
+CF_PREFETCH_N = 10
+CF_KINDS = ("user", "item", "mf")
+
+
+class RecommendationPrefetcher:
+    """Computes a user's recommendations in a thread pool before they are asked for.
+
+    prefetch() submits user-based, item-based and MF CF plus the hybrid for
+    one user on one model snapshot; get() returns the finished result (or
+    waits for it). Futures live in an LRU cache of max_entries keyed by
+    (model version, user, kind) -- plus n and alpha for the hybrid -- so a
+    retrained model never serves stale results. Prefetching a different
+    user cancels the queued work for the previous one; work already
+    running finishes and stays cached.
+    """
+
+    def __init__(self, max_workers=2, max_entries=64):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_user = None
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def _compute(snapshot, user_id, kind, n_recommendations, alpha):
+        cf = snapshot.cf
+        if kind == "user":
+            return cf.user_based_recommendations(user_id, n_recommendations)
+        if kind == "item":
+            return cf.item_based_recommendations(user_id, n_recommendations)
+        if kind == "mf":
+            return cf.mf_recommendations(user_id, n_recommendations)
+        return snapshot.hybrid.hybrid_recommendations(user_id, n_recommendations=n_recommendations, alpha=alpha)
+
+    def _submit_locked(self, snapshot, user_id, kind, n_recommendations=CF_PREFETCH_N, alpha=None):
+        params = (n_recommendations, alpha) if kind == "hybrid" else None
+        key = (snapshot.version, user_id, kind, params)
+        future = self._futures.get(key)
+        if future is not None and not future.cancelled():
+            self._futures.move_to_end(key)
+            return future, True
+        future = self._executor.submit(self._compute, snapshot, user_id, kind, n_recommendations, alpha)
+        self._futures[key] = future
+        while len(self._futures) > self.max_entries:
+            _, evicted = self._futures.popitem(last=False)
+            evicted.cancel()
+        return future, False
+
+    def _cancel_stale_locked(self, user_id):
+        for key in [key for key in self._futures if key[1] != user_id]:
+            if self._futures[key].cancel():
+                del self._futures[key]
+                self.cancelled += 1
+
+    def prefetch(self, snapshot, user_id, n_hybrid=5, alpha=0.5):
+        """Start every CF kind and the hybrid for user_id (a no-op for work already cached)"""
+        with self._lock:
+            if user_id != self._current_user:
+                self._cancel_stale_locked(user_id)
+                self._current_user = user_id
+            for kind in CF_KINDS:
+                self._submit_locked(snapshot, user_id, kind)
+            self._submit_locked(snapshot, user_id, "hybrid", n_hybrid, alpha)
+
+    def get(self, snapshot, user_id, kind, n_recommendations, alpha=0.5, timeout=None):
+        """Recommendations of one kind, computing them now if they were not prefetched.
+
+        CF kinds return (book_ids, scores), the hybrid a list of dicts.
+        Errors raised while computing are raised here.
+        """
+        if kind != "hybrid" and n_recommendations > CF_PREFETCH_N:
+            # Longer than the cached lists: compute in this thread, uncached
+            return self._compute(snapshot, user_id, kind, n_recommendations, None)
+        with self._lock:
+            if kind == "hybrid":
+                future, cached = self._submit_locked(snapshot, user_id, kind, n_recommendations, alpha)
+            else:
+                future, cached = self._submit_locked(snapshot, user_id, kind)
+            if cached and future.done():
+                self.hits += 1
+            else:
+                self.misses += 1
+        result = future.result(timeout)
+        if kind == "hybrid":
+            return result
+        book_ids, scores = result
+        return book_ids[:n_recommendations], scores[:n_recommendations]
+
+    def status(self):
+        with self._lock:
+            return {
+                'entries': len(self._futures),
+                'pending': sum(not future.done() for future in self._futures.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'cancelled': self.cancelled,
+            }
+
+    def shutdown(self):
+        """Cancel queued work and stop the pool (running tasks finish in the background)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+
+class TablePreview:
+    """Server-side paging, sorting and equality filtering over a DataFrame.
+
+    Sort orders and value groups are built lazily, once per column, and kept
+    for the life of the preview (one per data version). An unfiltered page is
+    a slice of a precomputed order; a filtered page looks its rows up in the
+    groups and only sorts the rows up to the end of the page. Only the
+    requested columns of the page rows are copied out.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._orders = {}
+        self._ranks = {}
+        self._groups = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def columns(self):
+        return list(self.frame.columns)
+
+    # =========================
+    # Indexes
+    # =========================
+    def _order(self, column):
+        """Row positions sorted by column (stable, missing values last)"""
+        if column not in self._orders:
+            values = self.frame[column].reset_index(drop=True)
+            self._orders[column] = values.sort_values(kind='stable', na_position='last').index.to_numpy()
+        return self._orders[column]
+
+    def _rank(self, column):
+        """Position of every row in _order(column)"""
+        if column not in self._ranks:
+            order = self._order(column)
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            self._ranks[column] = rank
+        return self._ranks[column]
+
+    def _group_rows(self, column, value):
+        """Sorted row positions where column == value"""
+        if column not in self._groups:
+            codes, uniques = pd.factorize(self.frame[column])
+            order = np.argsort(codes, kind='stable')
+            starts = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self._groups[column] = (pd.Index(uniques), order, starts)
+        uniques, order, starts = self._groups[column]
+        code = uniques.get_indexer([value])[0]
+        if code < 0:
+            return order[:0]
+        return order[starts[code]:starts[code + 1]]
+
+    def values(self, column):
+        """Distinct values of column, sorted (for filter pickers)"""
+        self._group_rows(column, None)
+        return sorted(self._groups[column][0])
+
+    # =========================
+    # Paging
+    # =========================
+    def page(self, offset=0, limit=50, columns=None, sort_by=None, ascending=True, filters=None):
+        """(total matching rows, frame of rows offset..offset+limit) with only the given columns.
+
+        filters maps column -> value (rows must match all of them).
+        """
+        columns = self.columns if columns is None else list(columns)
+        offset, limit = max(0, int(offset)), max(0, int(limit))
+        filters = {column: value for column, value in (filters or {}).items() if value is not None}
+
+        if not filters:
+            total = len(self.frame)
+            if sort_by is None:
+                rows = np.arange(offset, min(offset + limit, total))
+            elif ascending:
+                rows = self._order(sort_by)[offset:offset + limit]
+            else:
+                rows = self._order(sort_by)[::-1][offset:offset + limit]
+        else:
+            rows = None
+            for column, value in filters.items():
+                matches = self._group_rows(column, value)
+                rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+            total = len(rows)
+            if sort_by is not None:
+                keys = self._rank(sort_by)[rows]
+                if not ascending:
+                    keys = -keys
+                end = offset + limit
+                if end < total:
+                    # Only the first `end` rows need ordering
+                    head = np.argpartition(keys, end - 1)[:end] if end > 0 else keys[:0]
+                    rows = rows[head[np.argsort(keys[head], kind='stable')]]
+                else:
+                    rows = rows[np.argsort(keys, kind='stable')]
+            rows = rows[offset:offset + limit]
+
+        positions = [self.frame.columns.get_loc(column) for column in columns]
+        return total, self.frame.iloc[rows, positions].reset_index(drop=True)
@@ -0,0 +1,196 @@
+import numpy as np
+
+# One row per recommended book; a block holds the rows of one or more users
+RESULT_DTYPE = np.dtype([('user_id', '<i8'), ('book_id', '<i8'), ('score', '<f8')])
+
+
+class Recommendation:
+    """Read-only view of one row of a RecommendationBlock.
+
+    Supports the dict-style access of the old per-item dicts (rec['title'],
+    rec.get('genre')); metadata comes from the block's resolved columns.
+    """
+
+    __slots__ = ('block', 'row')
+
+    def __init__(self, block, row):
+        self.block = block
+        self.row = row
+
+    def __getitem__(self, key):
+        value = self.block.column(key)[self.row]
+        return value.item() if hasattr(value, 'item') else value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.block.columns
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, Recommendation):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Recommendation({self.to_dict()!r})"
+
+
+class RecommendationBlock:
+    """Recommendations for one or more users in a single structured array.
+
+    Rows are (user_id, book_id, score), grouped by user in the order the
+    users were given; offsets[i]:offsets[i + 1] are the rows of the i-th
+    user. Extra per-row values (e.g. a cold start's rating counts) are
+    kept as arrays, and catalog columns (title, author, ...) are looked up
+    for all rows at once the first time they are read. Iterating yields
+    Recommendation views, so callers written against lists of dicts keep
+    working without a dict per item.
+    """
+
+    __slots__ = ('records', 'offsets', 'data_loader', 'metadata', 'extra', '_resolved')
+
+    def __init__(self, records, offsets=None, data_loader=None, metadata=('title', 'author', 'genre'), extra=None):
+        self.records = records
+        self.offsets = np.array([0, len(records)]) if offsets is None else np.asarray(offsets)
+        self.data_loader = data_loader
+        self.metadata = tuple(metadata)
+        self.extra = dict(extra or {})
+        self._resolved = {}
+
+    @classmethod
+    def from_arrays(cls, book_ids, scores, user_id=-1, data_loader=None, decimals=None,
+                    metadata=('title', 'author', 'genre'), **extra):
+        """Block for one user; with a data_loader, books missing from its catalog are dropped"""
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        extra = {name: np.asarray(values) for name, values in extra.items()}
+        if data_loader is not None and len(book_ids):
+            known = data_loader.book_mapper.to_index(book_ids) >= 0
+            if not known.all():
+                book_ids, scores = book_ids[known], scores[known]
+                extra = {name: values[known] for name, values in extra.items()}
+        records = np.empty(len(book_ids), dtype=RESULT_DTYPE)
+        records['user_id'] = user_id
+        records['book_id'] = book_ids
+        records['score'] = scores if decimals is None else np.round(scores, decimals)
+        return cls(records, data_loader=data_loader, metadata=metadata, extra=extra)
+
+    @classmethod
+    def concat(cls, blocks, data_loader=None):
+        """One block with the rows of several (per-user) blocks, in order"""
+        blocks = list(blocks)
+        if not blocks:
+            return cls(np.empty(0, dtype=RESULT_DTYPE), data_loader=data_loader)
+        first = blocks[0]
+        sizes = [len(block) for block in blocks]
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        extra = {name: np.concatenate([block.extra[name] for block in blocks]) for name in first.extra}
+        return cls(np.concatenate([block.records for block in blocks]), offsets,
+                   data_loader if data_loader is not None else first.data_loader, first.metadata, extra)
+
+    # =========================
+    # Columns
+    # =========================
+    @property
+    def book_ids(self):
+        return self.records['book_id']
+
+    @property
+    def scores(self):
+        return self.records['score']
+
+    @property
+    def user_ids(self):
+        return self.records['user_id']
+
+    @property
+    def nbytes(self):
+        """Bytes held in the block's arrays (records, offsets, extra and resolved columns)"""
+        arrays = [self.records, self.offsets, *self.extra.values(), *self._resolved.values()]
+        return int(sum(np.asarray(array).nbytes for array in arrays))
+
+    @property
+    def columns(self):
+        books_df = self.data_loader.books_df if self.data_loader is not None else None
+        metadata = [name for name in self.metadata if books_df is not None and name in books_df.columns]
+        return ['book_id'] + metadata + ['score'] + list(self.extra)
+
+    def column(self, name):
+        """Values of one column for every row (catalog columns are resolved once, vectorised)"""
+        if name in RESULT_DTYPE.names:
+            return self.records[name]
+        if name in self.extra:
+            return self.extra[name]
+        if name not in self._resolved:
+            books_df = self.data_loader.books_df if self.data_loader is not None else None
+            if books_df is None or name not in books_df.columns:
+                raise KeyError(name)
+            self._resolved[name] = self.data_loader.get_book_values(self.book_ids, name)
+        return self._resolved[name]
+
+    # =========================
+    # Sequence protocol
+    # =========================
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return (Recommendation(self, row) for row in range(len(self.records)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Recommendation(self, index)
+
+    def take(self, rows):
+        """Block of the given rows (as one user's list)"""
+        block = RecommendationBlock(self.records[rows], data_loader=self.data_loader, metadata=self.metadata,
+                                    extra={name: values[rows] for name, values in self.extra.items()})
+        block._resolved = {name: values[rows] for name, values in self._resolved.items()}
+        return block
+
+    def __eq__(self, other):
+        if isinstance(other, RecommendationBlock):
+            return np.array_equal(self.records, other.records) and self.to_dicts() == other.to_dicts()
+        if isinstance(other, list):
+            return len(self) == len(other) and all(rec == item for rec, item in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"RecommendationBlock({len(self)} rows, {self.n_users} users)"
+
+    # =========================
+    # Per-user access and export
+    # =========================
+    @property
+    def n_users(self):
+        return len(self.offsets) - 1
+
+    def for_user(self, i):
+        """Block of the i-th user's rows"""
+        return self.take(np.arange(self.offsets[i], self.offsets[i + 1]))
+
+    def to_frame(self, columns=None):
+        """DataFrame of the given columns (default: all) for every row"""
+        import pandas as pd
+        columns = self.columns if columns is None else list(columns)
+        if self.n_users > 1 and 'user_id' not in columns:
+            columns = ['user_id'] + columns
+        return pd.DataFrame({name: self.column(name) for name in columns})
+
+    def to_dicts(self):
+        """The old list-of-dicts form (one dict per row)"""
+        return [rec.to_dict() for rec in self]
@@ -1,7 +1,14 @@
+import os
 import pandas as pd
 import numpy as np
 import random
 
+from event_log import DEFAULT_LOG_PATH, base_path_for, compacting_path_for
+from sqlite_loader import DEFAULT_DB_PATH
+
+# Content features cached by the apps (app.CONTENT_FEATURES_PATH); fitted on the old books
+CONTENT_FEATURES_PATH = os.path.join('artifacts', 'content_features.npz')
+
 def generate_sample_data():
     # Generate sample books data
     books_data = {
@@ -32,6 +39,14 @@ def generate_sample_data():
     books_df.to_csv('data/books.csv', index=False)
     ratings_df.to_csv('data/ratings.csv', index=False)
     
+    # New sample data starts a new rating history
+    stale = [DEFAULT_LOG_PATH, base_path_for(DEFAULT_LOG_PATH), compacting_path_for(DEFAULT_LOG_PATH)]
+    stale += [DEFAULT_DB_PATH + suffix for suffix in ('', '-wal', '-shm')]
+    stale.append(CONTENT_FEATURES_PATH)
+    for path in stale:
+        if os.path.exists(path):
+            os.remove(path)
+    
     print(f"Generated {len(books_df)} books and {len(ratings_df)} ratings")
     print("Sample Books:")
     print(books_df.head())
@@ -0,0 +1,288 @@
+import threading
+import time
+
+import pandas as pd
+
+from collaborative_filtering import CollaborativeFiltering
+from content_based import ContentBasedFiltering
+from hybrid_recommender import HybridRecommender
+from pipeline import build_default_pipeline, PIPELINE_MIN_BOOKS
+
+
+# =========================
+# Model snapshots
+# =========================
+class ModelSnapshot:
+    """A fully built set of models over one data loader.
+
+    Snapshots are never modified after build_models() returns: new ratings go
+    into a new loader and a new snapshot, so readers holding an old snapshot
+    keep a consistent view.
+    """
+
+    def __init__(self, version, data_loader, cf, cbf, hybrid, build_seconds=0.0):
+        self.version = version
+        self.data_loader = data_loader
+        self.cf = cf
+        self.cbf = cbf
+        self.hybrid = hybrid
+        self.build_seconds = build_seconds
+        self.built_at = time.time()
+
+
+class ModelHandle:
+    """Versioned reference to the snapshot currently being served.
+
+    Readers call get() once per request and use that snapshot throughout;
+    swap() replaces it with a single reference assignment, so a request sees
+    either the old or the new models, never a mix.
+    """
+
+    def __init__(self, snapshot=None):
+        self._snapshot = snapshot
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else 0
+
+    def swap(self, snapshot):
+        """Serve snapshot from now on; returns the one it replaces"""
+        with self._lock:
+            previous, self._snapshot = self._snapshot, snapshot
+        return previous
+
+
+def build_models(data_loader, previous=None, precision=None, artifact_path=None, n_factors=15,
+                 cooccurrence=None):
+    """Fit CF/content/hybrid models on data_loader and return them as a ModelSnapshot.
+
+    Everything the request path would otherwise build lazily is built here.
+    With a previous snapshot over the same catalog its content model is
+    reused and the SVD is warm-started from its basis. A streaming
+    CooccurrenceEngine is shared by every snapshot, not rebuilt.
+    """
+    t0 = time.perf_counter()
+    if data_loader.user_item_matrix is None:
+        data_loader.create_user_item_matrix()
+
+    cf = CollaborativeFiltering(
+        data_loader.user_item_matrix,
+        user_mapper=data_loader.user_mapper,
+        item_mapper=data_loader.book_mapper,
+        precision=precision
+    )
+    same_catalog = previous is not None and previous.data_loader.books_df is data_loader.books_df
+    if same_catalog:
+        cbf = previous.cbf
+        cf.warm_start_from(previous.cf)
+    else:
+        cbf = ContentBasedFiltering(
+            data_loader.books_df,
+            artifact_path=artifact_path,
+            book_mapper=data_loader.book_mapper,
+            precision=precision
+        )
+
+    # Large catalogs score a few hundred candidates instead of every book
+    pipeline = None
+    if len(data_loader.books_df) >= PIPELINE_MIN_BOOKS:
+        pipeline = build_default_pipeline(cf, cbf, data_loader, cooccurrence=cooccurrence)
+    hybrid = HybridRecommender(cf, cbf, data_loader, pipeline=pipeline, cooccurrence=cooccurrence)
+
+    cf.matrix_factorization(n_factors)
+    if pipeline is None:
+        cf.calculate_user_similarity()
+        cf.calculate_item_similarity()
+        cbf._ensure_features()
+    elif len(data_loader.user_mapper):
+        # One recommendation builds the generators' neighbour tables and hash index
+        hybrid.hybrid_recommendations(data_loader.user_mapper.ids[0], 1)
+    data_loader.get_search_index()
+    data_loader.get_book_labels()
+    data_loader.get_aggregates()
+    data_loader.get_popularity()
+
+    version = previous.version + 1 if previous is not None else 1
+    return ModelSnapshot(version, data_loader, cf, cbf, hybrid, time.perf_counter() - t0)
+
+
+# =========================
+# Background retraining
+# =========================
+class RetrainScheduler:
+    """Retrains in a background thread and swaps the result into a ModelHandle.
+
+    New ratings are buffered by add_ratings(). A retrain starts once
+    min_new_ratings are pending, every interval_seconds while any are
+    pending, or on request_retrain(). It builds a new loader and snapshot off
+    to the side; the served snapshot only changes at the final swap. If a
+    build fails the old models keep serving and the ratings stay pending.
+
+    Ratings written to the loader's event log by any process count as
+    pending too: each retrain calls refresh_ratings() on the new loader, so
+    events logged elsewhere are picked up without a reload. With an
+    event_log, the log is compacted after a successful retrain once it holds
+    compact_min_records events. With a cooccurrence engine, new
+    ratings are also fed to it straight away, so its "readers also liked"
+    lists do not wait for the retrain.
+    """
+
+    def __init__(self, handle, min_new_ratings=50, interval_seconds=None, precision=None,
+                 artifact_path=None, n_factors=15, event_log=None, compact_min_records=10000,
+                 cooccurrence=None):
+        self.handle = handle
+        self.min_new_ratings = min_new_ratings
+        self.interval_seconds = interval_seconds
+        self.event_log = event_log
+        self.compact_min_records = compact_min_records
+        self.cooccurrence = cooccurrence
+        self.build_options = dict(precision=precision, artifact_path=artifact_path, n_factors=n_factors,
+                                  cooccurrence=cooccurrence)
+
+        self._pending = []
+        self._n_pending = 0
+        self._lock = threading.Lock()        # guards the pending buffer
+        self._build_lock = threading.Lock()  # one retrain at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._force = False
+        self._thread = None
+
+        self.builds = 0
+        self.compactions = 0
+        self.last_build_seconds = None
+        self.last_error = None
+
+    # ----- producers -----
+    def add_ratings(self, new_ratings):
+        """Queue a frame of ratings (user_id, book_id, rating) for the next retrain"""
+        if len(new_ratings) == 0:
+            return self._n_pending
+        if self.cooccurrence is not None:
+            self.cooccurrence.consume(new_ratings)
+        with self._lock:
+            self._pending.append(new_ratings)
+            self._n_pending += len(new_ratings)
+            n_pending = self._n_pending
+        if n_pending >= self.min_new_ratings:
+            self._wake.set()
+        return n_pending
+
+    def request_retrain(self):
+        """Retrain in the background as soon as possible, even with nothing pending"""
+        self._force = True
+        self._wake.set()
+
+    @property
+    def n_pending(self):
+        return self._n_pending
+
+    # ----- retraining -----
+    def retrain(self):
+        """Build a snapshot with the pending ratings and swap it in; returns the new version.
+
+        Runs in the caller's thread (the background loop calls it too).
+        """
+        with self._build_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._n_pending = 0
+                self._force = False
+
+            current = self.handle.get()
+            # Without pending ratings an empty frame will do (the SQLite loader's
+            # ratings_df would read the whole table)
+            new_ratings = (pd.concat(pending, ignore_index=True) if pending
+                           else pd.DataFrame(columns=current.data_loader.rating_columns))
+            t0 = time.perf_counter()
+            try:
+                loader = current.data_loader.with_ratings(new_ratings)
+                loader.refresh_ratings()
+                snapshot = build_models(loader, previous=current, **self.build_options)
+            except Exception as e:
+                # Put the ratings back in front of anything that arrived meanwhile
+                with self._lock:
+                    self._pending = pending + self._pending
+                    self._n_pending += len(new_ratings)
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Retrain failed, still serving version {current.version}: {self.last_error}")
+                return current.version
+
+            self.handle.swap(snapshot)
+            self.builds += 1
+            self.last_build_seconds = time.perf_counter() - t0
+            self.last_error = None
+            if self.event_log is not None and self.event_log.n_records >= self.compact_min_records:
+                self.compact_log()
+            return snapshot.version
+
+    def compact_log(self):
+        """Merge the event log into its base snapshot (failures are recorded, not raised)"""
+        try:
+            self.event_log.compact()
+            self.compactions += 1
+        except Exception as e:
+            self.last_error = f"compaction failed: {type(e).__name__}: {e}"
+            print(self.last_error)
+
+    def _n_logged(self):
+        """Rating-log events the served loader has not read (ours are usually queued as well)"""
+        snapshot = self.handle.get()
+        return snapshot.data_loader.n_unread_ratings() if snapshot is not None else 0
+
+    def _due(self, woken):
+        if self._force:
+            return True
+        n_new = max(self._n_pending, self._n_logged())
+        if n_new >= self.min_new_ratings:
+            return True
+        # Timer tick: retrain whatever has accumulated
+        return not woken and n_new > 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if self._due(woken):
+                self.retrain()
+
+    def start(self):
+        """Start the background thread (a daemon, so it never blocks exit)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="retrain-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the background thread, letting a running build finish"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        snapshot = self.handle.get()
+        return {
+            'version': self.handle.version,
+            'pending_ratings': self._n_pending,
+            'builds': self.builds,
+            'compactions': self.compactions,
+            'running': self.running,
+            'building': self._build_lock.locked(),
+            'last_build_seconds': self.last_build_seconds,
+            'built_at': snapshot.built_at if snapshot is not None else None,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,159 @@
+import bisect
+import re
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = r"\w+"
+_TOKEN_RE = re.compile(TOKEN_PATTERN)
+
+
+def tokenize(text):
+    """Lower-cased word tokens of a search string"""
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def _intersect_sorted(small, large):
+    """Intersection of two sorted unique int arrays in O(len(small) * log(len(large)))"""
+    if len(small) > len(large):
+        small, large = large, small
+    if len(small) == 0 or len(large) == 0:
+        return small[:0]
+    pos = np.searchsorted(large, small)
+    pos[pos == len(large)] = len(large) - 1
+    return small[large[pos] == small]
+
+
+class BookSearchIndex:
+    """Token-level inverted index over title/author with genre facets.
+
+    Books are numbered by their rank in descending catalog rating, and every
+    posting list is a sorted array of ranks. Results therefore come out
+    rating-sorted for free, a minimum rating is a prefix of the rank space,
+    and paging is a slice.
+    """
+
+    def __init__(self, books_df, prefix_cache_size=256):
+        n_books = len(books_df)
+        if 'rating' in books_df.columns:
+            rating = books_df['rating'].to_numpy(dtype=np.float64)
+        else:
+            rating = np.zeros(n_books)
+
+        # rank -> books_df row, and ratings in rank order (descending)
+        self.order = np.argsort(-rating, kind='stable')
+        self.sorted_ratings = rating[self.order]
+        self._ascending_key = -self.sorted_ratings  # for searchsorted on the rating cut-off
+        rank_of_row = np.empty(n_books, dtype=np.int64)
+        rank_of_row[self.order] = np.arange(n_books)
+
+        self._build_postings(books_df, rank_of_row)
+        self._build_facets(books_df, rank_of_row)
+        
+        # Typeahead re-issues the same short prefixes on every keystroke
+        self._prefix_cache = OrderedDict()
+        self._prefix_cache_size = prefix_cache_size
+
+    def __len__(self):
+        return len(self.order)
+
+    def _build_postings(self, books_df, rank_of_row):
+        text = pd.Series('', index=range(len(books_df)), dtype=object)
+        for column in ('title', 'author'):
+            if column in books_df.columns:
+                text = text + ' ' + books_df[column].fillna('').astype(str).to_numpy()
+
+        tokens = text.str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+        pairs = pd.DataFrame({'row': tokens.index.to_numpy(), 'token': tokens.to_numpy()})
+        pairs = pairs.drop_duplicates()
+
+        # Token ids in lexicographic order so prefixes map to contiguous ranges
+        codes, uniques = pd.factorize(pairs['token'])
+        sorter = np.argsort(uniques.astype(str))
+        token_id = np.empty(len(uniques), dtype=np.int64)
+        token_id[sorter] = np.arange(len(uniques))
+        token_ids = token_id[codes]
+        ranks = rank_of_row[pairs['row'].to_numpy()]
+
+        by_token = np.lexsort((ranks, token_ids))
+        self.tokens = [str(t) for t in uniques[sorter]]
+        self.postings = ranks[by_token].astype(np.int64)
+        self.postings_ptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(token_ids, minlength=len(uniques)))]
+        )
+
+    def _build_facets(self, books_df, rank_of_row):
+        self.genres = []
+        self.genre_ranks = {}
+        if 'genre' not in books_df.columns:
+            return
+        genre = books_df['genre'].to_numpy()
+        self.genres = [g for g in pd.unique(genre) if pd.notna(g)]
+        ranks_by_row = pd.Series(rank_of_row).groupby(genre, sort=False)
+        for g, ranks in ranks_by_row:
+            self.genre_ranks[g] = np.sort(ranks.to_numpy())
+
+    @property
+    def genre_counts(self):
+        return {g: len(self.genre_ranks[g]) for g in self.genres}
+
+    def _prefix_postings(self, prefix):
+        """Sorted ranks of books with a token starting with prefix"""
+        lo = bisect.bisect_left(self.tokens, prefix)
+        hi = bisect.bisect_left(self.tokens, prefix + '\U0010ffff')
+        if hi - lo == 1:
+            return self.postings[self.postings_ptr[lo]:self.postings_ptr[lo + 1]]
+        if hi == lo:
+            return self.postings[:0]
+        
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            self._prefix_cache.move_to_end(prefix)
+            return cached
+        
+        # Union of several posting lists: a bitmap over ranks beats sorting
+        # once the combined lists are a noticeable share of the catalog
+        merged = self.postings[self.postings_ptr[lo]:self.postings_ptr[hi]]
+        if len(merged) * 32 > len(self.order):
+            seen = np.zeros(len(self.order), dtype=bool)
+            seen[merged] = True
+            result = np.flatnonzero(seen)
+        else:
+            result = np.unique(merged)
+        
+        self._prefix_cache[prefix] = result
+        if len(self._prefix_cache) > self._prefix_cache_size:
+            self._prefix_cache.popitem(last=False)
+        return result
+
+    def search(self, query='', genre=None, min_rating=None, offset=0, limit=30):
+        """Books matching every query term (as a word prefix), genre and minimum rating.
+
+        Returns (total_matches, rows) where rows are books_df positions of the
+        requested page, best-rated first.
+        """
+        ranks = None
+        for term in tokenize(query):
+            postings = self._prefix_postings(term)
+            ranks = postings if ranks is None else _intersect_sorted(ranks, postings)
+            if len(ranks) == 0:
+                return 0, self.order[:0]
+
+        if genre is not None:
+            facet = self.genre_ranks.get(genre, self.postings[:0])
+            ranks = facet if ranks is None else _intersect_sorted(ranks, facet)
+
+        # Ratings are descending in rank order, so the filter is a cut-off rank
+        cutoff = len(self.order)
+        if min_rating is not None:
+            cutoff = int(np.searchsorted(self._ascending_key, -min_rating, side='right'))
+
+        if ranks is None:
+            total = cutoff
+            page = np.arange(offset, min(offset + limit, cutoff))
+        else:
+            ranks = ranks[:np.searchsorted(ranks, cutoff)]
+            total = len(ranks)
+            page = ranks[offset:offset + limit]
+        return total, self.order[page]
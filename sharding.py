@@ -0,0 +1,466 @@
+"""Item-sharded catalog: book-side model state split by book id range across processes.
+
+Usage:
+    python sharding.py build --shards 4 [--out artifacts/shards] [--neighbours 20]
+                             [--synthetic 20000,20000,50]
+
+write_shards() splits the MF item factors, item neighbour lists and content
+feature rows of trained models into per-shard directories of .npy files.
+A ShardedCatalog starts one worker process per shard (or keeps the shards
+in-process); each worker memory-maps only its own shard, computes a local
+top-k for a request, and the coordinator merges the shards' lists with a heap.
+"""
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+
+from similarity import l2_normalize_rows, to_csr, top_k_per_row
+
+DEFAULT_SHARD_DIR = os.path.join("artifacts", "shards")
+MANIFEST = "manifest.json"
+
+
+# =========================
+# Partitioning
+# =========================
+def shard_bounds(book_ids, n_shards):
+    """Lower book id bound of each shard, splitting the ids into ranges of (nearly) equal size.
+
+    Shard i holds ids in [bounds[i], bounds[i + 1]); the last range is open-ended.
+    """
+    book_ids = np.unique(book_ids)
+    n_shards = max(1, min(int(n_shards), len(book_ids)))
+    return book_ids[(np.arange(n_shards) * len(book_ids)) // n_shards]
+
+
+def shard_of(lower_bounds, book_ids):
+    """Shard number of each book id (ids below the first bound go to shard 0)"""
+    return np.maximum(np.searchsorted(lower_bounds, book_ids, side="right") - 1, 0)
+
+
+def _id_range(ids, lower_bounds, i):
+    """[start, stop) of the sorted ids falling in shard i"""
+    start = np.searchsorted(ids, lower_bounds[i]) if i > 0 else 0
+    stop = np.searchsorted(ids, lower_bounds[i + 1]) if i + 1 < len(lower_bounds) else len(ids)
+    return start, stop
+
+
+def write_shards(cf, cbf, directory=DEFAULT_SHARD_DIR, n_shards=4, neighbours=20, block_size=1024):
+    """Write the book-side state of trained models as n_shards book id ranges; returns the manifest.
+
+    Per shard: MF item factors and biases, the top `neighbours` item-item
+    cosine neighbours of every rated book (as in
+    calculate_item_similarity(top_k=neighbours)) and the content feature
+    rows. Neighbour lists are built one block of rows at a time, so the full
+    similarity matrix never exists.
+    """
+    if cf.user_factors is None:
+        cf.matrix_factorization()
+    if cbf.feature_vectors is None:
+        cbf.build_features()  # the content similarity matrix is not needed
+
+    item_ids = cf.item_mapper.ids
+    book_ids = cbf.book_mapper.ids
+    lower_bounds = shard_bounds(np.union1d(item_ids, book_ids), n_shards)
+
+    R = cf.user_item_matrix
+    R = R.tocsr() if hasattr(R, "tocsr") else sparse.csr_matrix(R.values)
+    item_vectors = l2_normalize_rows(R.T).astype(cf.precision.similarity)
+    features = cbf.feature_vectors.tocsr()
+    feature_norms = np.sqrt(np.asarray(to_csr(features).multiply(features).sum(axis=1)).ravel())
+
+    os.makedirs(directory, exist_ok=True)
+    shards = []
+    for i in range(len(lower_bounds)):
+        path = f"shard-{i:03d}"
+        shard_dir = os.path.join(directory, path)
+        os.makedirs(shard_dir, exist_ok=True)
+
+        def save(name, values):
+            np.save(os.path.join(shard_dir, name + ".npy"), np.ascontiguousarray(values))
+
+        start, stop = _id_range(item_ids, lower_bounds, i)
+        k = min(neighbours, len(item_ids))
+        neighbour_idx = np.zeros((stop - start, k), dtype=np.int64)
+        neighbour_sims = np.zeros((stop - start, k), dtype=item_vectors.dtype)
+        for row in range(start, stop, block_size):
+            end = min(row + block_size, stop)
+            block = item_vectors[row:end].dot(item_vectors.T).toarray()
+            neighbour_idx[row - start:end - start], neighbour_sims[row - start:end - start] = top_k_per_row(block, k)
+        save("mf_book_ids", item_ids[start:stop])
+        save("item_factors", cf.item_factors[start:stop])
+        save("item_bias", cf.item_bias[start:stop])
+        # Stored inverted (sorted by neighbour id) so a request reads only
+        # the entries of the books the user rated
+        order = np.argsort(neighbour_idx.ravel(), kind="stable")
+        save("neighbour_ids", item_ids[neighbour_idx.ravel()[order]])
+        save("neighbour_rows", order // max(k, 1))
+        save("neighbour_sims", neighbour_sims.ravel()[order])
+
+        start, stop = _id_range(book_ids, lower_bounds, i)
+        rows = features[start:stop]
+        save("content_book_ids", book_ids[start:stop])
+        save("feature_data", rows.data)
+        save("feature_indices", rows.indices)
+        save("feature_indptr", rows.indptr)
+        save("feature_norms", feature_norms[start:stop])
+        shards.append({'path': path, 'mf_books': int(len(neighbour_idx)), 'content_books': int(stop - start)})
+
+    manifest = {
+        'lower_bounds': lower_bounds.tolist(),
+        'n_features': int(features.shape[1]),
+        'neighbours': int(min(neighbours, len(item_ids))),
+        'shards': shards,
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# =========================
+# Shard (worker side)
+# =========================
+def _top_k(book_ids, scores, k, exclude=None):
+    """Best k (book_ids, scores), highest score first and ties by book id, skipping excluded ids"""
+    candidates = np.arange(len(book_ids))
+    if exclude is not None and len(exclude):
+        candidates = candidates[~np.isin(book_ids, exclude)]
+    values = scores[candidates]
+    if k < len(candidates):
+        # Keep everything tied with the k-th best so the tie-break is exact
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        keep = values >= kth
+        candidates, values = candidates[keep], values[keep]
+    order = np.lexsort((book_ids[candidates], -values))[:k]
+    return np.asarray(book_ids[candidates[order]]), np.asarray(values[order], dtype=np.float64)
+
+
+class ItemShard:
+    """One book id range of the catalog, loaded from its shard directory.
+
+    With mmap (the default) the arrays are memory-mapped, so a worker holds
+    only the pages its requests touch rather than a copy of the shard.
+    Every top_* method returns the shard's local (book_ids, scores), best first.
+    """
+
+    def __init__(self, path, n_features, mmap=True):
+        mode = "r" if mmap else None
+
+        def load(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+
+        self.mf_book_ids = load("mf_book_ids")
+        self.item_factors = load("item_factors")
+        self.item_bias = load("item_bias")
+        self.neighbour_ids = load("neighbour_ids")
+        self.neighbour_rows = load("neighbour_rows")
+        self.neighbour_sims = load("neighbour_sims")
+        self.content_book_ids = load("content_book_ids")
+        self.features = sparse.csr_matrix(
+            (load("feature_data"), load("feature_indices"), load("feature_indptr")),
+            shape=(len(self.content_book_ids), n_features),
+        )
+        norms = np.array(load("feature_norms"), dtype=np.float64)
+        norms[norms == 0] = 1.0
+        self.feature_norms = norms
+
+    def info(self):
+        return {'mf_books': len(self.mf_book_ids), 'content_books': len(self.content_book_ids)}
+
+    def top_mf(self, user_vector, user_bias, exclude, k):
+        """MF predictions (user_vector . item factors + biases) for this shard's books"""
+        scores = self.item_factors @ user_vector + user_bias + self.item_bias
+        return _top_k(self.mf_book_ids, scores, k, exclude)
+
+    def top_item_based(self, rated_ids, ratings, k):
+        """Similarity-weighted mean rating over each book's neighbours the user rated.
+
+        Rated books are also excluded from the result.
+        """
+        n_books = len(self.mf_book_ids)
+        starts = np.searchsorted(self.neighbour_ids, rated_ids, side="left")
+        counts = np.searchsorted(self.neighbour_ids, rated_ids, side="right") - starts
+        # Positions of every (book, rated neighbour) entry, segment by segment
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        entries = np.arange(counts.sum()) + offsets
+        rows = self.neighbour_rows[entries]
+        sims = self.neighbour_sims[entries].astype(np.float64)
+        numerator = np.bincount(rows, sims * np.repeat(ratings, counts), minlength=n_books)
+        denominator = np.bincount(rows, np.abs(sims), minlength=n_books)
+        scores = np.zeros(n_books)
+        np.divide(numerator, denominator, out=scores, where=denominator > 0)
+        return _top_k(self.mf_book_ids, scores, k, rated_ids)
+
+    def profile_part(self, rated_ids, ratings):
+        """Rating-weighted sum of the feature rows of the rated books held here, as (indices, values)"""
+        rows = np.searchsorted(self.content_book_ids, rated_ids)
+        rows = np.minimum(rows, max(len(self.content_book_ids) - 1, 0))
+        known = (self.content_book_ids[rows] == rated_ids) if len(self.content_book_ids) else rated_ids < 0
+        part = np.asarray(self.features[rows[known]].T @ ratings[known]).ravel()
+        indices = np.flatnonzero(part)
+        return indices, part[indices]
+
+    def top_content(self, profile_indices, profile_values, exclude, k):
+        """Cosine similarity of this shard's books to a unit-length profile"""
+        profile = np.zeros(self.features.shape[1])
+        profile[profile_indices] = profile_values
+        scores = np.asarray(self.features @ profile).ravel() / self.feature_norms
+        return _top_k(self.content_book_ids, scores, k, exclude)
+
+
+def _serve_shard(path, n_features, conn):
+    """Worker loop: answer (method, args) messages until None or the pipe closes"""
+    shard = ItemShard(path, n_features)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        method, args = message
+        try:
+            conn.send((True, getattr(shard, method)(*args)))
+        except Exception as exc:
+            conn.send((False, f"{type(exc).__name__}: {exc}"))
+    conn.close()
+
+
+# =========================
+# Coordinator
+# =========================
+def merge_top_k(parts, k):
+    """Merge per-shard (book_ids, scores) lists, each best first, into the overall best k"""
+    streams = [zip((-np.asarray(scores)).tolist(), np.asarray(book_ids).tolist()) for book_ids, scores in parts]
+    top = list(islice(heapq.merge(*streams), k))
+    return (np.array([book_id for _, book_id in top], dtype=np.int64),
+            np.array([-score for score, _ in top], dtype=np.float64))
+
+
+class ShardedCatalog:
+    """Scatter-gather over the shards written by write_shards.
+
+    With processes=True every shard is served by its own subprocess (spawned,
+    so it holds nothing but its shard); a request is sent to all of them
+    before any reply is read, so the shards work in parallel. processes=False
+    keeps the shards in this process, which is handy for debugging. One
+    scatter round runs at a time, so concurrent callers never read each
+    other's replies.
+    """
+
+    def __init__(self, directory=DEFAULT_SHARD_DIR, processes=True):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.lower_bounds = np.array(manifest['lower_bounds'], dtype=np.int64)
+        self.neighbours = manifest['neighbours']
+        self.processes = processes
+        self._lock = threading.Lock()
+        paths = [os.path.join(directory, shard['path']) for shard in manifest['shards']]
+        n_features = manifest['n_features']
+
+        self._shards = []
+        self._workers = []
+        self._conns = []
+        if not processes:
+            self._shards = [ItemShard(path, n_features) for path in paths]
+            return
+        context = multiprocessing.get_context("spawn")
+        for path in paths:
+            parent, child = context.Pipe()
+            worker = context.Process(target=_serve_shard, args=(path, n_features, child), daemon=True)
+            worker.start()
+            child.close()
+            self._workers.append(worker)
+            self._conns.append(parent)
+
+    @property
+    def n_shards(self):
+        return len(self.lower_bounds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop the shard workers"""
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                    conn.close()
+                except (BrokenPipeError, OSError):
+                    pass
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._conns, self._workers = [], []
+
+    def scatter(self, method, args):
+        """Call method on shards and gather the replies.
+
+        args maps shard number -> argument tuple; shards not in it are skipped.
+        Every reply is read before a shard error is raised, so no stale reply
+        is left in a pipe for the next request.
+        """
+        if not self.processes:
+            return {i: getattr(self._shards[i], method)(*shard_args) for i, shard_args in args.items()}
+        with self._lock:
+            sent, errors = [], []
+            for i, shard_args in args.items():
+                try:
+                    self._conns[i].send((method, shard_args))
+                except (BrokenPipeError, OSError) as e:
+                    errors.append(f"shard {i}: {type(e).__name__}: {e}")
+                    break
+                sent.append(i)
+            replies = {}
+            for i in sent:
+                try:
+                    ok, result = self._conns[i].recv()
+                except (EOFError, OSError) as e:
+                    ok, result = False, f"{type(e).__name__}: {e}"
+                if ok:
+                    replies[i] = result
+                else:
+                    errors.append(f"shard {i}: {result}")
+        if errors:
+            raise RuntimeError(f"Shards failed in {method}: {'; '.join(errors)}")
+        return replies
+
+    def _split(self, book_ids, *values):
+        """Per shard: the book ids (and aligned values) in its range"""
+        shards = shard_of(self.lower_bounds, book_ids)
+        return {i: (book_ids[shards == i],) + tuple(v[shards == i] for v in values)
+                for i in range(self.n_shards)}
+
+    def info(self):
+        return self.scatter("info", {i: () for i in range(self.n_shards)})
+
+    # =========================
+    # Requests
+    # =========================
+    def mf(self, user_vector, user_bias, rated_ids, n=5):
+        """Top-n unrated books by MF prediction; returns (book_ids, scores)"""
+        user_vector = np.asarray(user_vector, dtype=np.float64)
+        excluded = self._split(np.asarray(rated_ids, dtype=np.int64))
+        parts = self.scatter("top_mf", {i: (user_vector, float(user_bias), excluded[i][0], n)
+                                        for i in range(self.n_shards)})
+        return merge_top_k(parts.values(), n)
+
+    def item_based(self, rated_ids, ratings, n=5):
+        """Top-n unrated books by item-based CF over the stored neighbour lists"""
+        rated_ids = np.asarray(rated_ids, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        parts = self.scatter("top_item_based", {i: (rated_ids, ratings, n) for i in range(self.n_shards)})
+        return merge_top_k(parts.values(), n)
+
+    def content(self, rated_ids, ratings, n=5):
+        """Top-n unrated books by content similarity to the user's rating-weighted profile.
+
+        Two rounds: the shards holding rated books return their part of the
+        profile, then every shard scores its books against the whole profile.
+        """
+        rated_ids = np.asarray(rated_ids, dtype=np.int64)
+        by_shard = self._split(rated_ids, np.asarray(ratings, dtype=np.float64))
+        parts = self.scatter("profile_part", {i: by_shard[i] for i in range(self.n_shards) if len(by_shard[i][0])})
+        indices = np.concatenate([part[0] for part in parts.values()] + [np.zeros(0, dtype=np.int64)])
+        values = np.concatenate([part[1] for part in parts.values()] + [np.zeros(0)])
+        indices, inverse = np.unique(indices, return_inverse=True)
+        values = np.bincount(inverse, weights=values, minlength=len(indices))
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values = values / norm
+        parts = self.scatter("top_content", {i: (indices, values, by_shard[i][0], n) for i in range(self.n_shards)})
+        return merge_top_k(parts.values(), n)
+
+
+class ShardedRecommender:
+    """MF, item-based and content recommendations served from a ShardedCatalog.
+
+    Only user-side state stays here: the users' MF factors and biases and
+    their ratings. Method names mirror the unsharded models so callers can
+    switch between the two.
+    """
+
+    def __init__(self, catalog, cf):
+        if cf.user_factors is None:
+            cf.matrix_factorization()
+        R = cf.user_item_matrix
+        self.catalog = catalog
+        self.ratings = R.tocsr() if hasattr(R, "tocsr") else sparse.csr_matrix(R.values)
+        self.user_mapper = cf.user_mapper
+        self.item_ids = cf.item_mapper.ids
+        self.user_factors = cf.user_factors
+        self.user_bias = cf.user_bias
+
+    def _rated(self, user_idx):
+        start, stop = self.ratings.indptr[user_idx], self.ratings.indptr[user_idx + 1]
+        return self.item_ids[self.ratings.indices[start:stop]], self.ratings.data[start:stop]
+
+    def mf_recommendations(self, user_id, n_recommendations=5):
+        user_idx = self.user_mapper.index(user_id)
+        rated_ids, _ = self._rated(user_idx)
+        return self.catalog.mf(self.user_factors[user_idx], self.user_bias[user_idx], rated_ids, n_recommendations)
+
+    def item_based_recommendations(self, user_id, n_recommendations=5):
+        rated_ids, ratings = self._rated(self.user_mapper.index(user_id))
+        return self.catalog.item_based(rated_ids, ratings, n_recommendations)
+
+    def recommend_based_on_history(self, rated_books, n_recommendations=5):
+        """rated_books is (book_id, rating) pairs, as for ContentBasedFiltering"""
+        rated_books = list(rated_books)
+        rated_ids = np.array([book_id for book_id, _ in rated_books], dtype=np.int64)
+        ratings = np.array([rating for _, rating in rated_books], dtype=np.float64)
+        return self.catalog.content(rated_ids, ratings, n_recommendations)
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the item-sharded catalog")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--out', default=DEFAULT_SHARD_DIR)
+    parser.add_argument('--neighbours', type=int, default=20)
+    parser.add_argument('--synthetic', help='users,books,ratings_per_user instead of data/*.csv')
+    args = parser.parse_args(argv)
+
+    from collaborative_filtering import CollaborativeFiltering
+    from content_based import ContentBasedFiltering
+
+    if args.synthetic:
+        from benchmark import synthetic_loader
+        loader = synthetic_loader(*[int(value) for value in args.synthetic.split(',')])
+    else:
+        from data_loader import DataLoader
+        loader = DataLoader()
+        if not loader.load_data():
+            print("❌ Could not load data/books.csv and data/ratings.csv")
+            return 1
+        loader.create_user_item_matrix()
+
+    cf = CollaborativeFiltering(loader.user_item_matrix, user_mapper=loader.user_mapper,
+                                item_mapper=loader.book_mapper)
+    cbf = ContentBasedFiltering(loader.books_df, book_mapper=loader.book_mapper)
+    manifest = write_shards(cf, cbf, args.out, args.shards, args.neighbours)
+    for shard in manifest['shards']:
+        print(f"{shard['path']}: {shard['mf_books']} MF books, {shard['content_books']} content books")
+    print(f"✅ Wrote {len(manifest['shards'])} shards to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
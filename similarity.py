@@ -0,0 +1,231 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+
+# =========================
+# Helpers
+# =========================
+def to_csr(matrix):
+    """Convert a pandas frame, dense array or sparse matrix to float CSR"""
+    if hasattr(matrix, "tocsr"):
+        return matrix.tocsr().astype(np.float64)
+    if hasattr(matrix, "values"):
+        matrix = matrix.values
+    return sparse.csr_matrix(np.asarray(matrix, dtype=np.float64))
+
+
+def l2_normalize_rows(matrix):
+    """Return a CSR copy of the matrix with every non-empty row scaled to unit length"""
+    X = to_csr(matrix)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(X).tocsr()
+
+
+def top_k_per_row(block, k):
+    """Indices and values of the k largest entries in each row of a dense block"""
+    k = min(k, block.shape[1])
+    part = np.argpartition(block, -k, axis=1)[:, -k:]
+    values = np.take_along_axis(block, part, axis=1)
+    order = np.argsort(-values, axis=1)
+    return (
+        np.take_along_axis(part, order, axis=1),
+        np.take_along_axis(values, order, axis=1),
+    )
+
+
+# Worker-side state for process pools (set once per worker by the initializer)
+_WORKER_MATRIX = None
+
+
+def _init_worker(normalized):
+    global _WORKER_MATRIX
+    _WORKER_MATRIX = normalized
+
+
+def _compute_block(start, stop, top_k, output_path, shape, normalized=None):
+    """Cosine similarities of rows [start, stop) against every row"""
+    X = normalized if normalized is not None else _WORKER_MATRIX
+    t0 = time.perf_counter()
+    block = X[start:stop].dot(X.T).toarray()
+
+    if output_path is not None:
+        out = np.memmap(output_path, dtype=X.dtype, mode="r+", shape=shape)
+        out[start:stop] = block
+        out.flush()
+        del out
+        payload = None
+    elif top_k is not None:
+        payload = top_k_per_row(block, top_k)
+    else:
+        payload = block
+
+    timing = {"start": start, "stop": stop, "seconds": time.perf_counter() - t0}
+    return start, stop, payload, timing
+
+
+# =========================
+# Blocked similarity builder
+# =========================
+class BlockedSimilarity:
+    """Row-blocked cosine similarity over a sparse matrix.
+
+    The input is L2-normalised once; each block of rows is then multiplied
+    against the whole normalised matrix, optionally on a thread or process
+    pool. The result is either a dense array, a CSR matrix holding only the
+    top-k entries per row, or a memory-mapped file on disk.
+    """
+
+    def __init__(self, block_size=1024, n_workers=1, top_k=None,
+                 executor="thread", output_path=None, dtype=np.float64):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+        if top_k is not None and output_path is not None:
+            raise ValueError("top_k and output_path are mutually exclusive")
+
+        self.block_size = max(1, int(block_size))
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.top_k = top_k
+        self.executor = executor
+        self.output_path = output_path
+        self.dtype = np.dtype(dtype)
+        self.block_timings = []
+
+    def _blocks(self, n_rows):
+        return [(start, min(start + self.block_size, n_rows))
+                for start in range(0, n_rows, self.block_size)]
+
+    def _run(self, normalized, shape):
+        blocks = self._blocks(shape[0])
+        args = (self.top_k, self.output_path, shape)
+
+        if self.n_workers == 1 or len(blocks) == 1:
+            return [_compute_block(start, stop, *args, normalized=normalized)
+                    for start, stop in blocks]
+
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                initializer=_init_worker,
+                initargs=(normalized,),
+            )
+            with pool:
+                futures = [pool.submit(_compute_block, start, stop, *args)
+                           for start, stop in blocks]
+                return [f.result() for f in futures]
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            futures = [pool.submit(_compute_block, start, stop, *args, normalized=normalized)
+                       for start, stop in blocks]
+            return [f.result() for f in futures]
+
+    def compute(self, matrix):
+        """Compute row-by-row cosine similarity of the given matrix"""
+        normalized = l2_normalize_rows(matrix).astype(self.dtype)
+        n_rows = normalized.shape[0]
+        shape = (n_rows, n_rows)
+        self.block_timings = []
+
+        if self.output_path is not None:
+            # Create the file up front so workers can open it in r+ mode
+            np.memmap(self.output_path, dtype=self.dtype, mode="w+", shape=shape).flush()
+            result = None
+        elif self.top_k is not None:
+            k = min(self.top_k, n_rows)
+            indices = np.zeros((n_rows, k), dtype=np.int64)
+            values = np.zeros((n_rows, k), dtype=self.dtype)
+        else:
+            result = np.zeros(shape, dtype=self.dtype)
+
+        for start, stop, payload, timing in self._run(normalized, shape):
+            self.block_timings.append(timing)
+            if self.output_path is not None:
+                continue
+            if self.top_k is not None:
+                indices[start:stop], values[start:stop] = payload
+            else:
+                result[start:stop] = payload
+
+        self.block_timings.sort(key=lambda t: t["start"])
+
+        if self.output_path is not None:
+            return np.memmap(self.output_path, dtype=self.dtype, mode="r", shape=shape)
+        if self.top_k is not None:
+            indptr = np.arange(0, n_rows * k + 1, k)
+            return sparse.csr_matrix(
+                (values.ravel(), indices.ravel(), indptr), shape=shape
+            )
+        return result
+
+    def total_seconds(self):
+        """Sum of per-block compute time"""
+        return sum(t["seconds"] for t in self.block_timings)
+
+
+def blocked_cosine_similarity(matrix, **kwargs):
+    """Convenience wrapper around BlockedSimilarity(**kwargs).compute(matrix)"""
+    return BlockedSimilarity(**kwargs).compute(matrix)
+
+
+# =========================
+# Incrementally grown similarity
+# =========================
+class AppendedSimilarity:
+    """Symmetric similarity matrix grown by column blocks instead of copies.
+
+    base holds the similarities of the first rows (dense, memmap or
+    QuantizedMatrix). Each append stores only the similarities of every
+    row so far against the new ones, an (n + k) x k block, so adding k
+    rows costs O(n * k) rather than O(n^2). Rows stay in the order they
+    were appended; position maps a row index to its stored row so callers
+    can keep their own index order (e.g. sorted book ids).
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.blocks = []
+        self.starts = []
+        self.position = np.arange(base.shape[0])
+        self.dtype = np.dtype(base.dtype)
+
+    @property
+    def shape(self):
+        return (len(self.position), len(self.position))
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes + sum(block.nbytes for block in self.blocks)
+
+    def append(self, block, position):
+        """Add len(block.T) rows; block rows follow the stored order, position is the new index map"""
+        n = len(self.position)
+        if block.shape[0] != n + block.shape[1] or len(position) != block.shape[0]:
+            raise ValueError("block must cover every existing row plus the new ones")
+        self.starts.append(n)
+        self.blocks.append(np.asarray(block, dtype=self.dtype))
+        self.position = np.asarray(position)
+
+    def _stored_row(self, row):
+        out = np.empty(len(self.position), dtype=self.dtype)
+        n_base = self.base.shape[0]
+        if row < n_base:
+            base_row = self.base[row]
+            out[:n_base] = base_row.toarray().ravel() if hasattr(base_row, "toarray") else base_row
+        for start, block in zip(self.starts, self.blocks):
+            stop = start + block.shape[1]
+            if start <= row < stop:
+                # Similarities against earlier rows are this block's column
+                out[:start] = block[:start, row - start]
+            if row < stop:
+                out[start:stop] = block[row]
+        return out
+
+    def __getitem__(self, row):
+        return self._stored_row(self.position[row])[self.position]
+
+    def toarray(self):
+        return np.vstack([self[row] for row in range(len(self.position))])
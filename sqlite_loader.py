@@ -0,0 +1,415 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from data_loader import DataLoader
+from id_mapper import IdMapper
+
+DEFAULT_DB_PATH = os.path.join('data', 'kitab.db')
+
+# SQLite's default limit on host parameters per statement is 999 on older builds
+MAX_PARAMS = 500
+
+
+def _sql_type(dtype):
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _python_rows(frame):
+    """Rows of plain Python values (sqlite3 does not bind numpy scalars)"""
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+
+class SQLiteDataLoader(DataLoader):
+    """DataLoader backed by a local SQLite database instead of in-memory ratings.
+
+    Ratings stay on disk, indexed on user_id and book_id; per-user and
+    per-book lookups are parameterised queries that sqlite3 keeps prepared in
+    each connection's statement cache. Each thread gets its own connection.
+    The catalog is still held as books_df, since content features and search
+    are built from it, and the user-item matrix is built straight from a
+    query without materialising the ratings table.
+
+    ratings_df is a property: reading it runs read_ratings(), which loads the
+    whole table (for code that needs every rating, e.g. aggregates);
+    assigning a frame replaces it. Use rating_columns for the schema.
+
+    With an event log, the read position in the log is kept in the meta
+    table, so every loader over the database shares it; refresh_ratings()
+    applies the events logged since.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._rating_columns = None
+        super().__init__()
+
+    # =========================
+    # Connections
+    # =========================
+    def connection(self):
+        """This thread's connection (opened on first use)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Only this thread queries it; other threads may close() it
+            conn = sqlite3.connect(self.db_path, cached_statements=256, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close every thread's connection"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def _has_table(self, name):
+        row = self.connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    # =========================
+    # Import
+    # =========================
+    def import_csv(self, books_path='data/books.csv', ratings_path='data/ratings.csv',
+                   ratings_df=None, chunk_size=100000):
+        """(Re)create the database from the CSV files, in one transaction per table.
+
+        ratings_df, if given, is imported instead of ratings_path (e.g. the
+        event log's base + tail).
+        """
+        books_df = pd.read_csv(books_path)
+        chunks = [ratings_df] if ratings_df is not None else pd.read_csv(ratings_path, chunksize=chunk_size)
+        self._write_table('books', books_df, primary_key='book_id')
+        self._replace_ratings(chunks)
+
+    def _write_table(self, name, frame, primary_key=None):
+        conn = self.connection()
+        columns = [
+            f'"{column}" {_sql_type(dtype)}' + (' PRIMARY KEY' if column == primary_key else '')
+            for column, dtype in frame.dtypes.items()
+        ]
+        placeholders = ', '.join('?' * len(frame.columns))
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS {name}')
+            conn.execute(f'CREATE TABLE {name} ({", ".join(columns)})')
+            conn.executemany(f'INSERT INTO {name} VALUES ({placeholders})', _python_rows(frame))
+
+    def _replace_ratings(self, chunks):
+        """Recreate the ratings table from an iterable of frames; indexes are built after the load"""
+        conn = self.connection()
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS ratings')
+            columns = None
+            for chunk in chunks:
+                if columns is None:
+                    columns = [c for c in ('user_id', 'book_id', 'rating', 'timestamp') if c in chunk.columns]
+                    types = ', '.join(f'{c} {_sql_type(chunk[c].dtype)}' for c in columns)
+                    conn.execute(f'CREATE TABLE ratings ({types})')
+                conn.executemany(
+                    f'INSERT INTO ratings ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                    _python_rows(chunk[columns])
+                )
+            conn.execute('CREATE INDEX idx_ratings_user ON ratings (user_id)')
+            conn.execute('CREATE INDEX idx_ratings_book ON ratings (book_id)')
+        self._rating_columns = columns
+
+    def _insert_ratings(self, new_ratings):
+        """Append ratings; with timestamps, the latest rating per (user, book) wins.
+
+        Timestamped inserts are idempotent, so replaying logged events that
+        are already in the table changes nothing.
+        """
+        columns = self.rating_columns
+        frame = new_ratings.reindex(columns=columns)
+        values = ", ".join("?" * len(columns))
+        conn = self.connection()
+        with conn:
+            if 'timestamp' not in columns:
+                conn.executemany(f'INSERT INTO ratings ({", ".join(columns)}) VALUES ({values})',
+                                 _python_rows(frame))
+                return
+            rows = list(_python_rows(frame[['user_id', 'book_id', 'timestamp']]))
+            conn.executemany('DELETE FROM ratings WHERE user_id = ? AND book_id = ? AND timestamp <= ?', rows)
+            conn.executemany(
+                f'INSERT INTO ratings ({", ".join(columns)}) SELECT {values} WHERE NOT EXISTS '
+                f'(SELECT 1 FROM ratings WHERE user_id = ? AND book_id = ? AND timestamp > ?)',
+                (row + key for row, key in zip(_python_rows(frame), rows))
+            )
+
+    def _meta_tail(self, log_path):
+        """LogTail at the log position stored in the meta table"""
+        from event_log import LogTail
+
+        conn = self.connection()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+        return LogTail(log_path, meta.get('log_generation'), meta.get('log_offset'))
+
+    def _sync_log(self, ratings_path, log_path):
+        """Apply rating events logged since the last sync (the event log is the write path)"""
+        from event_log import load_ratings
+
+        conn = self.connection()
+        tail = self._meta_tail(log_path)
+        new = tail.read_new()
+        if new is None:
+            # Compacted past our position: replay base + tail (idempotent)
+            new, tail = load_ratings(ratings_path, log_path)
+        if len(new):
+            self._insert_ratings(new)
+        if tail.generation is not None:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                 [('log_generation', tail.generation), ('log_offset', tail.offset)])
+        return len(new)
+
+    @property
+    def rating_columns(self):
+        if self._rating_columns is None:
+            self._rating_columns = [row[1] for row in self.connection().execute('PRAGMA table_info(ratings)')]
+        return self._rating_columns
+
+    # =========================
+    # DataLoader interface
+    # =========================
+    def load_data(self, books_path='data/books.csv', ratings_path='data/ratings.csv', log_path=None):
+        """Open the database, importing the CSVs when it is empty.
+
+        With log_path, events appended to the rating event log since the last
+        load are applied as well.
+        """
+        try:
+            if not (self._has_table('books') and self._has_table('ratings')):
+                ratings_df = None
+                if log_path is not None:
+                    from event_log import load_ratings
+                    ratings_df, _ = load_ratings(ratings_path, log_path)
+                self.import_csv(books_path, ratings_path, ratings_df=ratings_df)
+            if log_path is not None:
+                self._sync_log(ratings_path, log_path)
+            self._ratings_path, self._log_path = ratings_path, log_path
+            self.books_df = pd.read_sql_query('SELECT * FROM books ORDER BY rowid', self.connection())
+            self.build_id_mappers()
+            print(f"Loaded {len(self.books_df)} books and {self.n_ratings} ratings from {self.db_path}")
+            return True
+        except FileNotFoundError as e:
+            print(f"Error loading data: {e}")
+            return False
+
+    def read_ratings(self):
+        """Every rating as a frame: a full table scan, so only for code that needs them all"""
+        if not self._has_table('ratings'):
+            return None
+        columns = ', '.join(self.rating_columns)
+        return pd.read_sql_query(f'SELECT {columns} FROM ratings ORDER BY rowid', self.connection())
+
+    @property
+    def ratings_df(self):
+        return self.read_ratings()
+
+    @ratings_df.setter
+    def ratings_df(self, frame):
+        if frame is not None:
+            self._replace_ratings([frame])
+
+    @property
+    def n_ratings(self):
+        return self.connection().execute('SELECT COUNT(*) FROM ratings').fetchone()[0]
+
+    def _user_ids(self):
+        rows = self.connection().execute('SELECT DISTINCT user_id FROM ratings').fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def build_id_mappers(self):
+        """Build compact id <-> index mappings for users and books"""
+        self.data_version += 1
+        self.book_mapper = IdMapper(self.books_df['book_id'])
+        self.user_mapper = IdMapper(self._user_ids())
+        self._book_rows = np.empty(len(self.book_mapper), dtype=np.int64)
+        self._book_rows[self.book_mapper.to_index(self.books_df['book_id'].to_numpy())] = np.arange(len(self.books_df))
+        return self.user_mapper, self.book_mapper
+
+    def add_ratings(self, new_ratings):
+        """Insert ratings and update the cached aggregates incrementally"""
+        self._insert_ratings(new_ratings)
+        self._popularity = None
+        if self._aggregates is not None and self._aggregates[0] == self.data_version:
+            self.user_mapper = self._aggregates[1].add_ratings(new_ratings).user_mapper
+        else:
+            self.user_mapper = IdMapper(self._user_ids())
+        self._sync_user_item_matrix()
+        return new_ratings
+
+    def with_ratings(self, new_ratings):
+        """A new loader over the same database after inserting new_ratings.
+
+        Unlike the in-memory loader the rows are shared: this loader's
+        per-user lookups see them at once, its matrix and mappers do not.
+        """
+        if len(new_ratings):
+            self._insert_ratings(new_ratings)
+        loader = SQLiteDataLoader(self.db_path)
+        loader.books_df = self.books_df
+        loader.build_id_mappers()
+        loader.data_version = self.data_version
+        loader._search_index = self._search_index
+        loader._book_labels = self._book_labels
+        loader._ratings_path, loader._log_path = self._ratings_path, self._log_path
+        loader.create_user_item_matrix()
+        return loader
+
+    def refresh_ratings(self):
+        """Apply events appended to the rating log since the stored position; returns how many"""
+        if self._log_path is None:
+            return 0
+        n_new = self._sync_log(self._ratings_path, self._log_path)
+        if n_new:
+            self.user_mapper = IdMapper(self._user_ids())
+            self._aggregates = None
+            self._popularity = None
+            self._sync_user_item_matrix()
+        return n_new
+
+    def n_unread_ratings(self):
+        if self._log_path is None:
+            return 0
+        return self._meta_tail(self._log_path).n_unread()
+
+    def create_user_item_matrix(self, chunk_size=100000):
+        """Sparse user-item matrix streamed from the ratings table (duplicate pairs are averaged)"""
+        if self.user_mapper is None:
+            self.build_id_mappers()
+        # Map each chunk to matrix indices right away so only compact arrays are kept
+        n = self.n_ratings
+        rows = np.empty(n, dtype=np.int64)
+        cols = np.empty(n, dtype=np.int64)
+        values = np.empty(n, dtype=np.float64)
+        cursor = self.connection().execute('SELECT user_id, book_id, rating FROM ratings')
+        start = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            chunk = np.array(chunk, dtype=np.float64)
+            end = start + len(chunk)
+            rows[start:end] = self.user_mapper.to_index(chunk[:, 0].astype(np.int64))
+            cols[start:end] = self.book_mapper.to_index(chunk[:, 1].astype(np.int64))
+            values[start:end] = chunk[:, 2]
+            start = end
+
+        known = (rows[:start] >= 0) & (cols[:start] >= 0)
+        rows, cols, values = rows[:start][known], cols[:start][known], values[:start][known]
+        shape = (len(self.user_mapper), len(self.book_mapper))
+        matrix = csr_matrix((values, (rows, cols)), shape=shape)
+        if matrix.nnz < len(values):
+            # Duplicates were summed; divide by how many were summed
+            matrix.data /= csr_matrix((np.ones(len(values)), (rows, cols)), shape=shape).data
+        self.user_item_matrix = matrix
+        return self.user_item_matrix
+
+    def get_book_info(self, book_id):
+        """Get book information by ID (one indexed lookup)"""
+        conn = self.connection()
+        cursor = conn.execute('SELECT * FROM books WHERE book_id = ?', (int(book_id),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def get_books(self, book_ids):
+        """Catalog rows for several book ids, in the order given (unknown ids are skipped)"""
+        book_ids = [int(b) for b in book_ids]
+        frames = []
+        for start in range(0, len(book_ids), MAX_PARAMS):
+            chunk = book_ids[start:start + MAX_PARAMS]
+            frames.append(pd.read_sql_query(
+                f'SELECT * FROM books WHERE book_id IN ({", ".join("?" * len(chunk))})',
+                self.connection(), params=chunk
+            ))
+        if not frames:
+            return self.books_df.iloc[:0]
+        books = pd.concat(frames, ignore_index=True).set_index('book_id', drop=False)
+        return books.reindex([b for b in book_ids if b in books.index]).reset_index(drop=True)
+
+    def get_user_ratings(self, user_id):
+        """Get ratings by a specific user (oldest first)"""
+        columns = ', '.join(self.rating_columns)
+        return pd.read_sql_query(f'SELECT {columns} FROM ratings WHERE user_id = ? ORDER BY rowid',
+                                 self.connection(), params=(int(user_id),))
+
+    def get_ratings_for_users(self, user_ids):
+        """Ratings by any of the given users, oldest first"""
+        user_ids = [int(u) for u in user_ids]
+        columns = ', '.join(self.rating_columns)
+        frames = [
+            pd.read_sql_query(
+                f'SELECT rowid AS _row, {columns} FROM ratings WHERE user_id IN ({", ".join("?" * len(chunk))})',
+                self.connection(), params=chunk
+            )
+            for chunk in (user_ids[i:i + MAX_PARAMS] for i in range(0, len(user_ids), MAX_PARAMS))
+        ]
+        if not frames:
+            return pd.DataFrame(columns=self.rating_columns)
+        ratings = pd.concat(frames, ignore_index=True).sort_values('_row', kind='stable')
+        return ratings.drop(columns='_row').reset_index(drop=True)
+
+    def get_recent_ratings(self, n):
+        """The n most recently inserted ratings, oldest first"""
+        columns = ', '.join(self.rating_columns)
+        ratings = pd.read_sql_query(f'SELECT {columns} FROM ratings ORDER BY rowid DESC LIMIT ?',
+                                    self.connection(), params=(int(n),))
+        return ratings.iloc[::-1].reset_index(drop=True)
+
+    def get_ratings_page(self, offset=0, limit=50, columns=None, sort_by=None, ascending=True, filters=None):
+        """(total, page frame) of the ratings from a LIMIT/OFFSET query.
+
+        user_id and book_id filters and sorts use their indexes; other
+        columns scan the table. Large offsets still step over the skipped rows.
+        """
+        known = self.rating_columns
+        columns = known if columns is None else list(columns)
+        filters = {column: value for column, value in (filters or {}).items() if value is not None}
+        for column in list(columns) + list(filters) + ([sort_by] if sort_by is not None else []):
+            if column not in known:
+                raise KeyError(column)
+
+        where, params = '', []
+        if filters:
+            where = ' WHERE ' + ' AND '.join(f'{column} = ?' for column in filters)
+            params = [value.item() if hasattr(value, 'item') else value for value in filters.values()]
+        direction = 'ASC' if ascending else 'DESC'
+        order = f' ORDER BY {sort_by} {direction}, rowid {direction}' if sort_by is not None else ' ORDER BY rowid'
+
+        conn = self.connection()
+        total = conn.execute(f'SELECT COUNT(*) FROM ratings{where}', params).fetchone()[0]
+        page = pd.read_sql_query(f'SELECT {", ".join(columns)} FROM ratings{where}{order} LIMIT ? OFFSET ?',
+                                 conn, params=params + [max(0, int(limit)), max(0, int(offset))])
+        return total, page
+
+    def get_book_ratings(self, book_id):
+        """Ratings of one book"""
+        columns = ', '.join(self.rating_columns)
+        return pd.read_sql_query(f'SELECT {columns} FROM ratings WHERE book_id = ?',
+                                 self.connection(), params=(int(book_id),))
@@ -0,0 +1,341 @@
+"""Parallel hyperparameter sweep over SVD rank, neighbour count and hybrid alpha.
+
+Usage:
+    python sweep.py --factors 5 10 15 20 --neighbours 10 25 50 --alphas 0.3 0.5 0.7 --workers 4
+    python sweep.py --random 8 --checkpoint sweep.jsonl     # resumes if the file exists for the same run
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from evaluation import (SPLITS, fit_models, ranking_metrics, relevance_keys,
+                        scorable_users, recommend_users)
+
+DEFAULT_SPACE = {
+    'n_factors': [5, 10, 15, 20],
+    'neighbours': [10, 25, 50],
+    'alpha': [0.3, 0.5, 0.7],
+}
+
+# Recommenders each configuration is scored on; quality is their mean metric
+OBJECTIVE_RECOMMENDERS = ('item_based', 'mf', 'hybrid')
+
+
+# =========================
+# Shared training matrix
+# =========================
+class SharedCSR:
+    """A CSR matrix whose arrays live in shared memory blocks.
+
+    The parent copies the matrix in once; workers attach by name and wrap the
+    same buffers in a csr_matrix without copying.
+    """
+
+    PARTS = ('data', 'indices', 'indptr')
+
+    def __init__(self, matrix):
+        self.shape = matrix.shape
+        self.blocks = {}
+        self.spec = {'shape': matrix.shape, 'parts': {}}
+        for part in self.PARTS:
+            array = getattr(matrix, part)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.blocks[part] = block
+            self.spec['parts'][part] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec):
+        """(csr_matrix over the shared buffers, the open blocks to keep alive)"""
+        arrays, blocks = {}, []
+        for part, (name, shape, dtype) in spec['parts'].items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[part] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                            shape=tuple(spec['shape']), copy=False)
+        return matrix, blocks
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+# =========================
+# Trials
+# =========================
+def trial_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def grid(space):
+    """Every combination of the space's values"""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def random_configs(space, n_trials, seed=42):
+    """A seeded sample of n_trials distinct grid points"""
+    configs = grid(space)
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(configs), min(n_trials, len(configs)), replace=False)
+    return [configs[i] for i in sorted(picked)]
+
+
+def data_fingerprint(books_df, ratings_df):
+    """Short hash of the catalog and ratings contents"""
+    digest = hashlib.sha256()
+    for frame in (books_df, ratings_df):
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def run_header(books_df, ratings_df, split, k, seed, max_users, relevance_threshold):
+    """Everything besides the config that a trial's metrics depend on"""
+    return {'split': split, 'k': k, 'seed': seed, 'max_users': max_users,
+            'relevance_threshold': relevance_threshold,
+            'data': data_fingerprint(books_df, ratings_df)}
+
+
+def load_checkpoint(path, header=None):
+    """Completed trials from a JSONL checkpoint, keyed by configuration.
+
+    The first line is a header with the run parameters and data fingerprint;
+    a checkpoint written for a different header (or without one) raises
+    ValueError instead of being resumed. A new checkpoint gets the header
+    written. A partially written last line from an interrupted run is cut off
+    so new records start on a clean line.
+    """
+    done = {}
+    if not path:
+        return done
+    valid_bytes, found = 0, None
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_bytes += len(line)
+                if 'header' in record:
+                    found = record['header']
+                else:
+                    done[trial_key(record['config'])] = record
+        if valid_bytes < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+    if header is not None:
+        if found is None and done:
+            raise ValueError(f"Checkpoint {path} has no run header; delete it or use another checkpoint")
+        if found is not None and found != header:
+            changed = sorted(key for key in set(found) | set(header) if found.get(key) != header.get(key))
+            raise ValueError(f"Checkpoint {path} was written for different {', '.join(changed)}; "
+                             f"delete it or use another checkpoint")
+        if found is None:
+            append_checkpoint(path, [{'header': header}])
+    return done
+
+
+def append_checkpoint(path, records):
+    if not path:
+        return
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, default=float) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# =========================
+# Worker side
+# =========================
+_WORKER = {}
+
+
+def _init_worker(matrix_spec, models, users, relevant_keys, n_relevant, k):
+    matrix, blocks = SharedCSR.attach(matrix_spec)
+    _WORKER.update(matrix=matrix, blocks=blocks, models=models, users=users,
+                   relevant_keys=relevant_keys, n_relevant=n_relevant, k=k)
+
+
+def _run_group(n_factors, neighbours, alphas, state=None):
+    """Fit MF and the neighbour table once, then score every alpha on top of them"""
+    from collaborative_filtering import CollaborativeFiltering
+    from hybrid_recommender import HybridRecommender
+
+    state = state if state is not None else _WORKER
+    base, users, k = state['models'], state['users'], state['k']
+    loader = base['loader']
+
+    t0 = time.perf_counter()
+    cf = CollaborativeFiltering(state['matrix'], loader.user_mapper, loader.book_mapper,
+                                precision=base['precision'])
+    cf.calculate_item_similarity(top_k=neighbours)
+    cf.matrix_factorization(n_factors)
+    fit_seconds = time.perf_counter() - t0
+
+    models = dict(base, cf=cf, hybrid=HybridRecommender(cf, base['cbf'], loader))
+    n_books = len(loader.book_mapper)
+
+    def score(names):
+        recs, seconds = recommend_users(users, names, k, models=models)
+        return {name: dict(ranking_metrics(recs[name], state['relevant_keys'], state['n_relevant'],
+                                           n_books, k),
+                           seconds=seconds[name],
+                           ms_per_user=seconds[name] * 1000 / max(1, len(users)))
+                for name in names}
+
+    shared = score(['item_based', 'mf'])
+    records = []
+    for alpha in alphas:
+        models['alpha'] = alpha
+        metrics = dict(shared, **score(['hybrid']))
+        records.append({
+            'config': {'alpha': alpha, 'n_factors': n_factors, 'neighbours': neighbours},
+            'fit_seconds': fit_seconds,
+            'metrics': metrics,
+        })
+    return records
+
+
+# =========================
+# Sweep
+# =========================
+def summarize(records, k=10, metric='ndcg', tolerance=0.02):
+    """Add quality/cost to each trial and pick the fastest within tolerance of the best.
+
+    quality is the mean metric@k over OBJECTIVE_RECOMMENDERS; cost is fit time
+    plus their per-user recommendation time for the evaluated users.
+    """
+    for record in records:
+        m = record['metrics']
+        record['quality'] = float(np.mean([m[name][f'{metric}@{k}'] or 0.0
+                                           for name in OBJECTIVE_RECOMMENDERS]))
+        record['cost_seconds'] = record['fit_seconds'] + sum(
+            m[name]['seconds'] for name in OBJECTIVE_RECOMMENDERS)
+
+    best = max(records, key=lambda r: r['quality'])
+    floor = best['quality'] * (1 - tolerance)
+    eligible = [r for r in records if r['quality'] >= floor]
+    fastest = min(eligible, key=lambda r: r['cost_seconds'])
+    return {'best': best, 'recommended': fastest, 'tolerance': tolerance, 'trials': records}
+
+
+def run_sweep(books_df, ratings_df, configs, split='leave_k_out', k=10, seed=42, n_workers=1,
+              checkpoint=None, max_users=None, relevance_threshold=4.0, tolerance=0.02):
+    """Evaluate configurations, resuming from and appending to a JSONL checkpoint"""
+    header = run_header(books_df, ratings_df, split, k, seed, max_users, relevance_threshold)
+    done = load_checkpoint(checkpoint, header)
+    pending = [c for c in configs if trial_key(c) not in done]
+
+    # One unit of work per (n_factors, neighbours); alphas reuse its factorization
+    groups = {}
+    for config in pending:
+        groups.setdefault((config['n_factors'], config['neighbours']), []).append(config['alpha'])
+
+    records = [done[trial_key(c)] for c in configs if trial_key(c) in done]
+    if groups:
+        train_df, test_df = SPLITS[split](ratings_df, seed=seed)
+        models = fit_models(books_df, train_df)
+        loader = models['loader']
+        users = scorable_users(test_df, loader.user_mapper, max_users, seed)
+        relevant_keys, n_relevant = relevance_keys(test_df, users, loader.book_mapper,
+                                                   relevance_threshold)
+        print(f"{len(records)} trials from checkpoint, {len(pending)} to run "
+              f"in {len(groups)} factorizations")
+
+        matrix = models['cf'].user_item_matrix
+        # Workers get the matrix through shared memory, not inside the pickled loader
+        worker_models = {'loader': loader, 'cbf': models['cbf'], 'precision': models['cf'].precision}
+        state = (users, relevant_keys, n_relevant, k)
+
+        if n_workers > 1 and len(groups) > 1:
+            shared = SharedCSR(matrix)
+            loader.user_item_matrix = None
+            try:
+                with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                         initargs=(shared.spec, worker_models) + state) as pool:
+                    futures = [pool.submit(_run_group, f, n, alphas) for (f, n), alphas in groups.items()]
+                    for future in as_completed(futures):
+                        group_records = future.result()
+                        append_checkpoint(checkpoint, group_records)
+                        records.extend(group_records)
+            finally:
+                loader.user_item_matrix = matrix
+                shared.close()
+        else:
+            local = dict(zip(('users', 'relevant_keys', 'n_relevant', 'k'), state),
+                         matrix=matrix, models=worker_models)
+            for (f, n), alphas in groups.items():
+                group_records = _run_group(f, n, alphas, state=local)
+                append_checkpoint(checkpoint, group_records)
+                records.extend(group_records)
+
+    return summarize(records, k=k, tolerance=tolerance)
+
+
+def print_summary(summary):
+    print(f"{'n_factors':>9} {'neighbours':>10} {'alpha':>6} {'quality':>8} {'cost s':>8}")
+    for r in sorted(summary['trials'], key=lambda r: -r['quality']):
+        c = r['config']
+        print(f"{c['n_factors']:>9} {c['neighbours']:>10} {c['alpha']:>6} "
+              f"{r['quality']:>8.4f} {r['cost_seconds']:>8.2f}")
+    best, pick = summary['best'], summary['recommended']
+    print(f"Best quality: {best['config']} ({best['quality']:.4f})")
+    print(f"Recommended (fastest within {summary['tolerance']:.0%}): {pick['config']} "
+          f"({pick['quality']:.4f}, {pick['cost_seconds']:.2f} s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', default='data/books.csv')
+    parser.add_argument('--ratings', default='data/ratings.csv')
+    parser.add_argument('--factors', type=int, nargs='+', default=DEFAULT_SPACE['n_factors'])
+    parser.add_argument('--neighbours', type=int, nargs='+', default=DEFAULT_SPACE['neighbours'])
+    parser.add_argument('--alphas', type=float, nargs='+', default=DEFAULT_SPACE['alpha'])
+    parser.add_argument('--random', type=int, help='Sample this many configurations instead of the full grid')
+    parser.add_argument('--split', choices=sorted(SPLITS), default='leave_k_out')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-users', type=int)
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Allowed relative quality loss')
+    parser.add_argument('--checkpoint', default='sweep_checkpoint.jsonl')
+    parser.add_argument('--json', help='Write the summary to this JSON file')
+    args = parser.parse_args(argv)
+
+    space = {'n_factors': args.factors, 'neighbours': args.neighbours, 'alpha': args.alphas}
+    configs = random_configs(space, args.random, args.seed) if args.random else grid(space)
+    try:
+        summary = run_sweep(pd.read_csv(args.books), pd.read_csv(args.ratings), configs,
+                            split=args.split, k=args.k, seed=args.seed, n_workers=args.workers,
+                            checkpoint=args.checkpoint, max_users=args.max_users,
+                            tolerance=args.tolerance)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, default=float)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())